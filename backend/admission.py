@@ -0,0 +1,169 @@
+"""
+Admission control and login throttling.
+
+Expensive routes are grouped into classes (bcrypt-bound auth, fleet-wide
+reads and writes), each with a concurrency limit and a bounded wait queue.
+A request that finds the queue full, or waits longer than the class allows,
+is rejected straight away with 503 and Retry-After instead of queueing behind
+the work the worker is already saturated with. Routes outside every class
+(dashboard polls, /auth/me) are never limited, so their latency stays bounded
+while heavy routes shed load.
+
+TokenBuckets throttles login attempts per key (username, client IP); each key
+refills at a steady rate up to a burst size. Both are per process.
+"""
+import asyncio
+import json
+import math
+import time
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """At most `concurrency` requests at once, `queue_limit` waiting for at most `queue_timeout` seconds"""
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._active = 0
+        self._waiting = 0
+        self._hold_seconds = 0.0    # moving average of how long a request keeps its slot
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0, "max_wait_seconds": 0.0}
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to admit one more request"""
+        backlog = (self._waiting + 1) / self.concurrency
+        return max(1, math.ceil(self._hold_seconds * backlog))
+
+    def _reject(self, stat: str):
+        self._stats[stat] += 1
+        raise AdmissionRejected(self.retry_after())
+
+    async def acquire(self):
+        if self._semaphore.locked() and self._waiting >= self.queue_limit:
+            self._reject("rejected")
+
+        self._waiting += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timed_out")
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - start
+        self._active += 1
+        self._stats["admitted"] += 1
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return time.perf_counter()
+
+    def release(self, acquired_at: float):
+        self._active -= 1
+        self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - acquired_at)
+        self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "queue_timeout": self.queue_timeout,
+            "active": self._active,
+            "waiting": self._waiting,
+            "avg_hold_seconds": round(self._hold_seconds, 4),
+            **self._stats,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that runs each listed (method, path) under its class's limiter"""
+
+    def __init__(self, app, routes: dict):
+        self.app = app
+        self.routes = routes  # (method, path) -> AdmissionLimiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http":
+            limiter = self.routes.get((scope["method"], scope["path"]))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            acquired_at = await limiter.acquire()
+        except AdmissionRejected as e:
+            await send_error(send, 503, "Server busy, please retry", e.retry_after)
+            return
+        try:
+            # Held until the response (including a streamed body) is complete
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(acquired_at)
+
+
+async def send_error(send, status: int, detail: str, retry_after: int):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class TokenBuckets:
+    """Per-key token buckets refilling `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}      # key -> (tokens, last refill time)
+        self._next_purge = 0.0
+        self.throttled = 0
+
+    def take(self, key: str) -> float:
+        """Spend a token for `key`; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        self._purge(now)
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.throttled += 1
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def _purge(self, now: float):
+        # Buckets that have refilled completely carry no state worth keeping
+        if now < self._next_purge and len(self._buckets) < self.max_keys:
+            return
+        full_after = self.burst / self.rate
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < full_after}
+        if len(self._buckets) >= self.max_keys:
+            # Still too many active keys: keep the most recently used half
+            recent = sorted(self._buckets.items(), key=lambda item: item[1][1])[-(self.max_keys // 2):]
+            self._buckets = dict(recent)
+        self._next_purge = now + 60
+
+    def snapshot(self) -> dict:
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "tracked_keys": len(self._buckets),
+            "throttled": self.throttled,
+        }
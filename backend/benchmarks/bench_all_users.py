@@ -0,0 +1,120 @@
+"""
+Benchmark for /deliveries/all-users.
+
+Seeds a scratch database with N drivers/helpers (plus their delivery rows) and
+times the single aggregation used by the endpoint against the old per-user
+loop. Latency of the aggregation should stay flat in round trips as N grows.
+
+Usage (from the backend directory, with MONGO_URL set):
+    python -m benchmarks.bench_all_users --sizes 10 100 1000 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+
+from server import TRUCK_TYPES, COMMISSION_RATES
+from storage.mongo import MongoStorage, client_options_from_env
+
+
+async def seed(database, size: int):
+    """Replace the scratch collections with `size` users and their deliveries"""
+    await database.users.drop()
+    await database.deliveries.drop()
+
+    users = []
+    deliveries = []
+    for i in range(size):
+        user_id = str(uuid.uuid4())
+        users.append({
+            "id": user_id,
+            "username": f"bench_user_{i}",
+            "password": "not-a-real-hash",
+            "role": "driver" if i % 2 == 0 else "helper",
+            "createdAt": "2024-01-01T00:00:00+00:00"
+        })
+        for truck in TRUCK_TYPES:
+            deliveries.append({
+                "id": str(uuid.uuid4()),
+                "userId": user_id,
+                "truck_type": truck,
+                "count": random.randint(0, 50),
+                "updatedAt": "2024-01-01T00:00:00+00:00"
+            })
+
+    await database.users.insert_many(users)
+    await database.deliveries.insert_many(deliveries)
+    await database.deliveries.create_index("userId")
+
+
+async def aggregated(database):
+    pipeline = MongoStorage(database, COMMISSION_RATES, TRUCK_TYPES).all_users_stats_pipeline()
+    return await database.users.aggregate(pipeline).to_list(None)
+
+
+async def per_user_loop(database):
+    """The original N+1 implementation, kept here for comparison"""
+    users = await database.users.find(
+        {"role": {"$in": ["driver", "helper"]}}, {"_id": 0, "password": 0}
+    ).to_list(None)
+
+    results = []
+    for user in users:
+        rows = await database.deliveries.find({"userId": user["id"]}, {"_id": 0}).to_list(None)
+        total_deliveries = 0
+        total_commission = 0.0
+        for row in rows:
+            if row.get("truck_type") in COMMISSION_RATES:
+                total_deliveries += row.get("count", 0)
+                total_commission += row.get("count", 0) * COMMISSION_RATES[row["truck_type"]]
+        results.append((user["id"], total_deliveries, round(total_commission, 2)))
+    return results
+
+
+async def measure(fn, database, repeats: int) -> float:
+    """Median wall time of `fn` in milliseconds"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await fn(database)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--loop-max", type=int, default=1000,
+                        help="Skip the per-user loop above this many users")
+    args = parser.parse_args()
+
+    storage = MongoStorage.from_url(
+        os.environ["MONGO_URL"],
+        os.environ.get("BENCH_DB_NAME", f"{os.environ['DB_NAME']}_bench"),
+        COMMISSION_RATES,
+        TRUCK_TYPES,
+        client_options=client_options_from_env(os.environ)
+    )
+    await storage.open()
+    database = storage.db
+
+    print(f"{'users':>8} {'aggregate ms':>14} {'per-user loop ms':>18}")
+    for size in args.sizes:
+        await seed(database, size)
+        agg_ms = await measure(aggregated, database, args.repeats)
+        loop_ms = "skipped"
+        if size <= args.loop_max:
+            loop_ms = f"{await measure(per_user_loop, database, args.repeats):.1f}"
+        print(f"{size:>8} {agg_ms:>14.1f} {loop_ms:>18}")
+
+    await database.users.drop()
+    await database.deliveries.drop()
+    await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,313 @@
+"""
+Concurrent load test for the FleetTrack API.
+
+Seeds an admin plus a fleet of drivers and helpers, has every one of them log
+in at once (shift start), then runs concurrent clients for a fixed duration
+with a realistic mix of dashboard polls, token checks, admin listings and
+admin edits. Prints throughput and p50/p95/p99 latency per endpoint and saves
+the results as JSON so runs can be compared between commits.
+
+Runs against the ASGI app in-process by default, or against a running server
+with --url. In-process runs use the configured storage backend; set
+STORAGE_BACKEND=memory to leave the database out of the measurement, and a
+low BCRYPT_ROUNDS to keep seeding fast.
+
+Usage (from the backend directory):
+    STORAGE_BACKEND=memory BCRYPT_ROUNDS=4 python -m benchmarks.bench_load --users 200 --duration 30
+    python -m benchmarks.bench_load --url http://localhost:8001 --baseline results/before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+# action -> relative weight in the steady-state mix
+DEFAULT_MIX = {
+    "dashboard_poll": 50,
+    "auth_me": 10,
+    "login": 5,
+    "admin_all_users": 15,
+    "admin_update": 15,
+    "admin_update_batch": 5,
+}
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Recorder:
+    """Latency samples and status codes per endpoint"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    async def request(self, http, endpoint: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.timings[endpoint].append((time.perf_counter() - start) * 1000)
+        self.statuses[endpoint][response.status_code] += 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, timings in sorted(self.timings.items()):
+            endpoints[endpoint] = {
+                "requests": len(timings),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(timings) / elapsed, 1) if elapsed else None,
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p95_ms": round(percentile(timings, 95), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+                "mean_ms": round(statistics.mean(timings), 3),
+                "max_ms": round(max(timings), 3),
+                "statuses": {str(code): count for code, count in sorted(self.statuses[endpoint].items())},
+            }
+        return endpoints
+
+
+class Fleet:
+    """Accounts created for one run, with their tokens and last-seen ETags"""
+
+    def __init__(self, prefix: str, password: str):
+        self.prefix = prefix
+        self.password = password
+        self.admin_headers = None
+        self.truck_types = []
+        self.users = []         # {"id", "username"}
+        self.tokens = {}        # user id -> access token
+        self.etags = {}         # (endpoint, user id) -> ETag
+
+    def headers(self, user_id: str) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+
+async def seed(http, fleet: Fleet, size: int):
+    """Register an admin, then import `size` drivers and helpers in batches"""
+    response = await http.post("/api/auth/register", json={
+        "username": f"{fleet.prefix}admin", "password": fleet.password, "role": "admin"
+    })
+    response.raise_for_status()
+    fleet.admin_headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = await http.get("/api/deliveries/my", headers=fleet.admin_headers)
+    response.raise_for_status()
+    fleet.truck_types = list(response.json()["commission_rates"])
+
+    rows = [
+        {"username": f"{fleet.prefix}user_{i}", "password": fleet.password, "role": "driver" if i % 3 else "helper"}
+        for i in range(size)
+    ]
+    for start in range(0, len(rows), 1000):
+        response = await http.post(
+            "/api/admin/users/import", json=rows[start:start + 1000], headers=fleet.admin_headers, timeout=None
+        )
+        response.raise_for_status()
+        fleet.users.extend(
+            {"id": user["id"], "username": user["username"]} for user in response.json()["users"]
+        )
+
+
+async def login(http, recorder: Recorder, fleet: Fleet, user: dict):
+    response = await recorder.request(http, "POST /auth/login", "POST", "/api/auth/login", json={
+        "username": user["username"], "password": fleet.password
+    })
+    if response is not None and response.status_code == 200:
+        fleet.tokens[user["id"]] = response.json()["token"]
+
+
+async def shift_start(http, recorder: Recorder, fleet: Fleet, concurrency: int):
+    """Every user logs in at once, at most `concurrency` requests in flight"""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(user):
+        async with slots:
+            await login(http, recorder, fleet, user)
+
+    await asyncio.gather(*(one(user) for user in fleet.users))
+
+
+async def conditional_get(http, recorder: Recorder, fleet: Fleet, endpoint: str, path: str, user_id: str, headers: dict):
+    """GET the way a polling dashboard does, revalidating with the last ETag it saw"""
+    etag = fleet.etags.get((endpoint, user_id))
+    if etag:
+        headers = {**headers, "If-None-Match": etag}
+    response = await recorder.request(http, endpoint, "GET", path, headers=headers)
+    if response is not None and "etag" in response.headers:
+        fleet.etags[(endpoint, user_id)] = response.headers["etag"]
+
+
+async def run_action(action: str, http, recorder: Recorder, fleet: Fleet):
+    user = random.choice(fleet.users)
+    if action == "login" or user["id"] not in fleet.tokens:
+        await login(http, recorder, fleet, user)
+    elif action == "dashboard_poll":
+        await conditional_get(http, recorder, fleet, "GET /deliveries/my", "/api/deliveries/my",
+                              user["id"], fleet.headers(user["id"]))
+    elif action == "auth_me":
+        await recorder.request(http, "GET /auth/me", "GET", "/api/auth/me", headers=fleet.headers(user["id"]))
+    elif action == "admin_all_users":
+        await conditional_get(http, recorder, fleet, "GET /deliveries/all-users", "/api/deliveries/all-users",
+                              "admin", fleet.admin_headers)
+    elif action == "admin_update":
+        await recorder.request(http, "POST /deliveries/update", "POST", "/api/deliveries/update", json={
+            "userId": user["id"], "truck_type": random.choice(fleet.truck_types), "count": random.randint(0, 60)
+        }, headers=fleet.admin_headers)
+    elif action == "admin_update_batch":
+        updates = [
+            {"userId": random.choice(fleet.users)["id"], "truck_type": random.choice(fleet.truck_types),
+             "count": random.randint(0, 60)}
+            for _ in range(10)
+        ]
+        await recorder.request(http, "POST /deliveries/update-batch", "POST", "/api/deliveries/update-batch",
+                               json={"updates": updates}, headers=fleet.admin_headers)
+
+
+async def steady_state(http, recorder: Recorder, fleet: Fleet, mix: dict, concurrency: int, duration: float):
+    actions, weights = zip(*mix.items())
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await run_action(random.choices(actions, weights)[0], http, recorder, fleet)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def print_table(title: str, endpoints: dict, elapsed: float):
+    total = sum(stats["requests"] for stats in endpoints.values())
+    print(f"\n{title}: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    print(f"{'endpoint':<32} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for endpoint, stats in endpoints.items():
+        statuses = " ".join(f"{code}x{count}" for code, count in stats["statuses"].items())
+        print(f"{endpoint:<32} {stats['requests']:>7} {stats['throughput_rps']:>8} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}  {statuses}")
+
+
+def print_comparison(results: dict, baseline: dict):
+    """p95 change per endpoint against an earlier run"""
+    print(f"\nsteady state p95 vs baseline {baseline.get('commit')} ({baseline.get('label') or 'no label'}):")
+    before = baseline.get("steady_state", {}).get("endpoints", {})
+    for endpoint, stats in results["steady_state"]["endpoints"].items():
+        if endpoint not in before:
+            continue
+        old, new = before[endpoint]["p95_ms"], stats["p95_ms"]
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{endpoint:<32} {old:>8.2f} -> {new:>8.2f} ms ({change:+.0f}%)")
+
+
+def parse_mix(value: str) -> dict:
+    """`dashboard_poll=50,admin_update=10` -> weights, falling back to the default for unnamed actions"""
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, value.split(",")):
+        action, _, weight = part.partition("=")
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[action] = float(weight)
+    return {action: weight for action, weight in mix.items() if weight > 0}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running server (default: the ASGI app in-process)")
+    parser.add_argument("--users", type=int, default=100, help="Drivers and helpers to create")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of steady-state load")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="Action weights, e.g. dashboard_poll=50,admin_update=10")
+    parser.add_argument("--label", default="", help="Free-form note stored with the results")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/load-<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="Earlier results file to compare p95 latencies against")
+    args = parser.parse_args()
+
+    # httpx logs every request at INFO, which would dominate the client's own time
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    app = None
+    if args.url:
+        transport = httpx.AsyncHTTPTransport()
+        base_url = args.url.rstrip("/")
+    else:
+        from server import app, storage
+        await storage.startup()
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://bench"
+
+    fleet = Fleet(prefix=f"load_{uuid.uuid4().hex[:8]}_", password="load-test-password")
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=30) as http:
+        await seed(http, fleet, args.users)
+
+        start = time.perf_counter()
+        await shift_start(http, recorder, fleet, args.concurrency)
+        login_elapsed = time.perf_counter() - start
+        login_endpoints = recorder.summary(login_elapsed)
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        await steady_state(http, recorder, fleet, args.mix, args.concurrency, args.duration)
+        steady_elapsed = time.perf_counter() - start
+        steady_endpoints = recorder.summary(steady_elapsed)
+
+    if app is not None:
+        await storage.close()
+
+    commit = git_commit()
+    results = {
+        "label": args.label,
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or f"in-process ({os.environ.get('STORAGE_BACKEND', 'mongo')} storage)",
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        "shift_start": {"elapsed_s": round(login_elapsed, 3), "endpoints": login_endpoints},
+        "steady_state": {"elapsed_s": round(steady_elapsed, 3), "endpoints": steady_endpoints},
+    }
+
+    print_table("shift start", login_endpoints, login_elapsed)
+    print_table("steady state", steady_endpoints, steady_elapsed)
+    if args.baseline:
+        print_comparison(results, json.loads(Path(args.baseline).read_text()))
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).parent / "results" / f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
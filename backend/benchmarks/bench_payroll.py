@@ -0,0 +1,92 @@
+"""
+Benchmark for the vectorized payroll report.
+
+Generates a synthetic fleet in memory (no database needed) and compares the
+per-user/per-row Python loop used by calculate_user_stats with the NumPy
+report from payroll.py. Both start from the same delivery documents, so the
+headline for NumPy is loading them into the matrix plus computing the report
+the endpoint returns by default (with per-user columns).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_payroll --users 100000
+"""
+import argparse
+import random
+import time
+
+from payroll import CountMatrix, payroll_report, rate_vector
+from server import COMMISSION_RATES, TRUCK_TYPES
+
+
+def synthetic_fleet(size: int):
+    users = [
+        {"id": f"user-{i}", "username": f"user_{i}", "role": "driver" if i % 3 else "helper"}
+        for i in range(size)
+    ]
+    deliveries = [
+        {"userId": user["id"], "truck_type": truck, "count": random.randint(0, 60)}
+        for user in users
+        for truck in TRUCK_TYPES
+    ]
+    return users, deliveries
+
+
+def per_user_loop(users, deliveries):
+    """Per-user totals the way calculate_user_stats computes them, plus the same aggregates"""
+    rows_by_user = {}
+    for delivery in deliveries:
+        rows_by_user.setdefault(delivery["userId"], []).append(delivery)
+
+    results = []
+    by_role = {}
+    by_truck = {truck: 0 for truck in TRUCK_TYPES}
+    for user in users:
+        total_deliveries = 0
+        total_commission = 0.0
+        for delivery in rows_by_user.get(user["id"], []):
+            truck_type = delivery["truck_type"]
+            if truck_type in COMMISSION_RATES:
+                total_deliveries += delivery["count"]
+                total_commission += delivery["count"] * COMMISSION_RATES[truck_type]
+                by_truck[truck_type] += delivery["count"]
+        role = by_role.setdefault(user["role"], [0, 0.0])
+        role[0] += total_deliveries
+        role[1] += total_commission
+        results.append((user["id"], total_deliveries, round(total_commission, 2)))
+    ranking = sorted(results, key=lambda result: -result[2])[:10]
+    return results, by_role, by_truck, ranking
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    args = parser.parse_args()
+
+    users, deliveries = synthetic_fleet(args.users)
+    rates = rate_vector(COMMISSION_RATES, TRUCK_TYPES)
+
+    (loop_results, _, _, _), loop_ms = timed(per_user_loop, users, deliveries)
+    matrix, load_ms = timed(CountMatrix.from_delivery_rows, users, deliveries, TRUCK_TYPES)
+    report, report_ms = timed(payroll_report, matrix, rates, 10, False)
+    _, full_ms = timed(payroll_report, matrix, rates, 10, True)
+
+    expected = round(sum(result[2] for result in loop_results), 2)
+    assert abs(report["totals"]["total_commission"] - expected) < 0.01, "reports disagree"
+
+    print(f"users: {args.users}, delivery rows: {len(deliveries)}")
+    print(f"{'per-user loop':>30}: {loop_ms:>9.1f} ms")
+    print(f"{'numpy: build matrix':>30}: {load_ms:>9.1f} ms")
+    print(f"{'numpy: aggregates + ranking':>30}: {report_ms:>9.1f} ms")
+    print(f"{'numpy: with per-user columns':>30}: {full_ms:>9.1f} ms")
+    print(f"{'numpy: load + report':>30}: {load_ms + full_ms:>9.1f} ms")
+    print(f"speedup (load + report vs loop): {loop_ms / (load_ms + full_ms):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark for serializing and compressing the /deliveries/all-users response.
+
+Builds a fleet of N users in the in-memory backend (so database time does not
+blur the numbers), then reports:
+  * encode time of the listing with the old path (jsonable_encoder + stdlib
+    json), the response-model path used now (pydantic-core + orjson) and bare
+    orjson;
+  * body size and compression time for identity, gzip and brotli;
+  * end-to-end time and bytes on the wire for GET /api/deliveries/all-users
+    through the ASGI app, per Accept-Encoding.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_serialization --users 10000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import uuid
+
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import httpx  # noqa: E402
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from compression import brotli_available, compress  # noqa: E402
+from server import AllUsersStatsResponse, TRUCK_TYPES, app, create_access_token, storage  # noqa: E402
+
+
+def timed(fn, repeats: int):
+    """Median wall time of `fn` in milliseconds, and its last result"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+async def seed(size: int) -> dict:
+    """Create `size` drivers/helpers with random counts plus an admin; returns the admin"""
+    users = [
+        {
+            "id": str(uuid.uuid4()),
+            "username": f"bench_user_{i}",
+            "password": "not-a-real-hash",
+            "role": "driver" if i % 2 == 0 else "helper",
+            "createdAt": "2024-01-01T00:00:00+00:00"
+        }
+        for i in range(size)
+    ]
+    admin = {"id": str(uuid.uuid4()), "username": "bench_admin", "password": "not-a-real-hash",
+             "role": "admin", "createdAt": "2024-01-01T00:00:00+00:00"}
+    await storage.insert_users(users + [admin])
+    await storage.create_user_deliveries([user["id"] for user in users])
+    await storage.set_delivery_counts({
+        (user["id"], truck): random.randint(0, 50) for user in users for truck in TRUCK_TYPES
+    })
+    return admin
+
+
+def encode_stdlib(payload: dict) -> bytes:
+    # What JSONResponse did before: jsonable_encoder, then the stdlib encoder
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def encode_model(payload: dict) -> bytes:
+    # What the route does now: validate against the response model, dump, then orjson
+    content = AllUsersStatsResponse.model_validate(payload).model_dump(mode="json", exclude_unset=True)
+    return orjson.dumps(content)
+
+
+async def end_to_end(http, headers: dict, encoding: str, repeats: int):
+    timings = []
+    wire_bytes = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = await http.get("/api/deliveries/all-users", headers={**headers, "Accept-Encoding": encoding})
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        wire_bytes = response.num_bytes_downloaded
+    return statistics.median(timings), wire_bytes, response.headers.get("content-encoding", "identity")
+
+
+async def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    admin = await seed(args.users)
+    rows, _ = await storage.fleet_stats_page()
+    payload = {"users": rows}
+    print(f"{args.users} users, {args.repeats} repeats (median)\n")
+
+    print(f"{'encoder':<28}{'ms':>10}{'bytes':>12}")
+    body = b""
+    for name, fn in (("jsonable_encoder + json", encode_stdlib),
+                     ("response model + orjson", encode_model),
+                     ("orjson only", orjson.dumps)):
+        ms, body = timed(lambda: fn(payload), args.repeats)
+        print(f"{name:<28}{ms:>10.1f}{len(body):>12}")
+
+    print(f"\n{'encoding':<28}{'ms':>10}{'bytes':>12}{'ratio':>8}")
+    print(f"{'identity':<28}{0.0:>10.1f}{len(body):>12}{1.0:>8.2f}")
+    encodings = ["gzip"] + (["br"] if brotli_available() else [])
+    for encoding in encodings:
+        ms, compressed = timed(lambda: compress(body, encoding), args.repeats)
+        print(f"{encoding:<28}{ms:>10.1f}{len(compressed):>12}{len(body) / len(compressed):>8.2f}")
+    if not brotli_available():
+        print("(brotli not installed, skipped)")
+
+    headers = {"Authorization": f"Bearer {create_access_token(admin)}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        print(f"\n{'GET /deliveries/all-users':<28}{'ms':>10}{'wire bytes':>12}")
+        for accept in ["identity"] + encodings:
+            ms, wire_bytes, used = await end_to_end(http, headers, accept, args.repeats)
+            print(f"{'Accept-Encoding: ' + accept:<28}{ms:>10.1f}{wire_bytes:>12}  ({used})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
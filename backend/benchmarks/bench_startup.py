@@ -0,0 +1,164 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import the app and
+answer its first request, which is what a user waits for when an instance
+wakes up.
+
+Every run starts a new interpreter:
+  * `python -X importtime -c "import server"`, broken down per module that
+    server.py imports directly (cumulative, so a module's own imports are
+    included), plus server.py's own body;
+  * import, lifespan startup and the first GET /api/health/ready through the
+    ASGI app, with the in-memory backend so no database is needed.
+
+--check enforces the cold-start budget and exits 1 when it is exceeded:
+  * the median import of server takes at most --budget-ms;
+  * none of LAZY_MODULES is loaded by the import (they belong to the first
+    request that needs them).
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --check
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Optional or heavy modules that must not be imported until a request needs them
+LAZY_MODULES = ("numpy", "pandas", "pyarrow", "passlib")
+
+IMPORT_BUDGET_MS = 1000
+
+IMPORT_SCRIPT = """
+import json, sys
+import server
+print(json.dumps(sorted({{name.split(".")[0] for name in sys.modules}} & {lazy!r})))
+"""
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+import asyncio, json, httpx
+
+async def main():
+    begin = time.perf_counter()
+    async with server.app.router.lifespan_context(server.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            before_request = time.perf_counter()
+            response = await client.get("/api/health/ready")
+            answered = time.perf_counter()
+    response.raise_for_status()
+    print(json.dumps({
+        "import": (imported - start) * 1000,
+        "lifespan startup": (started - begin) * 1000,
+        "first request": (answered - before_request) * 1000,
+    }))
+
+asyncio.run(main())
+"""
+
+
+def child_env(**overrides) -> dict:
+    env = dict(os.environ)
+    # Importing never connects, so placeholders are enough for the Mongo backend
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "bench_startup")
+    env.update(overrides)
+    return env
+
+
+def parse_importtime(stderr: str, root: str = "server") -> dict:
+    """Milliseconds per module imported directly by `root`, plus `root`'s own body as '(self)'"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue    # the header line
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+
+    # Children are listed before their parent; walk back from the root to the previous top-level import
+    root_index = max(i for i, entry in enumerate(entries) if entry[0] == 0 and entry[1] == root)
+    breakdown = {"(self)": entries[root_index][2] / 1000}
+    for depth, name, _, cumulative in reversed(entries[:root_index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            breakdown[name] = cumulative / 1000
+    breakdown["total"] = entries[root_index][3] / 1000
+    return breakdown
+
+
+def measure_imports(runs: int):
+    """Median import breakdown over `runs` fresh interpreters, and the lazy modules the import loaded"""
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT.format(lazy=set(LAZY_MODULES))],
+            capture_output=True, text=True, env=child_env(), check=True
+        )
+        samples.append(parse_importtime(result.stderr))
+        loaded |= set(json.loads(result.stdout.strip().splitlines()[-1]))
+    names = {name for sample in samples for name in sample}
+    return {name: statistics.median(sample.get(name, 0.0) for sample in samples) for name in names}, sorted(loaded)
+
+
+def measure_startup(runs: int) -> dict:
+    """Median import, lifespan and first-request time over `runs` fresh interpreters"""
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            capture_output=True, text=True, env=child_env(STORAGE_BACKEND="memory"), check=True
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {phase: statistics.median(sample[phase] for sample in samples) for phase in samples[0]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="imports to list, slowest first")
+    parser.add_argument("--check", action="store_true", help="exit 1 when the budget is exceeded")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    breakdown, loaded = measure_imports(args.runs)
+    total = breakdown.pop("total")
+    print(f"import server: {total:.0f} ms ({args.runs} runs, median)\n")
+    print(f"{'module':<32}{'ms':>10}{'share':>8}")
+    for name, ms in sorted(breakdown.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<32}{ms:>10.1f}{ms / total:>8.0%}")
+
+    startup = measure_startup(args.runs)
+    print(f"\n{'cold start (memory backend)':<32}{'ms':>10}")
+    for phase, ms in startup.items():
+        print(f"{phase:<32}{ms:>10.1f}")
+    print(f"{'time to first byte':<32}{sum(startup.values()):>10.1f}")
+
+    if not args.check:
+        return 0
+    failures = []
+    if total > args.budget_ms:
+        failures.append(f"importing server took {total:.0f} ms, budget is {args.budget_ms:.0f} ms")
+    if loaded:
+        failures.append(f"imported at startup but should be lazy: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"\nOK: within the {args.budget_ms:.0f} ms import budget, no lazy module loaded")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Response compression (gzip, and brotli when the `brotli` package is installed).
+
+Only text-like responses (JSON, NDJSON, CSV, metrics) of at least
+`minimum_size` bytes are compressed; smaller bodies cost more to compress
+than they save on the wire. Server-sent events are left alone because a
+compressor buffers its output and would hold events back. Streamed responses
+are compressed chunk by chunk, so exports keep streaming in constant memory.
+"""
+import gzip
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+# Bodies this large are compressed on a worker thread (zlib and brotli release the GIL)
+THREADPOOL_SIZE = 256 * 1024
+
+
+def brotli_available() -> bool:
+    return brotli is not None
+
+
+def accepted_encodings(header: str) -> set:
+    """Codings in an Accept-Encoding header that are not refused with q=0"""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    """Compress a whole body in one call"""
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large text responses with the best coding the client accepts"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, scope) -> str:
+        header = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                header = value.decode("latin-1")
+                break
+        accepted = accepted_encodings(header)
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return ""
+
+    async def __call__(self, scope, receive, send):
+        encoding = self.choose_encoding(scope) if scope["type"] == "http" else ""
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None   # set once the response is known to be compressed
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                passthrough = not self._compressible(message)
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not more_body:
+                    # Whole body in one message: compress it only if that is worth it
+                    if len(body) >= self.minimum_size:
+                        if len(body) >= THREADPOOL_SIZE:
+                            body = await run_in_threadpool(
+                                compress, body, encoding, self.gzip_level, self.brotli_quality
+                            )
+                        else:
+                            body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                        self._set_headers(start_message, encoding, len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                self._set_headers(start_message, encoding, None)
+                await send(start_message)
+
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compressible(start_message) -> bool:
+        if start_message["status"] in (204, 304):
+            return False
+        content_type = ""
+        for name, value in start_message.get("headers", []):
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(UNCOMPRESSED_TYPES)
+
+    @staticmethod
+    def _set_headers(start_message, encoding: str, length):
+        headers = [(name, value) for name, value in start_message.get("headers", []) if name != b"content-length"]
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        headers.append((b"content-encoding", encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+        start_message["headers"] = headers
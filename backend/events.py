@@ -0,0 +1,70 @@
+"""
+In-process pub/sub hub for pushing stats changes to connected dashboards.
+
+Subscribers get a bounded queue. A subscriber that falls behind and fills its
+queue has its backlog dropped and replaced by a single `resync` event, telling
+the client to refetch instead of letting memory grow without bound.
+
+The hub only reaches clients connected to the same process; with several
+workers each one has its own hub.
+"""
+import asyncio
+from collections import defaultdict
+
+RESYNC_EVENT = {"type": "resync"}
+
+
+class Subscription:
+    def __init__(self, topics, queue_size: int):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflows = 0
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow consumer: drop the backlog and ask it to resync
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self, timeout: float):
+        """Next event, or None if nothing arrived within `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class StatsHub:
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, *topics) -> Subscription:
+        subscription = Subscription(topics, self.queue_size)
+        for topic in topics:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def publish(self, topic: str, event: dict):
+        for subscription in list(self._subscribers.get(topic, ())):
+            subscription.put(event)
+
+    def snapshot(self) -> dict:
+        subscriptions = {s for subscribers in self._subscribers.values() for s in subscribers}
+        return {
+            "subscribers": len(subscriptions),
+            "topics": len(self._subscribers),
+            "overflows": sum(s.overflows for s in subscriptions),
+        }
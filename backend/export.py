@@ -0,0 +1,112 @@
+"""
+Streaming CSV and Parquet export of fleet stats.
+
+Rows are pulled from an async cursor in fixed-size chunks and each chunk is
+encoded and yielded straight away, so memory use does not grow with the size
+of the fleet. Parquet output needs pandas and pyarrow; they are imported only
+when a Parquet export is requested.
+"""
+import csv
+import io
+
+EXPORT_CHUNK_SIZE = 1000
+
+
+def export_columns(truck_types: list) -> list:
+    return ["id", "username", "role", *truck_types, "total_deliveries", "total_commission"]
+
+
+def export_row(user: dict, truck_types: list) -> list:
+    by_truck = user["deliveries_by_truck"]
+    return [
+        user["id"],
+        user["username"],
+        user["role"],
+        *(by_truck.get(truck, 0) for truck in truck_types),
+        user["total_deliveries"],
+        user["total_commission"],
+    ]
+
+
+async def chunked(cursor, size: int = EXPORT_CHUNK_SIZE):
+    """Group documents from an async cursor into lists of at most `size`"""
+    chunk = []
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def csv_stream(chunks, truck_types: list):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(truck_types))
+    async for chunk in chunks:
+        writer.writerows(export_row(user, truck_types) for user in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents can be taken out as they are written"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pandas  # noqa: F401
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def parquet_stream(chunks, truck_types: list):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = export_columns(truck_types)
+    schema = pa.schema(
+        [("id", pa.string()), ("username", pa.string()), ("role", pa.string())]
+        + [(truck, pa.int64()) for truck in truck_types]
+        + [("total_deliveries", pa.int64()), ("total_commission", pa.float64())]
+    )
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # One row group per chunk; each is flushed to the client once written
+        async for chunk in chunks:
+            frame = pd.DataFrame([export_row(user, truck_types) for user in chunk], columns=columns)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
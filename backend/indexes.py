@@ -0,0 +1,120 @@
+"""
+Index definitions for the FleetTrack collections and a COLLSCAN check for the
+queries that run on every request.
+"""
+import logging
+
+from typing import Sequence
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# collection -> list of (keys, options)
+INDEXES = {
+    "users": [
+        ([("username", ASCENDING)], {"unique": True, "name": "username_unique"}),
+        ([("id", ASCENDING)], {"unique": True, "name": "id_unique"}),
+        ([("role", ASCENDING)], {"name": "role"}),
+    ],
+    "deliveries": [
+        ([("userId", ASCENDING), ("truck_type", ASCENDING)], {"unique": True, "name": "userId_truck_type_unique"}),
+    ],
+    "user_stats": [
+        ([("userId", ASCENDING)], {"unique": True, "name": "userId_unique"}),
+    ],
+    "delivery_counts": [
+        ([("userId", ASCENDING)], {"unique": True, "name": "userId_unique"}),
+    ],
+    "delivery_history": [
+        ([("period", ASCENDING), ("userId", ASCENDING)], {"unique": True, "name": "period_userId_unique"}),
+        ([("userId", ASCENDING), ("period", ASCENDING)], {"name": "userId_period"}),
+    ],
+    "delivery_events": [
+        ([("createdAt", ASCENDING)], {"name": "createdAt"}),
+        ([("compactedBy", ASCENDING)], {"sparse": True, "name": "compactedBy_sparse"}),
+    ],
+    "delivery_rollups": [
+        ([("granularity", ASCENDING), ("userId", ASCENDING), ("bucket", ASCENDING), ("truck_type", ASCENDING)],
+         {"unique": True, "name": "granularity_userId_bucket_truck_type_unique"}),
+        # Buckets are removed once their retention has passed (rollups.RETENTION)
+        ([("expiresAt", ASCENDING)], {"expireAfterSeconds": 0, "name": "expiresAt_ttl"}),
+    ],
+    "delivery_checkpoints": [
+        ([("userId", ASCENDING), ("truck_type", ASCENDING), ("hour", ASCENDING)],
+         {"unique": True, "name": "userId_truck_type_hour_unique"}),
+    ],
+}
+
+# Collections holding per-user stats documents (user_stats for the row layout, delivery_counts for compact)
+STATS_COLLECTIONS = ("user_stats", "delivery_counts")
+
+
+def leaderboard_indexes(truck_types: Sequence[str]) -> list:
+    """Descending indexes for every field the leaderboard ranks by, ties broken by userId"""
+    fields = ["total_commission", "total_deliveries"] + [f"deliveries_by_truck.{truck}" for truck in truck_types]
+    return [([(field, DESCENDING), ("userId", ASCENDING)], {"name": f"leaderboard_{field}"}) for field in fields]
+
+
+# (description, collection, filter[, sort]) for the queries on the request hot path
+HOT_QUERIES = [
+    ("login/register by username", "users", {"username": "__explain__"}),
+    ("get_current_user by id", "users", {"id": "__explain__"}),
+    ("deliveries for a user", "deliveries", {"userId": "__explain__"}),
+    ("delivery cell update", "deliveries", {"userId": "__explain__", "truck_type": "BKO"}),
+    ("stats point lookup", "user_stats", {"userId": "__explain__"}),
+    ("stats point lookup (compact layout)", "delivery_counts", {"userId": "__explain__"}),
+    ("delivery timeseries", "delivery_rollups",
+     {"granularity": "day", "userId": "__explain__", "bucket": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}),
+    ("fleet size", "users", {"role": {"$in": ["driver", "helper"]}}),
+    ("leaderboard top", "user_stats", {}, {"total_commission": -1, "userId": 1}),
+    ("leaderboard rank", "user_stats", {"total_commission": {"$gt": 0}}),
+    ("leaderboard top (compact layout)", "delivery_counts", {}, {"total_commission": -1, "userId": 1}),
+    ("leaderboard rank (compact layout)", "delivery_counts", {"total_commission": {"$gt": 0}}),
+    ("fleet history by period", "delivery_history", {"period": {"$gte": "2024-01", "$lte": "2024-12"}}),
+    ("user history", "delivery_history", {"userId": "__explain__", "period": {"$gte": "2024-01"}}),
+]
+
+
+async def ensure_indexes(db, truck_types: Sequence[str] = ()):
+    """Create any missing indexes; failures are logged so the app can still start"""
+    indexes_by_collection = {collection: list(indexes) for collection, indexes in INDEXES.items()}
+    for collection in STATS_COLLECTIONS:
+        indexes_by_collection[collection] += leaderboard_indexes(truck_types)
+    for collection, indexes in indexes_by_collection.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.error(f"Could not create index {options['name']} on {collection}: {e}")
+            except PyMongoError as e:
+                logger.error(f"Skipping index creation, database unavailable: {e}")
+                return
+
+
+def _plan_stages(plan) -> set:
+    """Collect every stage name in an explain plan tree"""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _plan_stages(item)
+    return stages
+
+
+async def explain_hot_queries(db) -> list:
+    """Explain each hot query and return (description, collection, stages, is_collscan)"""
+    results = []
+    for description, collection, query, *sort in HOT_QUERIES:
+        find = {"find": collection, "filter": query}
+        if sort:
+            find["sort"] = sort[0]
+        explain = await db.command("explain", find, verbosity="queryPlanner")
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        results.append((description, collection, sorted(stages), "COLLSCAN" in stages))
+    return results
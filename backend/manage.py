@@ -0,0 +1,129 @@
+"""
+FleetTrack maintenance commands.
+
+Usage (from the backend directory):
+    python manage.py rebuild-stats
+    python manage.py verify-stats
+    python manage.py ensure-indexes
+    python manage.py check-indexes
+    python manage.py migrate-deliveries
+"""
+import asyncio
+
+import typer
+
+from indexes import ensure_indexes, explain_hot_queries
+from server import format_stats, storage
+from storage.compact import CompactMongoStorage, migrate_to_compact
+from storage.mongo import MongoStorage
+
+cli = typer.Typer(help="FleetTrack maintenance commands", no_args_is_help=True)
+
+
+def mongo_storage() -> MongoStorage:
+    """The configured backend; these commands only make sense against MongoDB"""
+    if not isinstance(storage, MongoStorage):
+        typer.echo("Maintenance commands require STORAGE_BACKEND=mongo", err=True)
+        raise typer.Exit(code=2)
+    return storage
+
+
+def run(command):
+    """Connect to MongoDB, await `command(mongo)` and close the client afterwards"""
+    mongo = mongo_storage()
+
+    async def runner():
+        await mongo.open()
+        try:
+            return await command(mongo)
+        finally:
+            await mongo.close()
+    return asyncio.run(runner())
+
+
+async def find_stats_drift(mongo: MongoStorage) -> list:
+    """Compare every user_stats document with a fresh recomputation from deliveries"""
+    expected = {
+        doc["userId"]: format_stats(doc)
+        async for doc in mongo.db.deliveries.aggregate(mongo.user_stats_pipeline())
+    }
+    drift = []
+    async for doc in mongo.db.user_stats.find({}, {"_id": 0}):
+        user_id = doc["userId"]
+        stored = format_stats(doc)
+        computed = expected.pop(user_id, None)
+        if computed is None:
+            if stored["total_deliveries"] or stored["total_commission"]:
+                drift.append((user_id, stored, None))
+        elif stored != computed:
+            drift.append((user_id, stored, computed))
+    for user_id, computed in expected.items():
+        if computed["total_deliveries"] or computed["total_commission"]:
+            drift.append((user_id, None, computed))
+    return drift
+
+
+@cli.command("rebuild-stats")
+def rebuild_stats():
+    """Recompute every user_stats document from the raw deliveries collection."""
+    async def rebuild(mongo: MongoStorage):
+        await ensure_indexes(mongo.db, mongo.truck_types)
+        await mongo.refresh_user_stats()
+    run(rebuild)
+    typer.echo("Rebuilt user stats from deliveries")
+
+
+@cli.command("verify-stats")
+def verify_stats():
+    """Report user_stats documents that have drifted from the deliveries collection."""
+    if isinstance(mongo_storage(), CompactMongoStorage):
+        typer.echo("The compact layout keeps counts and stats in one document; there is nothing to verify", err=True)
+        raise typer.Exit(code=2)
+    drift = run(find_stats_drift)
+    for user_id, stored, computed in drift:
+        typer.echo(f"{user_id}: stored={stored} computed={computed}")
+    if drift:
+        typer.echo(f"{len(drift)} user(s) drifted; run `python manage.py rebuild-stats`", err=True)
+        raise typer.Exit(code=1)
+    typer.echo("All user stats match deliveries")
+
+
+@cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create the indexes the app relies on (also done at startup)."""
+    run(lambda mongo: ensure_indexes(mongo.db, mongo.truck_types))
+    typer.echo("Indexes ensured")
+
+
+@cli.command("check-indexes")
+def check_indexes():
+    """Explain each hot query and fail if any of them is a collection scan."""
+    results = run(lambda mongo: explain_hot_queries(mongo.db))
+    for description, collection, stages, is_collscan in results:
+        marker = "COLLSCAN" if is_collscan else "ok"
+        typer.echo(f"[{marker}] {collection}: {description} -> {', '.join(stages)}")
+    collscans = [r for r in results if r[3]]
+    if collscans:
+        typer.echo(f"{len(collscans)} hot query(ies) fall back to a COLLSCAN; run `python manage.py ensure-indexes`", err=True)
+        raise typer.Exit(code=1)
+
+
+@cli.command("migrate-deliveries")
+def migrate_deliveries(
+    batch_size: int = typer.Option(500, help="Users converted per batch"),
+    restart: bool = typer.Option(False, help="Start over instead of resuming the last run")
+):
+    """Convert delivery rows into one delivery_counts document per user (run with DELIVERY_LAYOUT=dual)."""
+    def report(state: dict):
+        typer.echo(f"{state['migrated']} users migrated")
+
+    async def migrate(mongo: MongoStorage):
+        await ensure_indexes(mongo.db, mongo.truck_types)
+        return await migrate_to_compact(mongo, batch_size=batch_size, restart=restart, progress=report)
+    state = run(migrate)
+    typer.echo(f"Migration finished: {state['migrated']} users in delivery_counts; "
+               "switch the app to DELIVERY_LAYOUT=compact once it runs on dual everywhere")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,211 @@
+"""
+Request and MongoDB metrics in the Prometheus text format.
+
+MetricsMiddleware times every request and counts responses per route
+template (e.g. /api/deliveries/history/{user_id}, never the raw path).
+MongoCommandListener is a pymongo CommandListener that charges each command
+to the request that issued it: the middleware keeps the request's counters in
+a context variable, and Motor runs pymongo calls in a copy of the caller's
+context, so the listener sees the same object from its executor thread.
+Commands issued outside a request (startup, background tasks) are reported
+under the route "-".
+
+The per-request `http_request_mongo_commands` histogram is the one to watch
+for N+1 patterns: a route whose command count grows with the data shows up
+in its upper buckets.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+NO_ROUTE = "-"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * len(self.buckets) + [0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._values.items()):
+            for bound, count in zip(self.buckets + (float("inf"),), series[:len(self.buckets)] + [series[-1]]):
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(float(series[-2]))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class RequestStats:
+    """Mongo work done on behalf of one request"""
+
+    __slots__ = ("scope", "commands", "command_seconds")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.commands = 0
+        self.command_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the scope; unmatched paths share one label
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("metrics_current_request", default=None)
+
+
+class Metrics:
+    """Registry of the app's metrics; safe to update from Motor's executor threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Time to serve a request, by route",
+            ("method", "route"), LATENCY_BUCKETS
+        )
+        self.requests = Counter(
+            "http_requests_total", "Responses sent, by route and status code",
+            ("method", "route", "status")
+        )
+        self.request_commands = Histogram(
+            "http_request_mongo_commands", "MongoDB commands issued while serving one request",
+            ("method", "route"), COMMAND_COUNT_BUCKETS
+        )
+        self.commands = Counter(
+            "mongo_commands_total", "MongoDB commands, by the route that issued them",
+            ("route", "command")
+        )
+        self.command_seconds = Counter(
+            "mongo_command_duration_seconds_total", "Time spent in MongoDB commands, by route",
+            ("route", "command")
+        )
+        self.command_failures = Counter(
+            "mongo_command_failures_total", "MongoDB commands that failed, by route",
+            ("route", "command")
+        )
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            self.request_duration.observe((method, route), seconds)
+            self.requests.inc((method, route, str(status)))
+            self.request_commands.observe((method, route), stats.commands)
+
+    def observe_command(self, command: str, seconds: float, failed: bool):
+        stats = _current_request.get()
+        route = stats.route if stats is not None else NO_ROUTE
+        with self._lock:
+            if stats is not None:
+                stats.commands += 1
+                stats.command_seconds += seconds
+            self.commands.inc((route, command))
+            self.command_seconds.inc((route, command), seconds)
+            if failed:
+                self.command_failures.inc((route, command))
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.requests, self.request_commands,
+                           self.commands, self.command_seconds, self.command_failures):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.observe_command(event.command_name, event.duration_micros / 1e6, failed=False)
+
+    def failed(self, event):
+        self.metrics.observe_command(event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and Mongo commands per route"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_request.reset(token)
+            self.metrics.observe_request(scope["method"], stats.route, status, time.perf_counter() - start, stats)
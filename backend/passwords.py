@@ -0,0 +1,98 @@
+"""
+Bcrypt hashing on a dedicated thread pool.
+
+bcrypt releases the GIL while it works, so running it on a small executor keeps
+the event loop free for other requests. The number of jobs waiting for a worker
+is bounded; once the queue is full new work is rejected instead of piling up.
+
+The passlib context is built by the first hash or verify, on a worker thread,
+so importing this module and constructing a PasswordHasher stay cheap.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = 2, queue_limit: int = 64, rounds: int = 12):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self._context = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "jobs": 0,
+            "rejected": 0,
+            "queued_seconds": 0.0,
+            "hashing_seconds": 0.0,
+            "max_queued_seconds": 0.0,
+        }
+
+    async def hash(self, password: str) -> str:
+        """Hash a password with the configured bcrypt cost"""
+        return await self._run(lambda: self.context().hash(password))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash"""
+        return await self._run(lambda: self.context().verify(plain_password, hashed_password))
+
+    def context(self):
+        """The passlib context, created on first use"""
+        if self._context is None:
+            with self._lock:
+                if self._context is None:
+                    from passlib.context import CryptContext
+                    self._context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=self.rounds)
+        return self._context
+
+    async def _run(self, fn, *args):
+        if self._in_flight >= self.workers + self.queue_limit:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PasswordHasherBusy()
+
+        self._in_flight += 1
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            result = fn(*args)
+            self._record(started - submitted, time.perf_counter() - started)
+            return result
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self._in_flight -= 1
+
+    def _record(self, queued: float, hashing: float):
+        with self._lock:
+            self._stats["jobs"] += 1
+            self._stats["queued_seconds"] += queued
+            self._stats["hashing_seconds"] += hashing
+            self._stats["max_queued_seconds"] = max(self._stats["max_queued_seconds"], queued)
+
+    def snapshot(self) -> dict:
+        """Current configuration and cumulative queue/hash timings"""
+        with self._lock:
+            stats = dict(self._stats)
+        jobs = stats["jobs"] or 1
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "rounds": self.rounds,
+            "in_flight": self._in_flight,
+            **stats,
+            "avg_queued_ms": round(stats["queued_seconds"] / jobs * 1000, 3),
+            "avg_hashing_ms": round(stats["hashing_seconds"] / jobs * 1000, 3),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,197 @@
+"""
+Vectorized payroll/commission reports.
+
+Delivery counts for the whole fleet (optionally across several archived months)
+are loaded into a rows x truck-types matrix and every total, commission,
+aggregate and ranking is computed with NumPy against a rate vector, instead of
+looping over users and delivery rows in Python.
+"""
+from itertools import count, repeat
+from operator import itemgetter
+
+import numpy as np
+
+
+def rate_vector(commission_rates: dict, truck_types: list) -> np.ndarray:
+    """Commission rate per truck type, in `truck_types` order"""
+    return np.array([commission_rates.get(truck, 0.0) for truck in truck_types], dtype=np.float64)
+
+
+def _column(docs: list, field: str) -> list:
+    """One field of every document as a list; map and itemgetter keep the per-document step in C"""
+    return list(map(itemgetter(field), docs))
+
+
+def _numeric_column(docs: list, field: str, dtype) -> np.ndarray:
+    """One numeric field of every document, filled straight into an array of `dtype`"""
+    return np.fromiter(map(itemgetter(field), docs), dtype=dtype, count=len(docs))
+
+
+def _positions(labels: list) -> dict:
+    """Small integer code per distinct label, in order of first appearance"""
+    return dict(zip(dict.fromkeys(labels), count()))
+
+
+def _encode(labels: list, codes: dict) -> np.ndarray:
+    """Code of each label in `codes`, or -1 for labels that are not in it"""
+    return np.fromiter(map(codes.get, labels, repeat(-1)), dtype=np.intp, count=len(labels))
+
+
+def _group_sum(codes: np.ndarray, values: np.ndarray, groups: int) -> np.ndarray:
+    """Sum the rows of a 2-D `values` array per integer group code"""
+    sums = np.zeros((groups, values.shape[1]), dtype=np.int64)
+    for column in range(values.shape[1]):
+        sums[:, column] = np.bincount(codes, weights=values[:, column], minlength=groups)
+    return sums
+
+
+class CountMatrix:
+    """Delivery counts with one row per (user, period), plus integer codes for grouping"""
+
+    def __init__(self, truck_types: list):
+        self.truck_types = truck_types
+        self.user_ids = []      # distinct users, indexed by user code
+        self.usernames = []
+        self.roles = []
+        self.periods = []       # distinct periods, indexed by period code
+        self.user_codes = np.zeros(0, dtype=np.intp)
+        self.period_codes = np.zeros(0, dtype=np.intp)
+        self.counts = np.zeros((0, len(truck_types)), dtype=np.int64)
+
+    def _set_users(self, ids: list, usernames: list, roles: list) -> dict:
+        """Keep the first occurrence of each user id; returns the user code per id"""
+        index = _positions(ids)
+        if len(index) == len(ids):
+            self.user_ids, self.usernames, self.roles = ids, usernames, roles
+            return index
+        # np.unique over codes numbered by first appearance yields each user's first row, in order
+        _, first = np.unique(_encode(ids, index), return_index=True)
+        self.user_ids = list(index)
+        self.usernames = [usernames[i] for i in first.tolist()]
+        self.roles = [roles[i] for i in first.tolist()]
+        return index
+
+    @classmethod
+    def from_delivery_rows(cls, users: list, deliveries: list, truck_types: list, period: str = "current"):
+        """Build from user documents plus raw (userId, truck_type, count) delivery rows"""
+        matrix = cls(truck_types)
+        user_index = matrix._set_users(_column(users, "id"), _column(users, "username"), _column(users, "role"))
+        users_count, trucks_count = len(matrix.user_ids), len(truck_types)
+
+        # Column arrays, mapped to matrix positions with C-level dict lookups rather than a loop per row
+        rows = _encode(_column(deliveries, "userId"), user_index)
+        columns = _encode(_column(deliveries, "truck_type"), _positions(truck_types))
+        counts = _numeric_column(deliveries, "count", np.int64)
+        valid = (rows >= 0) & (columns >= 0)
+
+        # Scatter every row into the matrix in one pass (duplicate cells add up)
+        matrix.counts = np.bincount(
+            rows[valid] * trucks_count + columns[valid], weights=counts[valid], minlength=users_count * trucks_count
+        ).astype(np.int64).reshape(users_count, trucks_count)
+        matrix.user_codes = np.arange(users_count, dtype=np.intp)
+        matrix.periods = [period]
+        matrix.period_codes = np.zeros(users_count, dtype=np.intp)
+        return matrix
+
+    @classmethod
+    def from_snapshots(cls, snapshots: list, truck_types: list):
+        """Build from delivery_history documents, one row per (user, period)"""
+        matrix = cls(truck_types)
+        user_ids = _column(snapshots, "userId")
+        user_index = matrix._set_users(user_ids, _column(snapshots, "username"), _column(snapshots, "role"))
+        periods = _column(snapshots, "period")
+        period_index = _positions(periods)
+        matrix.user_codes = _encode(user_ids, user_index)
+        matrix.period_codes = _encode(periods, period_index)
+        matrix.periods = list(period_index)
+        matrix.counts = np.array(
+            [[doc["deliveries_by_truck"].get(truck, 0) for truck in truck_types] for doc in snapshots],
+            dtype=np.int64
+        ).reshape(len(snapshots), len(truck_types))
+        return matrix
+
+
+def top_indices(values: np.ndarray, top: int) -> np.ndarray:
+    """Indices of the `top` largest values, largest first, without a full sort"""
+    if top < len(values):
+        candidates = np.argpartition(-values, top)[:top]
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+def payroll_report(matrix: CountMatrix, rates: np.ndarray, top: int = 10, include_users: bool = True) -> dict:
+    """Totals, commissions, per-role/per-truck/per-period aggregates and a commission ranking"""
+    trucks = matrix.truck_types
+    counts = matrix.counts
+
+    # Collapse (user, period) rows into one row per user
+    user_counts = _group_sum(matrix.user_codes, counts, len(matrix.user_ids))
+    user_totals = user_counts.sum(axis=1)
+    user_commission = np.round(user_counts @ rates, 2)
+
+    ranking = [
+        {
+            "rank": rank,
+            "id": matrix.user_ids[i],
+            "username": matrix.usernames[i],
+            "role": matrix.roles[i],
+            "total_deliveries": int(user_totals[i]),
+            "total_commission": float(user_commission[i])
+        }
+        for rank, i in enumerate(top_indices(user_commission, top).tolist(), start=1)
+    ]
+
+    role_index = _positions(matrix.roles)
+    role_codes = _encode(matrix.roles, role_index)
+    role_counts = _group_sum(role_codes, user_counts, len(role_index))
+    role_sizes = np.bincount(role_codes, minlength=len(role_index))
+    role_commission = role_counts @ rates
+    by_role = {
+        role: {
+            "users": int(role_sizes[i]),
+            "total_deliveries": int(role_counts[i].sum()),
+            "total_commission": round(float(role_commission[i]), 2)
+        }
+        for role, i in role_index.items()
+    }
+
+    period_counts = _group_sum(matrix.period_codes, counts, len(matrix.periods))
+    period_commission = period_counts @ rates
+    by_period = {
+        period: {
+            "total_deliveries": int(period_counts[i].sum()),
+            "total_commission": round(float(period_commission[i]), 2)
+        }
+        for i, period in enumerate(matrix.periods)
+    }
+
+    truck_deliveries = counts.sum(axis=0)
+    truck_commission = truck_deliveries * rates
+    by_truck = {
+        truck: {"deliveries": int(truck_deliveries[i]), "commission": round(float(truck_commission[i]), 2)}
+        for i, truck in enumerate(trucks)
+    }
+
+    report = {
+        "totals": {
+            "users": len(matrix.user_ids),
+            "total_deliveries": int(truck_deliveries.sum()),
+            "total_commission": round(float(truck_commission.sum()), 2)
+        },
+        "by_role": by_role,
+        "by_truck": by_truck,
+        "by_period": by_period,
+        "ranking": ranking
+    }
+    if include_users:
+        # Per-user figures as columns straight from the arrays (index i is one user), not a dict per user
+        report["users"] = {
+            "id": matrix.user_ids,
+            "username": matrix.usernames,
+            "role": matrix.roles,
+            "total_deliveries": user_totals.tolist(),
+            "total_commission": user_commission.tolist(),
+            "deliveries_by_truck": {truck: user_counts[:, i].tolist() for i, truck in enumerate(trucks)}
+        }
+    return report
@@ -5,4 +5,7 @@ echo "Installing Python dependencies..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Precompile bytecode so a waking instance does not compile the app on its first import
+python -m compileall -q .
+
 echo "Build completed successfully!"
\ No newline at end of file
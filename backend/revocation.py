@@ -0,0 +1,32 @@
+"""
+In-memory revocation list for JWTs.
+
+Tokens are identified by their `jti` claim. Entries are kept only until the
+token would have expired anyway, so the list stays small. Lookups are a dict
+membership check. The list is per process and is lost on restart.
+"""
+import time
+
+
+class RevocationList:
+    def __init__(self):
+        self._revoked = {}
+        self._next_purge = 0.0
+
+    def revoke(self, jti: str, expires_at: float):
+        """Revoke a token until its `exp` timestamp"""
+        self._revoked[jti] = expires_at
+        self._purge()
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def _purge(self):
+        now = time.time()
+        if now < self._next_purge:
+            return
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        self._next_purge = now + 60
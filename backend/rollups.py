@@ -0,0 +1,156 @@
+"""
+Day/week/month delivery rollups for trend charts.
+
+Every change to a delivery count is added to one bucket per granularity,
+per user and truck type, and again under FLEET for the fleet-wide series, so a
+chart over any range is one indexed read of pre-aggregated buckets. Buckets hold
+net changes in UTC periods: an increment adds, and an admin lowering a count
+subtracts. A monthly reset archives the month instead and is not a change in
+deliveries.
+
+Bucket keys sort as strings within a granularity:
+    day    2024-03-07
+    week   2024-W10   (ISO week)
+    month  2024-03
+
+Each bucket expires RETENTION after it starts (a TTL index on `expiresAt` for
+MongoDB).
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+GRANULARITIES = ("day", "week", "month")
+
+# userId of the buckets that add up the whole fleet
+FLEET = "*"
+
+RETENTION = {
+    "day": timedelta(days=180),
+    "week": timedelta(weeks=104),
+    "month": timedelta(days=5 * 366),
+}
+
+# Longest series a single request may ask for, and how many buckets to return by default
+MAX_BUCKETS = 400
+DEFAULT_BUCKETS = {"day": 30, "week": 12, "month": 12}
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    """First day of the bucket containing `day`"""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def bucket_key(day: date, granularity: str) -> str:
+    # Years are zero-padded so keys keep sorting as strings for every year of the calendar
+    if granularity == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year:04d}-W{week:02d}"
+    if granularity == "month":
+        return f"{day.year:04d}-{day.month:02d}"
+    return day.isoformat()
+
+
+def next_bucket(start: date, granularity: str) -> date:
+    """First day of the bucket after the one starting on `start`, or date.max for the last bucket of the calendar"""
+    try:
+        if granularity == "week":
+            return start + timedelta(weeks=1)
+        if granularity == "month":
+            return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start + timedelta(days=1)
+    except OverflowError:
+        return date.max
+
+
+def bucket_count(start: date, end: date, granularity: str) -> int:
+    """Number of buckets from the one containing `start` to the one containing `end`, without listing them"""
+    if start > end:
+        return 0
+    if granularity == "month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    days = (bucket_start(end, granularity) - bucket_start(start, granularity)).days
+    return days // 7 + 1 if granularity == "week" else days + 1
+
+
+def bucket_range(start: date, end: date, granularity: str) -> List[str]:
+    """Keys of every bucket from the one containing `start` to the one containing `end`"""
+    # Counted first, so the bucket after `end` (which may lie past date.max) is never computed
+    keys = []
+    current = bucket_start(start, granularity)
+    for i in range(bucket_count(start, end, granularity)):
+        if i:
+            current = next_bucket(current, granularity)
+        keys.append(bucket_key(current, granularity))
+    return keys
+
+
+def buckets_before(end: date, granularity: str, count: int) -> date:
+    """First day of the series of `count` buckets that ends with the one containing `end`
+
+    The series is cut short at the first bucket of the calendar.
+    """
+    start = bucket_start(end, granularity)
+    for _ in range(count - 1):
+        if start == date.min:
+            break
+        start = bucket_start(start - timedelta(days=1), granularity)
+    return start
+
+
+def rollup_targets(now: datetime) -> List[Tuple[str, str, datetime]]:
+    """(granularity, bucket key, expiry) of the buckets a change made at `now` belongs to"""
+    today = now.astimezone(timezone.utc).date()
+    targets = []
+    for granularity in GRANULARITIES:
+        start = bucket_start(today, granularity)
+        expires = datetime.combine(start, datetime.min.time(), tzinfo=timezone.utc) + RETENTION[granularity]
+        targets.append((granularity, bucket_key(today, granularity), expires))
+    return targets
+
+
+def rollup_increments(changes: List[Tuple[str, str, int]], now: datetime) -> Dict[tuple, int]:
+    """Net delta per (granularity, bucket, userId, truck_type) for (user id, truck type, delta) changes
+
+    Each change counts for its user and for FLEET; the expiry is not part of the key.
+    """
+    increments = {}
+    targets = rollup_targets(now)
+    for user_id, truck_type, delta in changes:
+        if not delta:
+            continue
+        for granularity, bucket, _ in targets:
+            for owner in (user_id, FLEET):
+                key = (granularity, bucket, owner, truck_type)
+                increments[key] = increments.get(key, 0) + delta
+    return increments
+
+
+def rollup_expiry(now: datetime) -> Dict[str, datetime]:
+    """When the bucket of each granularity containing `now` expires"""
+    return {granularity: expires for granularity, _, expires in rollup_targets(now)}
+
+
+def timeseries(docs: List[dict], buckets: List[str], truck_types: list) -> dict:
+    """Zero-filled, chart-ready series from rollup documents (bucket, truck_type, deliveries, commission)"""
+    position = {bucket: i for i, bucket in enumerate(buckets)}
+    deliveries = [0] * len(buckets)
+    commission = [0.0] * len(buckets)
+    by_truck = {truck: [0] * len(buckets) for truck in truck_types}
+    for doc in docs:
+        i = position.get(doc["bucket"])
+        if i is None:
+            continue
+        deliveries[i] += doc.get("deliveries", 0)
+        commission[i] += doc.get("commission", 0.0)
+        if doc["truck_type"] in by_truck:
+            by_truck[doc["truck_type"]][i] += doc.get("deliveries", 0)
+    return {
+        "buckets": buckets,
+        "deliveries": deliveries,
+        "commission": [round(value, 2) for value in commission],
+        "deliveries_by_truck": by_truck,
+    }
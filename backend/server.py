@@ -1,39 +1,93 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+from contextlib import asynccontextmanager, suppress
+import csv
+import io
+import json
+import math
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import Dict, List, Optional, Union
 import uuid
-from datetime import datetime, timezone
-import bcrypt
+from datetime import date, datetime, timedelta, timezone
 import jwt
-from passlib.context import CryptContext
+import orjson
+from admission import AdmissionLimiter, AdmissionMiddleware, TokenBuckets
+from compression import CompressionMiddleware
+from events import StatsHub
+from export import EXPORT_CHUNK_SIZE, chunked, csv_stream, parquet_available, parquet_stream
+from metrics import Metrics, MetricsMiddleware, MongoCommandListener
+from passwords import PasswordHasher, PasswordHasherBusy
+from revocation import RevocationList
+from rollups import DEFAULT_BUCKETS, MAX_BUCKETS, bucket_count, bucket_key, bucket_range, buckets_before, timeseries
+from storage import DuplicateUsername, InvalidCursor, ResetInProgress, create_storage, stat_value
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection with SSL configuration
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(
-    mongo_url,
-    tls=True,
-    tlsAllowInvalidCertificates=False,
-    serverSelectionTimeoutMS=5000,
-    connectTimeoutMS=10000,
-    retryWrites=True
-)
-db = client[os.environ['DB_NAME']]
-
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '2')),
+    queue_limit=int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', '64')),
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', '12'))
+)
 security = HTTPBearer()
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
+ACCESS_TOKEN_TTL = timedelta(minutes=int(os.environ.get('ACCESS_TOKEN_TTL_MINUTES', '60')))
+REFRESH_TOKEN_TTL = timedelta(days=int(os.environ.get('REFRESH_TOKEN_TTL_DAYS', '7')))
+# Tickets that open the live stats stream are single-use and only valid this long
+EVENTS_TICKET_TTL = timedelta(seconds=30)
+revoked_tokens = RevocationList()
+
+# Admission control: bcrypt-bound and fleet-wide routes get a bounded share of the worker
+auth_admission = AdmissionLimiter(
+    "auth",
+    concurrency=int(os.environ.get('ADMISSION_AUTH_CONCURRENCY', str(password_hasher.workers * 2))),
+    queue_limit=int(os.environ.get('ADMISSION_AUTH_QUEUE', '32')),
+    queue_timeout=float(os.environ.get('ADMISSION_AUTH_TIMEOUT', '5'))
+)
+fleet_admission = AdmissionLimiter(
+    "fleet",
+    concurrency=int(os.environ.get('ADMISSION_FLEET_CONCURRENCY', '4')),
+    queue_limit=int(os.environ.get('ADMISSION_FLEET_QUEUE', '16')),
+    queue_timeout=float(os.environ.get('ADMISSION_FLEET_TIMEOUT', '10'))
+)
+ADMISSION_ROUTES = {
+    ("POST", "/api/auth/login"): auth_admission,
+    ("POST", "/api/auth/register"): auth_admission,
+    ("POST", "/api/admin/users/import"): auth_admission,
+    ("GET", "/api/deliveries/all-users"): fleet_admission,
+    ("GET", "/api/deliveries/all-users/stream"): fleet_admission,
+    ("GET", "/api/deliveries/export"): fleet_admission,
+    ("GET", "/api/deliveries/history"): fleet_admission,
+    ("GET", "/api/deliveries/payroll"): fleet_admission,
+    ("POST", "/api/deliveries/update-batch"): fleet_admission,
+    ("POST", "/api/deliveries/reset-month"): fleet_admission,
+}
+
+# Login attempts per username and per client IP (token buckets, per minute)
+login_username_buckets = TokenBuckets(
+    rate=float(os.environ.get('LOGIN_USERNAME_PER_MINUTE', '10')) / 60,
+    burst=int(os.environ.get('LOGIN_USERNAME_BURST', '5'))
+)
+login_ip_buckets = TokenBuckets(
+    rate=float(os.environ.get('LOGIN_IP_PER_MINUTE', '120')) / 60,
+    burst=int(os.environ.get('LOGIN_IP_BURST', '60'))
+)
+
+# Reverse proxies in front of the app that append the peer they saw to X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '0'))
+
+# Live stats push (server-sent events)
+stats_hub = StatsHub(queue_size=int(os.environ.get('EVENTS_QUEUE_SIZE', '100')))
+EVENTS_KEEPALIVE_SECONDS = 15
 
 # Commission rates per truck type
 COMMISSION_RATES = {
@@ -47,8 +101,67 @@ COMMISSION_RATES = {
 
 TRUCK_TYPES = ["BKO", "PYW", "NYC", "GKY", "GSD", "AUA"]
 
-# Create the main app
-app = FastAPI()
+# Request latency and Mongo command accounting, served at /metrics
+metrics = Metrics()
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Storage backend: MongoDB by default, or in-memory with STORAGE_BACKEND=memory
+storage = create_storage(os.environ, COMMISSION_RATES, TRUCK_TYPES, event_listeners=[MongoCommandListener(metrics)])
+
+ROLES = ["driver", "helper", "admin"]
+
+# Payroll periods are calendar months written as YYYY-MM
+PERIOD_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+# Maximum number of rows accepted by the bulk user import
+MAX_IMPORT_ROWS = 1000
+
+# Maximum number of counts set by one batch delivery update
+MAX_BATCH_UPDATES = 1000
+
+# Leaderboard `by` values and the stats field each ranks on (a single truck type ranks on its count)
+LEADERBOARD_FIELDS = {"commission": "total_commission", "deliveries": "total_deliveries"}
+MAX_LEADERBOARD_SIZE = 100
+
+# Largest number of deliveries a single increment may record
+MAX_DELIVERY_INCREMENT = 1000
+
+# Delivery events older than the retention are folded into hourly checkpoints every interval (0 disables)
+EVENT_RETENTION_SECONDS = float(os.environ.get('EVENT_RETENTION_SECONDS', '3600'))
+EVENT_COMPACTION_INTERVAL = float(os.environ.get('EVENT_COMPACTION_INTERVAL', '300'))
+
+async def compact_delivery_events_periodically():
+    """Background task: fold old delivery events into checkpoints so the event log stays small"""
+    while True:
+        await asyncio.sleep(EVENT_COMPACTION_INTERVAL)
+        before = (datetime.now(timezone.utc) - timedelta(seconds=EVENT_RETENTION_SECONDS)).isoformat()
+        try:
+            folded = await storage.compact_delivery_events(before)
+        except Exception:
+            logger.exception("Delivery event compaction failed")
+            continue
+        if folded:
+            logger.info(f"Folded {folded} delivery events into checkpoints")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect and warm up storage before the first request, and release it on shutdown
+    app.state.ready = False
+    await storage.startup()
+    compactor = None
+    if EVENT_COMPACTION_INTERVAL > 0:
+        compactor = asyncio.create_task(compact_delivery_events_periodically())
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if compactor is not None:
+            compactor.cancel()
+            with suppress(asyncio.CancelledError):
+                await compactor
+        await storage.close()
+        password_hasher.shutdown()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -56,14 +169,21 @@ api_router = APIRouter(prefix="/api")
 # ============= MODELS =============
 
 class UserRegister(BaseModel):
-    username: str
-    password: str
+    # Empty values are rejected, including the blank cells of a CSV import row
+    username: str = Field(min_length=1)
+    password: str = Field(min_length=1)
     role: str = "driver"  # driver, helper, or admin
 
 class UserLogin(BaseModel):
     username: str
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class UserLogout(BaseModel):
+    refresh_token: Optional[str] = None
+
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
@@ -76,44 +196,198 @@ class DeliveryUpdate(BaseModel):
     truck_type: str
     count: int
 
+class DeliveryIncrement(BaseModel):
+    # Defaults to the current user; only admins may record for someone else
+    userId: Optional[str] = None
+    truck_type: str
+    amount: int = Field(1, ge=1, le=MAX_DELIVERY_INCREMENT)
+
+class MonthReset(BaseModel):
+    # Month being closed, defaults to the current month
+    period: Optional[str] = Field(None, pattern=PERIOD_PATTERN)
+
+class DeliveryBatchUpdate(BaseModel):
+    updates: List[DeliveryUpdate] = Field(max_length=MAX_BATCH_UPDATES)
+
+# Response models: validated and serialized by pydantic-core, then written by orjson
+
+class UserPublic(BaseModel):
+    id: str
+    username: str
+    role: str
+
+class Stats(BaseModel):
+    total_deliveries: int
+    total_commission: float
+    deliveries_by_truck: Dict[str, int]
+
 class UserStats(BaseModel):
     id: str
     username: str
     role: str
     total_deliveries: int
     total_commission: float
-    deliveries_by_truck: dict
+    deliveries_by_truck: Dict[str, int]
+
+class TokenResponse(BaseModel):
+    token: str
+    refresh_token: str
+    expires_in: int
+    user: UserPublic
+
+class EventsTicketResponse(BaseModel):
+    ticket: str
+    expires_in: int
+
+class RegisterResponse(TokenResponse):
+    message: str
+
+class MyDeliveriesResponse(BaseModel):
+    user: UserPublic
+    stats: Stats
+    commission_rates: Dict[str, float]
+
+class DeliveryUpdateResponse(BaseModel):
+    message: str
+    stats: Stats
+
+class DeliveryBatchUpdateResponse(BaseModel):
+    message: str
+    users: List[UserStats]
+
+class LeaderboardEntry(UserStats):
+    rank: int
+    value: Union[int, float]
+
+class LeaderboardResponse(BaseModel):
+    by: str
+    truck: Optional[str]
+    entries: List[LeaderboardEntry]
+
+class RankResponse(BaseModel):
+    user: UserPublic
+    by: str
+    truck: Optional[str]
+    rank: int
+    value: Union[int, float]
+    fleet_size: int
+
+class TimeseriesResponse(BaseModel):
+    granularity: str
+    userId: Optional[str]
+    buckets: List[str]
+    deliveries: List[int]
+    commission: List[float]
+    deliveries_by_truck: Dict[str, List[int]]
+
+class AllUsersStatsResponse(BaseModel):
+    users: List[UserStats]
+    # Only present on paged requests (when `limit` is given)
+    next_cursor: Optional[str] = None
 
 # ============= HELPER FUNCTIONS =============
 
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    """Hash a password using bcrypt off the event loop"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash off the event loop"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
-def create_access_token(data: dict) -> str:
-    """Create a JWT access token"""
-    to_encode = data.copy()
+def create_token(claims: dict, token_type: str, ttl: timedelta) -> str:
+    """Create a signed JWT with an expiry and a unique id"""
+    now = datetime.now(timezone.utc)
+    to_encode = {
+        **claims,
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": now + ttl
+    }
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Get the current authenticated user from JWT token"""
+def create_access_token(user: dict) -> str:
+    """Create a short-lived JWT access token carrying the user's username and role"""
+    claims = {"sub": user["id"], "username": user["username"], "role": user["role"]}
+    return create_token(claims, "access", ACCESS_TOKEN_TTL)
+
+def create_refresh_token(user: dict) -> str:
+    """Create a long-lived JWT that can only be exchanged for new tokens"""
+    return create_token({"sub": user["id"]}, "refresh", REFRESH_TOKEN_TTL)
+
+def issue_tokens(user: dict) -> dict:
+    """Access and refresh tokens for a login, registration or refresh response"""
+    return {
+        "token": create_access_token(user),
+        "refresh_token": create_refresh_token(user),
+        "expires_in": int(ACCESS_TOKEN_TTL.total_seconds())
+    }
+
+def decode_token(token: str, token_type: str) -> dict:
+    """Validate a JWT of the given type and return its claims"""
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        payload = jwt.decode(
+            token,
+            SECRET_KEY,
+            algorithms=[ALGORITHM],
+            options={"require": ["exp", "sub", "jti"]}
+        )
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    
+    if payload.get("type") != token_type or revoked_tokens.is_revoked(payload["jti"]):
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return payload
+
+def revoke_token(payload: dict):
+    """Reject a token for the rest of its lifetime"""
+    revoked_tokens.revoke(payload["jti"], payload["exp"])
+
+async def load_user(user_id: str) -> dict:
+    """Look up the user a token was issued to; 401 if it no longer exists"""
+    user = await storage.get_user(user_id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
+def client_ip(request: Request) -> str:
+    """The client address as seen by the outermost trusted proxy, or the peer without proxies"""
+    if TRUSTED_PROXY_HOPS:
+        # Entries left of the ones our proxies appended come from the client and can be forged
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def throttle_login(request: Request, username: str):
+    """Reject a login attempt with 429 when its client IP or username is out of tokens"""
+    for buckets, key in ((login_ip_buckets, client_ip(request)), (login_username_buckets, username.lower())):
+        wait = buckets.take(key)
+        if wait:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many login attempts, please retry later",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Validate the bearer access token and return its claims"""
+    return decode_token(credentials.credentials, "access")
+
+async def get_current_user(claims: dict = Depends(get_token_claims)):
+    """Get the current authenticated user from the JWT claims, without a database read"""
+    if "username" not in claims or "role" not in claims:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return {"id": claims["sub"], "username": claims["username"], "role": claims["role"]}
 
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     """Verify that the current user is an admin"""
@@ -121,46 +395,92 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
-async def calculate_user_stats(user_id: str) -> dict:
-    """Calculate total deliveries and commission for a user"""
-    deliveries = await db.deliveries.find({"userId": user_id}, {"_id": 0}).to_list(1000)
-    
-    total_deliveries = 0
-    total_commission = 0.0
-    deliveries_by_truck = {truck: 0 for truck in TRUCK_TYPES}
-    
-    for delivery in deliveries:
-        truck_type = delivery.get("truck_type")
-        count = delivery.get("count", 0)
-        
-        if truck_type in COMMISSION_RATES:
-            total_deliveries += count
-            deliveries_by_truck[truck_type] = count
-            total_commission += count * COMMISSION_RATES[truck_type]
-    
+def empty_stats() -> dict:
+    """Stats for a user with no deliveries"""
     return {
-        "total_deliveries": total_deliveries,
-        "total_commission": round(total_commission, 2),
-        "deliveries_by_truck": deliveries_by_truck
+        "total_deliveries": 0,
+        "total_commission": 0.0,
+        "deliveries_by_truck": {truck: 0 for truck in TRUCK_TYPES}
     }
 
+def format_stats(doc: dict) -> dict:
+    """Shape a stored user_stats document into the stats returned by the API"""
+    by_truck = doc.get("deliveries_by_truck", {})
+    return {
+        "total_deliveries": doc.get("total_deliveries", 0),
+        "total_commission": round(doc.get("total_commission", 0.0), 2),
+        "deliveries_by_truck": {truck: by_truck.get(truck, 0) for truck in TRUCK_TYPES}
+    }
+
+def leaderboard_field(by: str, truck: Optional[str]) -> str:
+    """The stats field a leaderboard ranks on"""
+    if truck is None:
+        return LEADERBOARD_FIELDS[by]
+    if truck not in TRUCK_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid truck type")
+    # Commission on one truck type is its count times a fixed rate, so both rank the same
+    return f"deliveries_by_truck.{truck}"
+
+def leaderboard_value(by: str, truck: Optional[str], value):
+    """What a user is ranked by, in the leaderboard's unit"""
+    if by == "deliveries":
+        return value
+    if truck is not None:
+        value *= COMMISSION_RATES[truck]
+    return round(value, 2)
+
+def publish_stats_changes(rows: list):
+    """Push changed stats rows to the affected users and to admin dashboards"""
+    for row in rows:
+        stats_hub.publish(f"user:{row['id']}", {
+            "type": "stats",
+            "stats": {
+                "total_deliveries": row["total_deliveries"],
+                "total_commission": row["total_commission"],
+                "deliveries_by_truck": row["deliveries_by_truck"]
+            }
+        })
+    fleet_rows = [row for row in rows if row["role"] in ("driver", "helper")]
+    if fleet_rows:
+        stats_hub.publish("fleet", {"type": "stats", "users": fleet_rows})
+
+def make_etag(*parts) -> str:
+    """Weak ETag built from a resource's identity and version"""
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names this ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+def set_etag(response: Response, etag: str):
+    # no-cache makes browsers revalidate with If-None-Match on every poll
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
 # ============= AUTH ROUTES =============
 
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", response_model=RegisterResponse)
 async def register(user_data: UserRegister):
     """Register a new user"""
     # Check if username already exists
-    existing_user = await db.users.find_one({"username": user_data.username})
+    existing_user = await storage.get_user_by_username(user_data.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     # Validate role
-    if user_data.role not in ["driver", "helper", "admin"]:
+    if user_data.role not in ROLES:
         raise HTTPException(status_code=400, detail="Invalid role. Must be 'driver', 'helper', or 'admin'")
     
     # Create new user
     user_id = str(uuid.uuid4())
-    hashed_pwd = hash_password(user_data.password)
+    hashed_pwd = await hash_password(user_data.password)
     
     new_user = {
         "id": user_id,
@@ -170,56 +490,87 @@ async def register(user_data: UserRegister):
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.users.insert_one(new_user)
+    try:
+        await storage.insert_user(new_user)
+    except DuplicateUsername:
+        raise HTTPException(status_code=400, detail="Username already exists")
     
     # Initialize deliveries for all truck types
-    for truck in TRUCK_TYPES:
-        await db.deliveries.insert_one({
-            "id": str(uuid.uuid4()),
-            "userId": user_id,
-            "truck_type": truck,
-            "count": 0,
-            "updatedAt": datetime.now(timezone.utc).isoformat()
-        })
+    await storage.create_user_deliveries([user_id])
+    await storage.bump_fleet_version()
     
-    # Create token
-    token = create_access_token({"sub": user_id})
+    user = {
+        "id": user_id,
+        "username": user_data.username,
+        "role": user_data.role
+    }
+    publish_stats_changes([{**user, **empty_stats()}])
     
     return {
         "message": "User registered successfully",
-        "token": token,
-        "user": {
-            "id": user_id,
-            "username": user_data.username,
-            "role": user_data.role
-        }
+        **issue_tokens(user),
+        "user": user
     }
 
-@api_router.post("/auth/login")
-async def login(credentials: UserLogin):
+@api_router.post("/auth/login", response_model=TokenResponse)
+async def login(credentials: UserLogin, request: Request):
     """Login a user and return JWT token"""
+    # Throttle before spending any time on the lookup or bcrypt
+    throttle_login(request, credentials.username)
+    
     # Find user by username
-    user = await db.users.find_one({"username": credentials.username})
+    user = await storage.get_user_by_username(credentials.username)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
     # Verify password
-    if not verify_password(credentials.password, user["password"]):
+    if not await verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Create token
-    token = create_access_token({"sub": user["id"]})
+    principal = {
+        "id": user["id"],
+        "username": user["username"],
+        "role": user["role"]
+    }
     
     return {
-        "token": token,
-        "user": {
-            "id": user["id"],
-            "username": user["username"],
-            "role": user["role"]
-        }
+        **issue_tokens(principal),
+        "user": principal
     }
 
-@api_router.get("/auth/me")
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh(body: TokenRefresh):
+    """Exchange a refresh token for a new access/refresh token pair"""
+    payload = decode_token(body.refresh_token, "refresh")
+    user = await load_user(payload["sub"])
+    
+    # Refresh tokens are single use
+    revoke_token(payload)
+    
+    principal = {
+        "id": user["id"],
+        "username": user["username"],
+        "role": user["role"]
+    }
+    
+    return {
+        **issue_tokens(principal),
+        "user": principal
+    }
+
+@api_router.post("/auth/logout")
+async def logout(body: Optional[UserLogout] = None, claims: dict = Depends(get_token_claims)):
+    """Revoke the current access token and, if given, the refresh token"""
+    revoke_token(claims)
+    if body and body.refresh_token:
+        try:
+            revoke_token(decode_token(body.refresh_token, "refresh"))
+        except HTTPException:
+            pass
+    
+    return {"message": "Logged out successfully"}
+
+@api_router.get("/auth/me", response_model=UserPublic)
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current user information"""
     return {
@@ -230,10 +581,15 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 # ============= DELIVERY ROUTES =============
 
-@api_router.get("/deliveries/my")
-async def get_my_deliveries(current_user: dict = Depends(get_current_user)):
+@api_router.get("/deliveries/my", response_model=MyDeliveriesResponse)
+async def get_my_deliveries(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
     """Get current user's deliveries and commission"""
-    stats = await calculate_user_stats(current_user["id"])
+    doc = await storage.get_user_stats(current_user["id"])
+    etag = make_etag("user", current_user["id"], doc.get("version", 0))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    stats = format_stats(doc)
     
     return {
         "user": {
@@ -245,7 +601,7 @@ async def get_my_deliveries(current_user: dict = Depends(get_current_user)):
         "commission_rates": COMMISSION_RATES
     }
 
-@api_router.post("/deliveries/update")
+@api_router.post("/deliveries/update", response_model=DeliveryUpdateResponse)
 async def update_deliveries(update: DeliveryUpdate, admin: dict = Depends(get_admin_user)):
     """Admin only: Update delivery count for a user and truck type"""
     # Validate truck type
@@ -253,78 +609,559 @@ async def update_deliveries(update: DeliveryUpdate, admin: dict = Depends(get_ad
         raise HTTPException(status_code=400, detail="Invalid truck type")
     
     # Check if user exists
-    user = await db.users.find_one({"id": update.userId})
+    user = await storage.get_user(update.userId)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if user["role"] == "admin":
+        raise HTTPException(status_code=400, detail="Deliveries can only be recorded for drivers and helpers")
     
-    # Update or create delivery record
-    result = await db.deliveries.update_one(
-        {"userId": update.userId, "truck_type": update.truck_type},
-        {
-            "$set": {
-                "count": update.count,
-                "updatedAt": datetime.now(timezone.utc).isoformat()
-            }
-        },
-        upsert=True
-    )
-    
-    # Calculate updated stats
-    stats = await calculate_user_stats(update.userId)
+    # Update or create delivery record and its stats
+    stats = format_stats(await storage.set_delivery_count(update.userId, update.truck_type, update.count))
+    await storage.bump_fleet_version()
+    publish_stats_changes([{"id": user["id"], "username": user["username"], "role": user["role"], **stats}])
     
     return {
         "message": "Delivery updated successfully",
         "stats": stats
     }
 
-@api_router.get("/deliveries/all-users")
-async def get_all_users_stats(admin: dict = Depends(get_admin_user)):
-    """Admin only: Get all users with their stats"""
-    users = await db.users.find({"role": {"$in": ["driver", "helper"]}}, {"_id": 0, "password": 0}).to_list(1000)
+@api_router.post("/deliveries/increment", response_model=DeliveryUpdateResponse)
+async def increment_deliveries(increment: DeliveryIncrement, current_user: dict = Depends(get_current_user)):
+    """Add deliveries to a count: drivers and helpers record their own, admins anyone's"""
+    # Unlike /deliveries/update this never overwrites a count, so concurrent increments all land
+    if increment.truck_type not in TRUCK_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid truck type")
+    
+    user_id = increment.userId or current_user["id"]
+    if user_id == current_user["id"]:
+        user = current_user
+    elif current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    else:
+        user = await storage.get_user(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    if user["role"] == "admin":
+        raise HTTPException(status_code=400, detail="Deliveries can only be recorded for drivers and helpers")
+    
+    stats = format_stats(await storage.record_deliveries(user_id, increment.truck_type, increment.amount))
+    await storage.bump_fleet_version()
+    publish_stats_changes([{"id": user["id"], "username": user["username"], "role": user["role"], **stats}])
+    
+    return {
+        "message": f"Recorded {increment.amount} deliveries",
+        "stats": stats
+    }
+
+@api_router.post("/deliveries/update-batch", response_model=DeliveryBatchUpdateResponse)
+async def update_deliveries_batch(batch: DeliveryBatchUpdate, admin: dict = Depends(get_admin_user)):
+    """Admin only: Update many delivery counts across users in one request"""
+    if not batch.updates:
+        raise HTTPException(status_code=400, detail="No updates given")
     
-    users_with_stats = []
-    for user in users:
-        stats = await calculate_user_stats(user["id"])
-        users_with_stats.append({
+    # Validate truck types; each cell may be set only once
+    cells = {}
+    for update in batch.updates:
+        if update.truck_type not in TRUCK_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid truck type: {update.truck_type}")
+        cell = (update.userId, update.truck_type)
+        if cell in cells:
+            raise HTTPException(
+                status_code=400, detail=f"Duplicate update for {update.userId} {update.truck_type}"
+            )
+        cells[cell] = update.count
+    
+    # Check that every user exists with a single query
+    user_ids = list({user_id for user_id, _ in cells})
+    users = await storage.get_users(user_ids)
+    missing = set(user_ids) - {user["id"] for user in users}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"User not found: {', '.join(sorted(missing))}")
+    admins = sorted(user["id"] for user in users if user["role"] == "admin")
+    if admins:
+        raise HTTPException(
+            status_code=400, detail=f"Deliveries can only be recorded for drivers and helpers: {', '.join(admins)}"
+        )
+    
+    stats_docs = await storage.set_delivery_counts(cells)
+    await storage.bump_fleet_version()
+    stats_by_user = {user_id: format_stats(doc) for user_id, doc in stats_docs.items()}
+    rows = [
+        {
             "id": user["id"],
             "username": user["username"],
             "role": user["role"],
-            "total_deliveries": stats["total_deliveries"],
-            "total_commission": stats["total_commission"],
-            "deliveries_by_truck": stats["deliveries_by_truck"]
+            **stats_by_user.get(user["id"], empty_stats())
+        }
+        for user in users
+    ]
+    publish_stats_changes(rows)
+    
+    return {
+        "message": f"Updated {len(cells)} deliveries for {len(users)} users",
+        "users": rows
+    }
+
+@api_router.get(
+    "/deliveries/all-users", response_model=AllUsersStatsResponse, response_model_exclude_unset=True
+)
+async def get_all_users_stats(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    """Admin only: Get all users with their stats, optionally one page at a time"""
+    # Without `limit` every user is returned; with it, `next_cursor` fetches the next page
+    # Read the version before the data so a concurrent write can only make the tag stale
+    etag = make_etag("fleet", await storage.fleet_version())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    
+    try:
+        users_with_stats, next_cursor = await storage.fleet_stats_page(cursor, limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if limit is None:
+        return {"users": users_with_stats}
+    
+    return {
+        "users": users_with_stats,
+        "next_cursor": next_cursor
+    }
+
+@api_router.get("/deliveries/all-users/stream")
+async def stream_all_users_stats(admin: dict = Depends(get_admin_user)):
+    """Admin only: Stream every user with their stats as NDJSON, one user per line"""
+    async def generate():
+        async for user in storage.iter_fleet_stats(batch_size=500):
+            yield orjson.dumps(user) + b"\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@api_router.get("/deliveries/export")
+async def export_all_users_stats(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|parquet)$"),
+    admin: dict = Depends(get_admin_user)
+):
+    """Admin only: Download every user's stats as CSV or Parquet, streamed in chunks"""
+    if export_format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pandas and pyarrow")
+
+    chunks = chunked(storage.iter_fleet_stats(batch_size=EXPORT_CHUNK_SIZE), EXPORT_CHUNK_SIZE)
+    filename = f"fleet-stats-{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.{export_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if export_format == "parquet":
+        return StreamingResponse(
+            parquet_stream(chunks, TRUCK_TYPES),
+            media_type="application/vnd.apache.parquet",
+            headers=headers
+        )
+    return StreamingResponse(csv_stream(chunks, TRUCK_TYPES), media_type="text/csv", headers=headers)
+
+@api_router.post("/deliveries/events/ticket", response_model=EventsTicketResponse)
+async def create_events_ticket(
+    claims: dict = Depends(get_token_claims),
+    current_user: dict = Depends(get_current_user)
+):
+    """A short-lived, single-use ticket to open the stats event stream with"""
+    # EventSource cannot send headers, so the stream is opened with a ticket in the query string
+    # rather than the access token; the ticket ties the stream to the access token's lifetime
+    ticket_claims = {
+        "sub": current_user["id"],
+        "username": current_user["username"],
+        "role": current_user["role"],
+        "access_jti": claims["jti"],
+        "access_exp": claims["exp"]
+    }
+    return {
+        "ticket": create_token(ticket_claims, "events", EVENTS_TICKET_TTL),
+        "expires_in": int(EVENTS_TICKET_TTL.total_seconds())
+    }
+
+@api_router.get("/deliveries/events")
+async def stream_stats_events(request: Request, ticket: str):
+    """Server-sent events with stats changes: per user for drivers and helpers, fleet-wide for admins"""
+    claims = decode_token(ticket, "events")
+    revoke_token(claims)
+    if revoked_tokens.is_revoked(claims["access_jti"]):
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    user = await get_current_user(claims)
+    if user["role"] == "admin":
+        subscription = stats_hub.subscribe("fleet", "all")
+    else:
+        subscription = stats_hub.subscribe(f"user:{user['id']}", "all")
+    
+    async def generate():
+        # The stream ends when the access token the ticket came from expires or is revoked;
+        # the client then gets a new ticket with a fresh access token
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                remaining = claims["access_exp"] - datetime.now(timezone.utc).timestamp()
+                if remaining <= 0 or revoked_tokens.is_revoked(claims["access_jti"]):
+                    break
+                event = await subscription.get(timeout=min(EVENTS_KEEPALIVE_SECONDS, remaining))
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            stats_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/deliveries/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    by: str = Query("commission", pattern="^(commission|deliveries)$"),
+    truck: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=MAX_LEADERBOARD_SIZE),
+    admin: dict = Depends(get_admin_user)
+):
+    """Admin only: Top drivers and helpers by commission or deliveries, overall or for one truck type"""
+    # Read from the precomputed stats down a descending index: `limit` users, not the whole fleet
+    field = leaderboard_field(by, truck)
+    rows = await storage.leaderboard(field, limit)
+    
+    entries = []
+    previous = None
+    for position, row in enumerate(rows, start=1):
+        value = stat_value(row, field)
+        # Tied users share a rank: 1, 2, 2, 4
+        rank = entries[-1]["rank"] if value == previous else position
+        previous = value
+        entries.append({
+            "id": row["id"],
+            "username": row["username"],
+            "role": row["role"],
+            **format_stats(row),
+            "rank": rank,
+            "value": leaderboard_value(by, truck, value)
         })
     
-    return {"users": users_with_stats}
+    return {"by": by, "truck": truck, "entries": entries}
+
+@api_router.get("/deliveries/rank", response_model=RankResponse)
+async def get_rank(
+    by: str = Query("commission", pattern="^(commission|deliveries)$"),
+    truck: Optional[str] = None,
+    user_id: Optional[str] = Query(None, alias="userId"),
+    current_user: dict = Depends(get_current_user)
+):
+    """A user's leaderboard position; drivers and helpers see their own, admins anyone's"""
+    field = leaderboard_field(by, truck)
+    user_id = user_id or current_user["id"]
+    if user_id == current_user["id"]:
+        user = current_user
+    elif current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    else:
+        user = await storage.get_user(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    if user["role"] == "admin":
+        raise HTTPException(status_code=400, detail="Only drivers and helpers are ranked")
+    
+    (rank, value), fleet_size = await asyncio.gather(storage.rank_of(user_id, field), storage.fleet_size())
+    
+    return {
+        "user": {"id": user["id"], "username": user["username"], "role": user["role"]},
+        "by": by,
+        "truck": truck,
+        "rank": rank,
+        "value": leaderboard_value(by, truck, value),
+        "fleet_size": fleet_size
+    }
+
+@api_router.get("/deliveries/timeseries", response_model=TimeseriesResponse)
+async def get_delivery_timeseries(
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    user_id: Optional[str] = Query(None, alias="userId"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Deliveries and commission per day, week or month; drivers and helpers get their own, admins the fleet's or anyone's"""
+    # Served from pre-aggregated rollup buckets in one indexed read, zero-filled for charts
+    if current_user["role"] != "admin":
+        if user_id is not None and user_id != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        user_id = current_user["id"]
+    elif user_id is not None and not await storage.get_user(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    end = end or datetime.now(timezone.utc).date()
+    try:
+        start = start or buckets_before(end, granularity, DEFAULT_BUCKETS[granularity])
+        if start > end:
+            raise HTTPException(status_code=400, detail="`from` must not be after `to`")
+        # Size the range arithmetically before listing any bucket
+        if bucket_count(start, end, granularity) > MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BUCKETS} {granularity} buckets per request")
+        buckets = bucket_range(start, end, granularity)
+        first, last = bucket_key(start, granularity), bucket_key(end, granularity)
+    except (OverflowError, ValueError):
+        raise HTTPException(status_code=400, detail="Date range is outside the supported calendar")
+    
+    docs = await storage.delivery_timeseries(granularity, first, last, user_id)
+    return {"granularity": granularity, "userId": user_id, **timeseries(docs, buckets, TRUCK_TYPES)}
 
 @api_router.post("/deliveries/reset-month")
-async def reset_month(admin: dict = Depends(get_admin_user)):
-    """Admin only: Reset all deliveries for the new month"""
-    # Reset all delivery counts to 0
-    result = await db.deliveries.update_many(
-        {},
-        {
-            "$set": {
-                "count": 0,
-                "updatedAt": datetime.now(timezone.utc).isoformat()
-            }
-        }
-    )
+async def reset_month(body: Optional[MonthReset] = None, admin: dict = Depends(get_admin_user)):
+    """Admin only: Archive the month's stats, then reset all deliveries for the new month"""
+    period = (body.period if body else None) or datetime.now(timezone.utc).strftime("%Y-%m")
+    
+    # Snapshot every user's stats into the history, then zero deliveries and stats
+    try:
+        updated_count = await storage.reset_month(period)
+    except ResetInProgress:
+        raise HTTPException(status_code=409, detail="A monthly reset is already running")
+    await storage.bump_fleet_version()
+    stats_hub.publish("all", {"type": "reset"})
     
     return {
         "message": "All deliveries reset successfully for the new month",
-        "updated_count": result.modified_count
+        "archived_period": period,
+        "updated_count": updated_count
     }
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/deliveries/history")
+async def get_fleet_history(
+    start: Optional[str] = Query(None, alias="from", pattern=PERIOD_PATTERN),
+    end: Optional[str] = Query(None, alias="to", pattern=PERIOD_PATTERN),
+    admin: dict = Depends(get_admin_user)
+):
+    """Admin only: Archived monthly stats for every user across a range of months"""
+    history = await storage.history(start, end)
+    
+    return {"history": history}
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@api_router.get("/deliveries/payroll")
+async def get_payroll_report(
+    start: Optional[str] = Query(None, alias="from", pattern=PERIOD_PATTERN),
+    end: Optional[str] = Query(None, alias="to", pattern=PERIOD_PATTERN),
+    top: int = Query(10, ge=1, le=1000),
+    include_users: bool = True,
+    admin: dict = Depends(get_admin_user)
+):
+    """Admin only: Payroll report for the current month, or for archived months when a range is given"""
+    # NumPy is only loaded once a report is asked for, keeping it off the cold-start path
+    from payroll import CountMatrix, payroll_report, rate_vector
+    
+    if start or end:
+        snapshots = await storage.history(
+            start, end, fields=["userId", "username", "role", "period", "deliveries_by_truck"]
+        )
+        matrix = CountMatrix.from_snapshots(snapshots, TRUCK_TYPES)
+    else:
+        users = await storage.list_fleet_users()
+        deliveries = await storage.delivery_rows()
+        matrix = CountMatrix.from_delivery_rows(users, deliveries, TRUCK_TYPES)
+    
+    return payroll_report(matrix, rate_vector(COMMISSION_RATES, TRUCK_TYPES), top=top, include_users=include_users)
+
+@api_router.get("/deliveries/history/{user_id}")
+async def get_user_history(
+    user_id: str,
+    start: Optional[str] = Query(None, alias="from", pattern=PERIOD_PATTERN),
+    end: Optional[str] = Query(None, alias="to", pattern=PERIOD_PATTERN),
+    current_user: dict = Depends(get_current_user)
+):
+    """Archived monthly stats for one user; drivers and helpers may only read their own"""
+    if current_user["role"] != "admin" and current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    history = await storage.history(start, end, user_id=user_id)
+    
+    return {"history": history}
+
+# ============= ADMIN ROUTES =============
+
+async def read_import_rows(request: Request) -> list:
+    """Parse a bulk import body: a JSON list (or {"users": [...]}) or CSV with a header row"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    if "csv" in content_type:
+        try:
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            rows = [{k.strip(): (v or "").strip() for k, v in row.items() if k} for row in reader]
+        except (UnicodeDecodeError, csv.Error):
+            raise HTTPException(status_code=400, detail="Invalid CSV body")
+    else:
+        try:
+            rows = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if isinstance(rows, dict):
+            rows = rows.get("users")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a list of users")
+    
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_IMPORT_ROWS} users can be imported at once")
+    return rows
+
+@api_router.post("/admin/users/import")
+async def import_users(request: Request, admin: dict = Depends(get_admin_user)):
+    """Admin only: Create many users at once from a JSON or CSV body"""
+    rows = await read_import_rows(request)
+    errors = []
+    candidates = []
+    seen = set()
+    
+    # Validate rows and drop duplicates within the upload
+    for row_number, row in enumerate(rows, start=1):
+        if isinstance(row, dict) and not row.get("role"):
+            row = {**row, "role": "driver"}
+        try:
+            user_data = UserRegister.model_validate(row)
+        except ValidationError:
+            errors.append({"row": row_number, "username": row.get("username") if isinstance(row, dict) else None,
+                           "error": "username and password are required"})
+            continue
+        if user_data.role not in ROLES:
+            errors.append({"row": row_number, "username": user_data.username,
+                           "error": "Invalid role. Must be 'driver', 'helper', or 'admin'"})
+        elif user_data.username in seen:
+            errors.append({"row": row_number, "username": user_data.username, "error": "Duplicate username in upload"})
+        else:
+            seen.add(user_data.username)
+            candidates.append((row_number, user_data))
+    
+    # Skip usernames that are already taken before spending time on bcrypt
+    existing = await storage.existing_usernames(list(seen))
+    for row_number, user_data in candidates:
+        if user_data.username in existing:
+            errors.append({"row": row_number, "username": user_data.username, "error": "Username already exists"})
+    candidates = [(row_number, user_data) for row_number, user_data in candidates if user_data.username not in existing]
+    
+    # Hash in parallel, but never more at once than the hashing pool has workers
+    slots = asyncio.Semaphore(password_hasher.workers)
+    
+    async def hash_row(password: str):
+        async with slots:
+            return await hash_password(password)
+    
+    hashes = await asyncio.gather(
+        *(hash_row(user_data.password) for _, user_data in candidates),
+        return_exceptions=True
+    )
+    
+    now = datetime.now(timezone.utc).isoformat()
+    new_users = []
+    new_user_rows = []
+    for (row_number, user_data), hashed_pwd in zip(candidates, hashes):
+        if isinstance(hashed_pwd, Exception):
+            errors.append({"row": row_number, "username": user_data.username, "error": "Password hashing failed, please retry"})
+            continue
+        new_users.append({
+            "id": str(uuid.uuid4()),
+            "username": user_data.username,
+            "password": hashed_pwd,
+            "role": user_data.role,
+            "createdAt": now
+        })
+        new_user_rows.append(row_number)
+    
+    # Insert users unordered so one bad row does not stop the rest
+    failed = await storage.insert_users(new_users) if new_users else {}
+    for index, message in failed.items():
+        errors.append({"row": new_user_rows[index], "username": new_users[index]["username"], "error": message})
+    
+    created = [user for index, user in enumerate(new_users) if index not in failed]
+    if created:
+        await storage.create_user_deliveries([user["id"] for user in created])
+        await storage.bump_fleet_version()
+        publish_stats_changes([
+            {"id": user["id"], "username": user["username"], "role": user["role"], **empty_stats()}
+            for user in created
+        ])
+    
+    return {
+        "message": f"Imported {len(created)} of {len(rows)} users",
+        "imported": len(created),
+        "users": [{"id": user["id"], "username": user["username"], "role": user["role"]} for user in created],
+        "errors": sorted(errors, key=lambda error: error["row"])
+    }
+
+# ============= DIAGNOSTICS ROUTES =============
+
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    """Startup has finished and the storage backend answers; 503 otherwise"""
+    health = await storage.health()
+    ready = getattr(request.app.state, "ready", False) and health["ready"]
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "storage": health},
+        status_code=200 if ready else 503
+    )
+
+@api_router.get("/admin/password-hashing")
+async def get_password_hashing_stats(admin: dict = Depends(get_admin_user)):
+    """Admin only: Password hashing pool configuration and queue vs. hashing time"""
+    return password_hasher.snapshot()
+
+@api_router.get("/admin/admission")
+async def get_admission_stats(admin: dict = Depends(get_admin_user)):
+    """Admin only: Admission limiter queues and login throttling counters"""
+    return {
+        "limiters": {limiter.name: limiter.snapshot() for limiter in (auth_admission, fleet_admission)},
+        "login_throttle": {"username": login_username_buckets.snapshot(), "ip": login_ip_buckets.snapshot()}
+    }
+
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint; requires `Authorization: Bearer <METRICS_TOKEN>` when that is set"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def create_app() -> FastAPI:
+    """Build the ASGI app
+
+    Nothing here touches the network: the database client is created and
+    warmed up by the lifespan, and heavy optional modules (NumPy, pandas,
+    pyarrow, passlib) are imported by the first request that needs them.
+    """
+    # orjson serializes the large fleet listings several times faster than the stdlib encoder
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.include_router(api_router)
+    app.add_api_route("/metrics", get_metrics, methods=["GET"], include_in_schema=False)
+
+    # Compression is innermost, so its time is part of the measured latency and of the admitted slot
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+        gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+        brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+    )
+    # Admission runs inside the metrics middleware so shed 503s are still counted (route "unmatched")
+    app.add_middleware(AdmissionMiddleware, routes=ADMISSION_ROUTES)
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+app = create_app()
 
 # Configure logging
 logging.basicConfig(
@@ -332,7 +1169,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
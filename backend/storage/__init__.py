@@ -0,0 +1,44 @@
+"""
+Storage backends for FleetTrack.
+
+STORAGE_BACKEND selects the implementation: "mongo" (the default, needs
+MONGO_URL and DB_NAME, with pool settings from MONGO_*) or "memory"
+(process-local, for load tests and profiling without a database). Backends
+connect in startup(), which the app runs from its lifespan. For MongoDB,
+DELIVERY_LAYOUT picks how delivery counts are stored ("rows", "dual" or
+"compact"; see storage.compact).
+"""
+from storage.base import DuplicateUsername, InvalidCursor, ResetInProgress, Storage, empty_stats, stat_value
+
+BACKENDS = ("mongo", "memory")
+
+
+def create_storage(environ, commission_rates: dict, truck_types: list, event_listeners=()) -> Storage:
+    """Build the backend named by STORAGE_BACKEND in `environ`"""
+    # `event_listeners` are pymongo monitoring listeners, only used by the Mongo backend
+    backend = environ.get("STORAGE_BACKEND", "mongo")
+    if backend == "memory":
+        from storage.memory import MemoryStorage
+        return MemoryStorage(commission_rates, truck_types)
+    if backend == "mongo":
+        from storage.compact import mongo_storage_class
+        from storage.mongo import client_options_from_env
+        storage_class = mongo_storage_class(environ.get("DELIVERY_LAYOUT", "rows"))
+        return storage_class.from_url(
+            environ["MONGO_URL"], environ["DB_NAME"], commission_rates, truck_types,
+            client_options=client_options_from_env(environ),
+            event_listeners=event_listeners
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of: {', '.join(BACKENDS)}")
+
+
+__all__ = [
+    "BACKENDS",
+    "DuplicateUsername",
+    "InvalidCursor",
+    "ResetInProgress",
+    "Storage",
+    "create_storage",
+    "empty_stats",
+    "stat_value",
+]
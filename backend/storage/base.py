@@ -0,0 +1,183 @@
+"""
+The storage interface shared by every backend.
+
+Handlers in server.py only talk to a Storage; MongoStorage and MemoryStorage
+implement it with the same semantics (stats documents, versions, history
+snapshots) so either one can sit behind the full app.
+"""
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+FLEET_ROLES = ["driver", "helper"]
+
+
+class DuplicateUsername(Exception):
+    """Raised when a user is created with a username that is already taken"""
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor the backend did not issue"""
+
+
+class ResetInProgress(Exception):
+    """Raised when a monthly reset is started while another one is still running"""
+
+
+def empty_stats(truck_types: list) -> dict:
+    """Stats for a user with no deliveries"""
+    return {
+        "total_deliveries": 0,
+        "total_commission": 0.0,
+        "deliveries_by_truck": {truck: 0 for truck in truck_types}
+    }
+
+
+def stat_value(stats: dict, field: str):
+    """The value of a leaderboard field ("total_commission", "deliveries_by_truck.BKO", ...) in a stats document"""
+    value = stats
+    for key in field.split("."):
+        value = value.get(key, 0) if isinstance(value, dict) else 0
+    return value
+
+
+class Storage:
+    """Users, delivery counts, per-user stats and monthly history"""
+
+    def __init__(self, commission_rates: dict, truck_types: list):
+        self.commission_rates = commission_rates
+        self.truck_types = truck_types
+
+    async def startup(self):
+        """Prepare the backend (indexes, connections) before serving requests"""
+
+    async def close(self):
+        """Release connections and other resources"""
+
+    async def health(self) -> dict:
+        """Readiness of the backend; `ready` is False when requests cannot be served"""
+        return {"ready": True}
+
+    # ----- users -----
+
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        """A user document without its password hash, or None"""
+        raise NotImplementedError
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        """A user document including its password hash, or None"""
+        raise NotImplementedError
+
+    async def get_users(self, user_ids: List[str]) -> List[dict]:
+        """id, username and role for each of `user_ids` that exists"""
+        raise NotImplementedError
+
+    async def list_fleet_users(self) -> List[dict]:
+        """id, username and role of every driver and helper"""
+        raise NotImplementedError
+
+    async def existing_usernames(self, usernames: List[str]) -> Set[str]:
+        """The subset of `usernames` that is already taken"""
+        raise NotImplementedError
+
+    async def insert_user(self, user: dict):
+        """Create a user; raises DuplicateUsername if the username is taken"""
+        raise NotImplementedError
+
+    async def insert_users(self, users: List[dict]) -> Dict[int, str]:
+        """Create many users, skipping failures; returns an error message per failed index"""
+        raise NotImplementedError
+
+    async def create_user_deliveries(self, user_ids: List[str]):
+        """Zeroed delivery counts and stats for newly created users"""
+        raise NotImplementedError
+
+    # ----- deliveries and stats -----
+
+    async def get_user_stats(self, user_id: str) -> dict:
+        """A user's stats document (with its version), built from deliveries if missing"""
+        raise NotImplementedError
+
+    async def set_delivery_count(self, user_id: str, truck_type: str, count: int) -> dict:
+        """Set one delivery count and return the user's updated stats document
+
+        Like every change to a count, the difference is added to the rollup buckets.
+        """
+        raise NotImplementedError
+
+    async def record_deliveries(self, user_id: str, truck_type: str, amount: int) -> dict:
+        """Log a delivery event and add `amount` to the count; returns the user's updated stats document"""
+        raise NotImplementedError
+
+    async def set_delivery_counts(self, cells: Dict[Tuple[str, str], int]) -> Dict[str, dict]:
+        """Set many (user id, truck type) counts; returns the updated stats document per user"""
+        raise NotImplementedError
+
+    async def refresh_user_stats(self, user_ids: Optional[List[str]] = None):
+        """Rebuild stats documents from the raw delivery counts (all users by default)"""
+        raise NotImplementedError
+
+    async def delivery_rows(self) -> List[dict]:
+        """userId, truck_type and count of every non-zero delivery count"""
+        raise NotImplementedError
+
+    async def fleet_stats_page(self, cursor: Optional[str] = None,
+                               limit: Optional[int] = None) -> Tuple[List[dict], Optional[str]]:
+        """Drivers and helpers with their stats, plus the cursor of the next page if there may be one"""
+        raise NotImplementedError
+
+    def iter_fleet_stats(self, batch_size: int = 500) -> AsyncIterator[dict]:
+        """Every driver and helper with their stats, fetched `batch_size` at a time"""
+        raise NotImplementedError
+
+    async def reset_month(self, period: str) -> int:
+        """Archive everyone's stats under `period`, then zero all counts; returns the counts reset
+
+        Raises ResetInProgress if another reset is running.
+        """
+        raise NotImplementedError
+
+    # ----- rollups -----
+
+    async def delivery_timeseries(self, granularity: str, start: str, end: str,
+                                  user_id: Optional[str] = None) -> List[dict]:
+        """Rollup buckets of `granularity` keyed `start`..`end` for a user, or the whole fleet
+
+        Each has bucket, truck_type, deliveries and commission; see rollups.py.
+        """
+        raise NotImplementedError
+
+    # ----- leaderboard -----
+
+    async def leaderboard(self, field: str, limit: int) -> List[dict]:
+        """The `limit` drivers and helpers with the highest stats `field`, best first (ties by user id)
+
+        Each row has the user's id, username and role plus their stats.
+        """
+        raise NotImplementedError
+
+    async def rank_of(self, user_id: str, field: str) -> Tuple[int, float]:
+        """A user's rank by stats `field` (1 + users strictly ahead) and their value"""
+        raise NotImplementedError
+
+    async def fleet_size(self) -> int:
+        """Number of drivers and helpers"""
+        raise NotImplementedError
+
+    # ----- delivery events -----
+
+    async def compact_delivery_events(self, before: str) -> int:
+        """Fold events created before `before` into hourly per-user checkpoints; returns the events folded"""
+        raise NotImplementedError
+
+    # ----- history and versions -----
+
+    async def history(self, start: Optional[str] = None, end: Optional[str] = None,
+                      user_id: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        """Archived snapshots in an inclusive YYYY-MM range, ordered by period then username"""
+        raise NotImplementedError
+
+    async def fleet_version(self) -> int:
+        """Version counter bumped by every write that changes the all-users listing"""
+        raise NotImplementedError
+
+    async def bump_fleet_version(self):
+        raise NotImplementedError
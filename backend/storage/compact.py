@@ -0,0 +1,382 @@
+"""
+Compact delivery layout: one `delivery_counts` document per user.
+
+The row layout keeps one `deliveries` document per (user, truck type), each
+with its own id and timestamp, plus a materialized `user_stats` document. The
+compact layout folds all of them into a single document per user:
+
+    {"userId": ..., "deliveries_by_truck": {"BKO": 3, "AUA": 1, ...},
+     "total_deliveries": 4, "total_commission": 20.5, "version": 7, "updatedAt": ...}
+
+Counts and totals change in the same update, so setting several truck types
+for a user is one atomic write and the stats can never drift from the counts.
+
+DELIVERY_LAYOUT moves a deployment across without downtime:
+
+    rows     the original layout (default)
+    dual     rows stay authoritative; every write is mirrored into
+             delivery_counts and point reads prefer it, falling back to rows
+    compact  delivery_counts only; a user the migration has not reached yet is
+             built from their rows on first access
+
+Deploy `dual`, run `python manage.py migrate-deliveries` (batched and
+resumable), then deploy `compact`.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from storage.base import empty_stats
+from storage.mongo import MongoStorage
+
+LAYOUTS = ("rows", "dual", "compact")
+
+# counters document recording how far the migration got
+MIGRATION_ID = "delivery_counts_migration"
+MIGRATION_BATCH_SIZE = 500
+
+
+def guarded_upserts(docs: List[dict]) -> List[UpdateOne]:
+    """Upserts of stats documents that never replace a document with the same or a newer version"""
+    return [
+        UpdateOne({"userId": doc["userId"], "version": {"$lt": doc["version"]}}, {"$set": doc}, upsert=True)
+        for doc in docs
+    ]
+
+
+async def write_guarded(collection, docs: List[dict]):
+    if not docs:
+        return
+    try:
+        await collection.bulk_write(guarded_upserts(docs), ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key is an upsert that lost to a newer version already stored
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if errors:
+            raise
+
+
+class DualMongoStorage(MongoStorage):
+    """Row layout that mirrors every stats change into delivery_counts and reads it first"""
+
+    def mirror_stats_pipeline(self, user_ids: Optional[List[str]] = None) -> list:
+        """Build the aggregation that copies user_stats documents newer than their mirror"""
+        match = {"userId": {"$in": user_ids}} if user_ids is not None else {}
+        return [
+            {"$match": match},
+            {"$project": {"_id": 0}},
+            {"$merge": {
+                "into": "delivery_counts",
+                "on": "userId",
+                "whenMatched": [{"$replaceWith": {"$cond": [
+                    {"$gt": ["$$new.version", {"$ifNull": ["$version", 0]}]},
+                    {"$mergeObjects": ["$$ROOT", "$$new"]},
+                    "$$ROOT"
+                ]}}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+
+    async def mirror(self, docs: List[dict]):
+        await write_guarded(self.db.delivery_counts, docs)
+
+    async def get_user_stats(self, user_id: str) -> dict:
+        doc = await self.db.delivery_counts.find_one({"userId": user_id}, {"_id": 0})
+        if doc is None:
+            doc = await super().get_user_stats(user_id)
+            await self.mirror([doc])
+        return doc
+
+    async def create_user_deliveries(self, user_ids: List[str]):
+        await super().create_user_deliveries(user_ids)
+        await self.mirror([self.initial_user_stats(user_id) for user_id in user_ids])
+
+    async def set_delivery_count(self, user_id: str, truck_type: str, count: int) -> dict:
+        doc = await super().set_delivery_count(user_id, truck_type, count)
+        await self.mirror([doc])
+        return doc
+
+    async def record_deliveries(self, user_id: str, truck_type: str, amount: int) -> dict:
+        doc = await super().record_deliveries(user_id, truck_type, amount)
+        await self.mirror([doc])
+        return doc
+
+    async def set_delivery_counts(self, cells: dict) -> dict:
+        docs = await super().set_delivery_counts(cells)
+        await self.mirror(list(docs.values()))
+        return docs
+
+    async def refresh_user_stats(self, user_ids: Optional[List[str]] = None):
+        await super().refresh_user_stats(user_ids)
+        await self.db.user_stats.aggregate(self.mirror_stats_pipeline(user_ids)).to_list(None)
+
+    async def reset_month(self, period: str) -> int:
+        reset = await super().reset_month(period)
+        await self.db.user_stats.aggregate(self.mirror_stats_pipeline()).to_list(None)
+        return reset
+
+
+class CompactMongoStorage(MongoStorage):
+    """One delivery_counts document per user holds both the counts and the stats"""
+
+    COUNTS_COLLECTION = "delivery_counts"
+    STATS_COLLECTION = "delivery_counts"
+
+    def totals_lookup(self) -> dict:
+        by_truck = {f"truck_{truck}": f"$deliveries_by_truck.{truck}" for truck in self.truck_types}
+        return {"$lookup": {
+            "from": "delivery_counts",
+            "localField": "id",
+            "foreignField": "userId",
+            "pipeline": [{"$project": {"_id": 0, "total_deliveries": 1, "total_commission": 1, **by_truck}}],
+            "as": "totals"
+        }}
+
+    def set_counts_update(self, counts: Dict[str, object], now: str) -> list:
+        """Update pipeline that sets some truck counts (values or expressions) and recomputes the totals in the same write"""
+        count = {truck: {"$ifNull": [f"$deliveries_by_truck.{truck}", 0]} for truck in self.truck_types}
+        pipeline = []
+        if counts:
+            pipeline.append({"$set": {f"deliveries_by_truck.{truck}": value for truck, value in counts.items()}})
+        pipeline.append({"$set": {
+            "total_deliveries": {"$add": [count[truck] for truck in self.commission_rates]},
+            "total_commission": {"$add": [
+                {"$multiply": [count[truck], rate]} for truck, rate in self.commission_rates.items()
+            ]},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            "updatedAt": {"$literal": now}
+        }})
+        return pipeline
+
+    async def create_user_deliveries(self, user_ids: List[str]):
+        await self.db.delivery_counts.insert_many(
+            [self.initial_user_stats(user_id) for user_id in user_ids],
+            ordered=False
+        )
+
+    async def set_delivery_count(self, user_id: str, truck_type: str, count: int) -> dict:
+        update = self.set_counts_update({truck_type: count}, datetime.now(timezone.utc).isoformat())
+        # The document before the write gives the change for the rollups
+        previous = await self.db.delivery_counts.find_one_and_update(
+            {"userId": user_id}, update, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+        )
+        if previous is None:
+            # Not migrated yet: build the document from the user's rows, then apply the change
+            await self.backfill_user_stats(user_id)
+            previous = await self.db.delivery_counts.find_one_and_update(
+                {"userId": user_id}, update, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+            )
+        delta = count - previous["deliveries_by_truck"].get(truck_type, 0)
+        doc, _ = await asyncio.gather(
+            self.db.delivery_counts.find_one({"userId": user_id}, {"_id": 0}),
+            self.record_rollups([(user_id, truck_type, delta)])
+        )
+        return doc
+
+    async def record_deliveries(self, user_id: str, truck_type: str, amount: int) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        _, doc, _ = await asyncio.gather(
+            self.db.delivery_events.insert_one(self.delivery_event(user_id, truck_type, amount, now)),
+            self.inc_user_stats(user_id, truck_type, amount, now),
+            self.record_rollups([(user_id, truck_type, amount)])
+        )
+        if doc is None:
+            await self.backfill_user_stats(user_id)
+            doc = await self.inc_user_stats(user_id, truck_type, amount, now)
+        return doc
+
+    async def set_delivery_counts(self, cells: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        counts_by_user = {}
+        for (user_id, truck_type), count in cells.items():
+            counts_by_user.setdefault(user_id, {})[truck_type] = count
+        user_ids = list(counts_by_user)
+
+        migrated = set(await self.db.delivery_counts.distinct("userId", {"userId": {"$in": user_ids}}))
+        for user_id in user_ids:
+            if user_id not in migrated:
+                await self.backfill_user_stats(user_id)
+
+        # One write per user, covering all of that user's truck types at once. As for the row
+        # layout, each write keeps the counts it replaces under this call's id for the rollups.
+        write = uuid.uuid4().hex
+        await self.db.delivery_counts.bulk_write(
+            [
+                UpdateOne(
+                    {"userId": user_id},
+                    [{"$set": {f"replaced.{write}": "$deliveries_by_truck"}}] + self.set_counts_update(counts, now)
+                )
+                for user_id, counts in counts_by_user.items()
+            ],
+            ordered=False
+        )
+        docs = {
+            doc["userId"]: doc
+            async for doc in self.db.delivery_counts.find({"userId": {"$in": user_ids}}, {"_id": 0})
+        }
+        await self.db.delivery_counts.update_many(
+            {"userId": {"$in": user_ids}}, {"$unset": {f"replaced.{write}": ""}}
+        )
+        previous = {user_id: doc.pop("replaced", {}).get(write, {}) for user_id, doc in docs.items()}
+        await self.record_rollups([
+            (user_id, truck_type, count - previous[user_id].get(truck_type, 0))
+            for user_id, counts in counts_by_user.items()
+            for truck_type, count in counts.items()
+        ])
+        return docs
+
+    async def refresh_user_stats(self, user_ids: Optional[List[str]] = None):
+        query = {"userId": {"$in": user_ids}} if user_ids is not None else {}
+        await self.db.delivery_counts.update_many(
+            query, self.set_counts_update({}, datetime.now(timezone.utc).isoformat())
+        )
+
+    async def delivery_rows(self) -> List[dict]:
+        return await self.db.delivery_counts.aggregate([
+            {"$project": {"_id": 0, "userId": 1, "cells": {"$objectToArray": "$deliveries_by_truck"}}},
+            {"$unwind": "$cells"},
+            {"$match": {"cells.v": {"$gt": 0}}},
+            {"$project": {"userId": 1, "truck_type": "$cells.k", "count": "$cells.v"}}
+        ]).to_list(None)
+
+    async def unmigrated_user_ids(self) -> List[str]:
+        """Users that have no delivery_counts document yet (their counts are still only in rows)"""
+        return [
+            user["id"]
+            async for user in self.db.users.aggregate([
+                {"$lookup": {"from": "delivery_counts", "localField": "id", "foreignField": "userId", "as": "counts"}},
+                {"$match": {"counts": {"$size": 0}}},
+                {"$project": {"_id": 0, "id": 1}}
+            ])
+        ]
+
+    async def reset_month(self, period: str) -> int:
+        # Users the migration has not reached are migrated first; otherwise their rows would be
+        # skipped by the reset and brought back, with last month's counts, on first access
+        user_ids = await self.unmigrated_user_ids()
+        for start in range(0, len(user_ids), MIGRATION_BATCH_SIZE):
+            await migrate_users(self, user_ids[start:start + MIGRATION_BATCH_SIZE])
+
+        # One document per user, so this counts users rather than (user, truck type) rows
+        return await super().reset_month(period)
+
+    async def counts_to_reset(self, run: str, ids: Optional[list] = None) -> List[dict]:
+        query = {"resetBy": {"$ne": run}}
+        if ids is not None:
+            query["_id"] = {"$in": ids}
+        return [
+            doc async for doc in self.db.delivery_counts.find(query, {"deliveries_by_truck": 1})
+            if any(doc.get("deliveries_by_truck", {}).values())
+        ]
+
+    def zero_count_update(self, doc: dict, run: str, now: str) -> UpdateOne:
+        """Zero a user's counts if they still hold the values read, moving those to archivedByTruck"""
+        counts = {truck: count for truck, count in doc["deliveries_by_truck"].items() if count}
+        return UpdateOne(
+            {
+                "_id": doc["_id"],
+                "resetBy": {"$ne": run},
+                **{f"deliveries_by_truck.{truck}": count for truck, count in counts.items()}
+            },
+            [{"$set": {
+                "resetBy": {"$literal": run},
+                **{
+                    f"archivedByTruck.{truck}": {"$add": [{"$ifNull": [f"$archivedByTruck.{truck}", 0]}, count]}
+                    for truck, count in counts.items()
+                }
+            }}] + self.set_counts_update({truck: 0 for truck in counts}, now)
+        )
+
+    def archived_totals_lookup(self) -> dict:
+        archived = {truck: {"$ifNull": [f"$archivedByTruck.{truck}", 0]} for truck in self.truck_types}
+        return {"$lookup": {
+            "from": "delivery_counts",
+            "localField": "id",
+            "foreignField": "userId",
+            "pipeline": [{"$project": {
+                "_id": 0,
+                "total_deliveries": {"$add": [archived[truck] for truck in self.commission_rates]},
+                "total_commission": {"$add": [
+                    {"$multiply": [archived[truck], rate]} for truck, rate in self.commission_rates.items()
+                ]},
+                **{f"truck_{truck}": archived[truck] for truck in self.truck_types}
+            }}],
+            "as": "totals"
+        }}
+
+    async def finish_reset(self, now: str):
+        # The totals were zeroed with the counts, in the same writes
+        await self.db.delivery_counts.update_many(
+            {"resetBy": {"$exists": True}}, {"$unset": {"archivedByTruck": "", "resetBy": ""}}
+        )
+
+
+def mongo_storage_class(layout: str):
+    """The MongoStorage implementation for a DELIVERY_LAYOUT value"""
+    classes = {"rows": MongoStorage, "dual": DualMongoStorage, "compact": CompactMongoStorage}
+    if layout not in classes:
+        raise ValueError(f"Unknown DELIVERY_LAYOUT {layout!r}, expected one of: {', '.join(LAYOUTS)}")
+    return classes[layout]
+
+
+async def migrate_users(mongo: MongoStorage, user_ids: List[str]):
+    """Write delivery_counts documents for `user_ids` from their rows, never over a newer version"""
+    db = mongo.db
+    versions = {
+        doc["userId"]: doc.get("version", 0)
+        async for doc in db.user_stats.find({"userId": {"$in": user_ids}}, {"_id": 0, "userId": 1, "version": 1})
+    }
+    computed = {
+        doc["userId"]: doc
+        async for doc in db.deliveries.aggregate(mongo.user_stats_pipeline(user_ids))
+    }
+    now = datetime.now(timezone.utc).isoformat()
+    await write_guarded(db.delivery_counts, [
+        {
+            "userId": user_id,
+            **empty_stats(mongo.truck_types),
+            **computed.get(user_id, {}),
+            "version": versions.get(user_id, 0),
+            "updatedAt": now
+        }
+        for user_id in user_ids
+    ])
+
+
+async def migrate_to_compact(mongo: MongoStorage, batch_size: int = MIGRATION_BATCH_SIZE, restart: bool = False,
+                             progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """Build delivery_counts from the row layout, `batch_size` users at a time
+
+    Progress is saved in `counters` after every batch, so an interrupted run
+    picks up where it stopped. Run it while the app is on the `dual` layout:
+    a user's stats version is read before their rows, and documents are only
+    written over older versions, so a write mirrored during the migration is
+    never replaced by the migration's copy.
+    """
+    db = mongo.db
+    if restart:
+        await db.counters.delete_one({"_id": MIGRATION_ID})
+    state = await db.counters.find_one({"_id": MIGRATION_ID}) or {"lastId": None, "migrated": 0}
+
+    while True:
+        query = {"_id": {"$gt": state["lastId"]}} if state["lastId"] is not None else {}
+        users = await db.users.find(query, {"_id": 1, "id": 1}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not users:
+            break
+        await migrate_users(mongo, [user["id"] for user in users])
+
+        state = {"lastId": users[-1]["_id"], "migrated": state["migrated"] + len(users)}
+        await db.counters.update_one({"_id": MIGRATION_ID}, {"$set": state}, upsert=True)
+        if progress is not None:
+            progress(state)
+
+    await db.counters.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"finishedAt": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    return state
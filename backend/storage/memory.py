@@ -0,0 +1,377 @@
+"""
+In-memory storage backend.
+
+Keeps users, delivery counts, stats documents and history snapshots in plain
+dicts inside the process and mirrors MongoStorage's semantics (incremental
+stats with versions, history accumulation, cursor pagination). No network or
+database is needed, which makes it suitable for local load tests and
+profiling of the ASGI app; data is lost when the process exits.
+
+Every method runs to completion without awaiting, so each call is atomic with
+respect to other requests on the event loop.
+"""
+import heapq
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from rollups import FLEET, rollup_expiry, rollup_increments
+from storage.base import FLEET_ROLES, DuplicateUsername, InvalidCursor, Storage, empty_stats, stat_value
+
+
+def _copy(doc: dict) -> dict:
+    """Copy a document and its nested per-truck counts so callers cannot mutate stored state"""
+    doc = dict(doc)
+    if "deliveries_by_truck" in doc:
+        doc["deliveries_by_truck"] = dict(doc["deliveries_by_truck"])
+    return doc
+
+
+class MemoryStorage(Storage):
+    def __init__(self, commission_rates: dict, truck_types: list):
+        super().__init__(commission_rates, truck_types)
+        self._users = {}          # id -> user document
+        self._usernames = {}      # username -> id
+        self._order = []          # ids in insertion order; a cursor is a position in this list
+        self._deliveries = {}     # userId -> {truck_type: {"count", "updatedAt"}}
+        self._stats = {}          # userId -> stats document
+        self._history = {}        # (period, userId) -> snapshot
+        self._events = []         # delivery events not yet folded into checkpoints
+        self._checkpoints = {}    # (userId, truck_type, hour) -> checkpoint
+        self._rollups = {}        # (granularity, userId or FLEET) -> {(bucket, truck_type): bucket document}
+        self._fleet_version = 0
+
+    async def health(self) -> dict:
+        return {"ready": True, "backend": "memory", "users": len(self._users)}
+
+    # ----- users -----
+
+    def _public(self, user: dict) -> dict:
+        return {"id": user["id"], "username": user["username"], "role": user["role"]}
+
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        user = self._users.get(user_id)
+        if user is None:
+            return None
+        return {key: value for key, value in user.items() if key != "password"}
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        user_id = self._usernames.get(username)
+        return dict(self._users[user_id]) if user_id is not None else None
+
+    async def get_users(self, user_ids: List[str]) -> List[dict]:
+        return [self._public(self._users[user_id]) for user_id in dict.fromkeys(user_ids) if user_id in self._users]
+
+    async def list_fleet_users(self) -> List[dict]:
+        return [self._public(user) for user in self._users.values() if user["role"] in FLEET_ROLES]
+
+    async def existing_usernames(self, usernames: List[str]) -> set:
+        return {username for username in usernames if username in self._usernames}
+
+    def _add_user(self, user: dict):
+        if user["username"] in self._usernames:
+            raise DuplicateUsername(user["username"])
+        self._users[user["id"]] = dict(user)
+        self._usernames[user["username"]] = user["id"]
+        self._order.append(user["id"])
+
+    async def insert_user(self, user: dict):
+        self._add_user(user)
+
+    async def insert_users(self, users: List[dict]) -> dict:
+        failed = {}
+        for index, user in enumerate(users):
+            try:
+                self._add_user(user)
+            except DuplicateUsername:
+                failed[index] = "Username already exists"
+        return failed
+
+    async def create_user_deliveries(self, user_ids: List[str]):
+        now = datetime.now(timezone.utc).isoformat()
+        for user_id in user_ids:
+            self._deliveries[user_id] = {truck: {"count": 0, "updatedAt": now} for truck in self.truck_types}
+            self._stats[user_id] = {
+                "userId": user_id,
+                **empty_stats(self.truck_types),
+                "version": 1,
+                "updatedAt": now
+            }
+
+    # ----- deliveries and stats -----
+
+    def _calculate(self, user_id: str) -> dict:
+        """Stats for a user computed from the raw delivery counts"""
+        total_deliveries = 0
+        total_commission = 0.0
+        deliveries_by_truck = {truck: 0 for truck in self.truck_types}
+        for truck_type, row in self._deliveries.get(user_id, {}).items():
+            if truck_type in self.commission_rates:
+                total_deliveries += row["count"]
+                deliveries_by_truck[truck_type] = row["count"]
+                total_commission += row["count"] * self.commission_rates[truck_type]
+        return {
+            "total_deliveries": total_deliveries,
+            "total_commission": round(total_commission, 2),
+            "deliveries_by_truck": deliveries_by_truck
+        }
+
+    def _stats_doc(self, user_id: str) -> dict:
+        doc = self._stats.get(user_id)
+        if doc is None:
+            doc = self._stats[user_id] = {
+                "userId": user_id,
+                **self._calculate(user_id),
+                "version": 1,
+                "updatedAt": datetime.now(timezone.utc).isoformat()
+            }
+        return doc
+
+    async def get_user_stats(self, user_id: str) -> dict:
+        return _copy(self._stats_doc(user_id))
+
+    async def set_delivery_count(self, user_id: str, truck_type: str, count: int) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        rows = self._deliveries.setdefault(user_id, {})
+        previous = rows.get(truck_type, {}).get("count", 0)
+        rows[truck_type] = {"count": count, "updatedAt": now}
+        self._record_rollups([(user_id, truck_type, count - previous)])
+        return self._apply_delta(user_id, truck_type, count - previous, now)
+
+    def _apply_delta(self, user_id: str, truck_type: str, delta: int, now: str) -> dict:
+        if user_id not in self._stats:
+            return _copy(self._stats_doc(user_id))
+        doc = self._stats[user_id]
+        doc["total_deliveries"] += delta
+        doc["total_commission"] += delta * self.commission_rates[truck_type]
+        doc["deliveries_by_truck"][truck_type] = doc["deliveries_by_truck"].get(truck_type, 0) + delta
+        doc["version"] += 1
+        doc["updatedAt"] = now
+        return _copy(doc)
+
+    async def record_deliveries(self, user_id: str, truck_type: str, amount: int) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        self._events.append({
+            "id": str(uuid.uuid4()),
+            "userId": user_id,
+            "truck_type": truck_type,
+            "amount": amount,
+            "createdAt": now
+        })
+        rows = self._deliveries.setdefault(user_id, {})
+        rows[truck_type] = {"count": rows.get(truck_type, {}).get("count", 0) + amount, "updatedAt": now}
+        self._record_rollups([(user_id, truck_type, amount)])
+        return self._apply_delta(user_id, truck_type, amount, now)
+
+    async def set_delivery_counts(self, cells: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        changes = []
+        for (user_id, truck_type), count in cells.items():
+            rows = self._deliveries.setdefault(user_id, {})
+            changes.append((user_id, truck_type, count - rows.get(truck_type, {}).get("count", 0)))
+            rows[truck_type] = {"count": count, "updatedAt": now}
+        self._record_rollups(changes)
+
+        user_ids = list({user_id for user_id, _ in cells})
+        await self.refresh_user_stats(user_ids)
+        return {user_id: _copy(self._stats[user_id]) for user_id in user_ids if user_id in self._stats}
+
+    async def refresh_user_stats(self, user_ids: Optional[List[str]] = None):
+        now = datetime.now(timezone.utc).isoformat()
+        # Like the Mongo pipeline, only users with delivery rows get a stats document
+        for user_id in (user_ids if user_ids is not None else list(self._deliveries)):
+            if user_id not in self._deliveries:
+                continue
+            previous = self._stats.get(user_id)
+            self._stats[user_id] = {
+                **(previous or {}),
+                "userId": user_id,
+                **self._calculate(user_id),
+                "version": previous.get("version", 0) + 1 if previous else 1,
+                "updatedAt": now
+            }
+
+    async def delivery_rows(self) -> List[dict]:
+        return [
+            {"userId": user_id, "truck_type": truck_type, "count": row["count"]}
+            for user_id, rows in self._deliveries.items()
+            for truck_type, row in rows.items()
+            if row["count"] > 0
+        ]
+
+    def _fleet_row(self, user: dict) -> dict:
+        return {**self._public(user), **self._calculate(user["id"])}
+
+    def _decode_cursor(self, cursor: str) -> int:
+        try:
+            position = int(cursor)
+        except ValueError:
+            raise InvalidCursor(cursor)
+        if not 0 < position <= len(self._order):
+            raise InvalidCursor(cursor)
+        return position
+
+    async def fleet_stats_page(self, cursor: Optional[str] = None, limit: Optional[int] = None):
+        position = self._decode_cursor(cursor) if cursor else 0
+        rows = []
+        for user_id in self._order[position:]:
+            position += 1
+            user = self._users[user_id]
+            if user["role"] in FLEET_ROLES:
+                rows.append(self._fleet_row(user))
+                if limit is not None and len(rows) == limit:
+                    return rows, str(position)
+        return rows, None
+
+    async def iter_fleet_stats(self, batch_size: int = 500):
+        cursor = None
+        while True:
+            rows, cursor = await self.fleet_stats_page(cursor, batch_size)
+            for row in rows:
+                yield row
+            if cursor is None:
+                return
+
+    async def reset_month(self, period: str) -> int:
+        now = datetime.now(timezone.utc).isoformat()
+        for user in self._users.values():
+            if user["role"] not in FLEET_ROLES:
+                continue
+            row = self._fleet_row(user)
+            key = (period, user["id"])
+            snapshot = self._history.get(key)
+            if snapshot is None:
+                self._history[key] = {
+                    "period": period,
+                    "userId": user["id"],
+                    "username": user["username"],
+                    "role": user["role"],
+                    "total_deliveries": row["total_deliveries"],
+                    "total_commission": row["total_commission"],
+                    "deliveries_by_truck": row["deliveries_by_truck"],
+                    "archivedAt": now
+                }
+            else:
+                # Archiving the same period twice adds the new counts to the existing snapshot
+                by_truck = snapshot["deliveries_by_truck"]
+                snapshot.update({
+                    "username": user["username"],
+                    "role": user["role"],
+                    "total_deliveries": snapshot["total_deliveries"] + row["total_deliveries"],
+                    "total_commission": round(snapshot["total_commission"] + row["total_commission"], 2),
+                    "deliveries_by_truck": {
+                        truck: by_truck.get(truck, 0) + row["deliveries_by_truck"][truck]
+                        for truck in self.truck_types
+                    },
+                    "archivedAt": now
+                })
+
+        reset = 0
+        for rows in self._deliveries.values():
+            for row in rows.values():
+                if row["count"]:
+                    row.update(count=0, updatedAt=now)
+                    reset += 1
+        for doc in self._stats.values():
+            doc.update(empty_stats(self.truck_types), updatedAt=now)
+            doc["version"] = doc.get("version", 0) + 1
+        return reset
+
+    # ----- rollups -----
+
+    def _record_rollups(self, changes: List[Tuple[str, str, int]]):
+        now = datetime.now(timezone.utc)
+        expires = rollup_expiry(now)
+        for (granularity, bucket, owner, truck_type), delta in rollup_increments(changes, now).items():
+            doc = self._rollups.setdefault((granularity, owner), {}).setdefault((bucket, truck_type), {
+                "bucket": bucket,
+                "truck_type": truck_type,
+                "deliveries": 0,
+                "commission": 0.0,
+                "expiresAt": expires[granularity]
+            })
+            doc["deliveries"] += delta
+            doc["commission"] += delta * self.commission_rates[truck_type]
+
+    async def delivery_timeseries(self, granularity: str, start: str, end: str,
+                                  user_id: Optional[str] = None) -> List[dict]:
+        buckets = self._rollups.get((granularity, user_id if user_id is not None else FLEET), {})
+        now = datetime.now(timezone.utc)
+        # Expired buckets are dropped when read, standing in for MongoDB's TTL index
+        for key in [key for key, doc in buckets.items() if doc["expiresAt"] <= now]:
+            del buckets[key]
+        return [
+            {key: value for key, value in doc.items() if key != "expiresAt"}
+            for (bucket, _), doc in buckets.items()
+            if start <= bucket <= end
+        ]
+
+    # ----- leaderboard -----
+
+    def _fleet_stats(self):
+        for user_id, doc in self._stats.items():
+            user = self._users.get(user_id)
+            if user is not None and user["role"] in FLEET_ROLES:
+                yield user, doc
+
+    async def leaderboard(self, field: str, limit: int) -> List[dict]:
+        top = heapq.nsmallest(
+            limit, self._fleet_stats(), key=lambda item: (-stat_value(item[1], field), item[0]["id"])
+        )
+        return [
+            {
+                **self._public(user),
+                "total_deliveries": doc["total_deliveries"],
+                "total_commission": doc["total_commission"],
+                "deliveries_by_truck": dict(doc["deliveries_by_truck"])
+            }
+            for user, doc in top
+        ]
+
+    async def rank_of(self, user_id: str, field: str):
+        value = stat_value(self._stats_doc(user_id), field)
+        ahead = sum(1 for _, doc in self._fleet_stats() if stat_value(doc, field) > value)
+        return ahead + 1, value
+
+    async def fleet_size(self) -> int:
+        return sum(1 for user in self._users.values() if user["role"] in FLEET_ROLES)
+
+    # ----- delivery events -----
+
+    async def compact_delivery_events(self, before: str) -> int:
+        folded = [event for event in self._events if event["createdAt"] < before]
+        self._events = [event for event in self._events if event["createdAt"] >= before]
+        for event in folded:
+            hour = event["createdAt"][:13]
+            key = (event["userId"], event["truck_type"], hour)
+            checkpoint = self._checkpoints.setdefault(key, {
+                "userId": event["userId"],
+                "truck_type": event["truck_type"],
+                "hour": hour,
+                "amount": 0,
+                "events": 0
+            })
+            checkpoint["amount"] += event["amount"]
+            checkpoint["events"] += 1
+        return len(folded)
+
+    # ----- history and versions -----
+
+    async def history(self, start: Optional[str] = None, end: Optional[str] = None,
+                      user_id: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        snapshots = [
+            snapshot for (period, snapshot_user), snapshot in self._history.items()
+            if (user_id is None or snapshot_user == user_id)
+            and (not start or period >= start)
+            and (not end or period <= end)
+        ]
+        snapshots.sort(key=lambda snapshot: (snapshot["period"], snapshot["username"]))
+        if fields is not None:
+            return [_copy({field: snapshot[field] for field in fields if field in snapshot}) for snapshot in snapshots]
+        return [_copy(snapshot) for snapshot in snapshots]
+
+    async def fleet_version(self) -> int:
+        return self._fleet_version
+
+    async def bump_fleet_version(self):
+        self._fleet_version += 1
@@ -0,0 +1,920 @@
+"""
+MongoDB storage backend (Motor).
+
+Per-user stats live in a materialized `user_stats` collection that is kept in
+step with `deliveries`; fleet-wide listings and monthly archives are computed
+server-side with aggregation pipelines. Increments are also appended to
+`delivery_events`, which a background compactor folds into hourly
+`delivery_checkpoints`.
+
+The Motor client is created by open() (the app lifespan calls startup()), not
+at import time. Warmup pings the server and pre-opens pooled connections so
+the first requests do not pay for server selection and TLS handshakes.
+"""
+import asyncio
+import base64
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from indexes import ensure_indexes
+from rollups import FLEET, rollup_expiry, rollup_increments
+from storage.base import (
+    FLEET_ROLES, DuplicateUsername, InvalidCursor, ResetInProgress, Storage, empty_stats, stat_value
+)
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PING_TIMEOUT = 2.0
+# counters documents of the leases, and how long a run may hold one before another process may take over
+COMPACTION_LEASE_ID = "event_compactor"
+COMPACTION_LEASE_SECONDS = 600
+RESET_LEASE_ID = "monthly_reset"
+RESET_LEASE_SECONDS = 600
+# Checkpoints remember this many of the runs folded into them, so a retried run is not counted twice
+CHECKPOINT_RUNS_KEPT = 10
+
+
+def client_options_from_env(environ) -> dict:
+    """Motor client options (pool sizing and timeouts) from MONGO_* environment variables"""
+    options = {
+        "maxPoolSize": int(environ.get("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(environ.get("MONGO_MIN_POOL_SIZE", "2")),
+        "serverSelectionTimeoutMS": int(environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(environ.get("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    }
+    # Unset (or 0) keeps idle connections open indefinitely
+    max_idle = int(environ.get("MONGO_MAX_IDLE_TIME_MS", "0"))
+    if max_idle > 0:
+        options["maxIdleTimeMS"] = max_idle
+    return options
+
+
+def encode_cursor(last_id: ObjectId) -> str:
+    """Opaque pagination cursor for the user after `last_id`"""
+    return base64.urlsafe_b64encode(last_id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, InvalidId):
+        raise InvalidCursor(cursor)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection counts across the client's pools, for the readiness endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, field: str, amount: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def connection_created(self, event):
+        self._add("open")
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_checked_out(self, event):
+        self._add("in_use")
+
+    def connection_checked_in(self, event):
+        self._add("in_use", -1)
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures")
+
+    def pool_cleared(self, event):
+        self._add("pool_clears")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+            }
+
+
+class MongoStorage(Storage):
+    # Collections holding the delivery counts and one stats document per user (see storage.compact
+    # for the alternative)
+    COUNTS_COLLECTION = "deliveries"
+    STATS_COLLECTION = "user_stats"
+
+    def __init__(self, db, commission_rates: dict, truck_types: list, client=None):
+        super().__init__(commission_rates, truck_types)
+        self.db = db
+        self.client = client
+        self.mongo_url = None
+        self.db_name = None
+        self.client_options = {}
+        self.event_listeners = []
+        self.pool_monitor = PoolMonitor()
+        self.instance_id = uuid.uuid4().hex   # owner of the compactor lease
+
+    @classmethod
+    def from_url(cls, mongo_url: str, db_name: str, commission_rates: dict, truck_types: list,
+                 client_options: dict = None, event_listeners=()):
+        """A storage whose client is created later by open(), with SSL and the given pool options"""
+        storage = cls(None, commission_rates, truck_types)
+        storage.mongo_url = mongo_url
+        storage.db_name = db_name
+        storage.client_options = client_options or {}
+        storage.event_listeners = list(event_listeners)
+        return storage
+
+    async def open(self):
+        """Create the Motor client; connections themselves are opened lazily or by warmup()"""
+        if self.db is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            self.mongo_url,
+            event_listeners=[*self.event_listeners, self.pool_monitor],
+            tls=True,
+            tlsAllowInvalidCertificates=False,
+            retryWrites=True,
+            **self.client_options
+        )
+        self.db = self.client[self.db_name]
+
+    async def warmup(self):
+        """Select a server, then check out as many connections as minPoolSize at once"""
+        start = time.perf_counter()
+        await self.db.command("ping")
+        connections = max(1, self.client_options.get("minPoolSize", 0))
+        await asyncio.gather(*(self.db.command("ping") for _ in range(connections)))
+        logger.info(f"MongoDB warmed up in {(time.perf_counter() - start) * 1000:.0f} ms "
+                    f"({self.pool_monitor.open} connections open)")
+
+    async def startup(self):
+        await self.open()
+        try:
+            await self.warmup()
+        except PyMongoError as e:
+            # Start anyway; the readiness endpoint reports the database as unavailable
+            logger.error(f"MongoDB warmup failed: {e}")
+        await ensure_indexes(self.db, self.truck_types)
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    async def health(self) -> dict:
+        if self.db is None:
+            return {"ready": False, "backend": "mongo", "error": "Not connected"}
+        pool = {
+            **self.pool_monitor.snapshot(),
+            "max_pool_size": self.client.options.pool_options.max_pool_size,
+            "min_pool_size": self.client.options.pool_options.min_pool_size,
+        }
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.db.command("ping"), HEALTH_PING_TIMEOUT)
+        except (PyMongoError, asyncio.TimeoutError) as e:
+            logger.warning(f"MongoDB readiness ping failed: {e!r}")
+            return {"ready": False, "backend": "mongo", "error": "Database unavailable", "pool": pool}
+        return {
+            "ready": True,
+            "backend": "mongo",
+            "ping_ms": round((time.perf_counter() - start) * 1000, 1),
+            "pool": pool
+        }
+
+    # ----- pipelines -----
+
+    def delivery_totals(self, prefix: str, count_field: str = "count") -> dict:
+        """$group accumulators that total the delivery rows at `prefix` and apply the commission rates"""
+        truck_type = f"{prefix}truck_type"
+        count = {"$ifNull": [f"{prefix}{count_field}", 0]}
+        rate = {
+            "$switch": {
+                "branches": [
+                    {"case": {"$eq": [truck_type, truck]}, "then": truck_rate}
+                    for truck, truck_rate in self.commission_rates.items()
+                ],
+                "default": 0
+            }
+        }
+
+        totals = {
+            "total_deliveries": {
+                "$sum": {"$cond": [{"$in": [truck_type, list(self.commission_rates)]}, count, 0]}
+            },
+            "total_commission": {"$sum": {"$multiply": [count, rate]}}
+        }
+        for truck in self.truck_types:
+            totals[f"truck_{truck}"] = {
+                "$sum": {"$cond": [{"$eq": [truck_type, truck]}, count, 0]}
+            }
+        return totals
+
+    def stats_projection(self, prefix: str = "") -> dict:
+        """$project fields that turn delivery_totals() output found at `prefix` into the stats shape"""
+        return {
+            "total_deliveries": {"$ifNull": [f"${prefix}total_deliveries", 0]},
+            "total_commission": {
+                "$round": [{"$toDouble": {"$ifNull": [f"${prefix}total_commission", 0]}}, 2]
+            },
+            "deliveries_by_truck": {
+                truck: {"$ifNull": [f"${prefix}truck_{truck}", 0]} for truck in self.truck_types
+            }
+        }
+
+    def all_users_stats_pipeline(self, after: Optional[ObjectId] = None, limit: Optional[int] = None) -> list:
+        """Build the aggregation that computes drivers' and helpers' stats in one query"""
+        # Users come back in _id order (optionally after a cursor). Totals are grouped per
+        # user inside the lookup so results stream from the cursor without a blocking stage.
+        match = {"role": {"$in": FLEET_ROLES}}
+        if after is not None:
+            match["_id"] = {"$gt": after}
+
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"_id": 1}}
+        ]
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+
+        return pipeline + [
+            self.totals_lookup(),
+            {"$unwind": {"path": "$totals", "preserveNullAndEmptyArrays": True}},
+            {"$project": {
+                "id": 1,
+                "username": 1,
+                "role": 1,
+                **self.stats_projection("totals.")
+            }}
+        ]
+
+    def totals_lookup(self) -> dict:
+        """$lookup stage that puts a user's delivery_totals() fields into `totals`"""
+        return {"$lookup": {
+            "from": "deliveries",
+            "localField": "id",
+            "foreignField": "userId",
+            "pipeline": [{"$group": {"_id": None, **self.delivery_totals("$")}}],
+            "as": "totals"
+        }}
+
+    def user_stats_pipeline(self, user_ids: Optional[List[str]] = None) -> list:
+        """Build the aggregation over deliveries that recomputes user_stats documents"""
+        match = {"userId": {"$in": user_ids}} if user_ids is not None else {}
+        return [
+            {"$match": match},
+            {"$group": {"_id": "$userId", **self.delivery_totals("$")}},
+            {"$project": {"_id": 0, "userId": "$_id", **self.stats_projection()}}
+        ]
+
+    def leaderboard_pipeline(self, field: str, limit: int) -> list:
+        """Build the aggregation that walks the stats collection down `field` and joins the top users"""
+        # The sort is served by the descending leaderboard index, so the pipeline streams and
+        # stops after `limit` drivers/helpers instead of ranking the whole fleet.
+        return [
+            {"$sort": {field: -1, "userId": 1}},
+            {"$lookup": {
+                "from": "users",
+                "localField": "userId",
+                "foreignField": "id",
+                "pipeline": [{"$project": {"_id": 0, "username": 1, "role": 1}}],
+                "as": "user"
+            }},
+            {"$unwind": "$user"},
+            {"$match": {"user.role": {"$in": FLEET_ROLES}}},
+            {"$limit": limit},
+            {"$project": {
+                "_id": 0,
+                "id": "$userId",
+                "username": "$user.username",
+                "role": "$user.role",
+                "total_deliveries": 1,
+                "total_commission": 1,
+                "deliveries_by_truck": 1
+            }}
+        ]
+
+    def archived_totals_lookup(self) -> dict:
+        """$lookup stage that puts the delivery_totals() of the counts set aside by a reset into `totals`"""
+        return {"$lookup": {
+            "from": "deliveries",
+            "localField": "id",
+            "foreignField": "userId",
+            "pipeline": [
+                {"$match": {"archivedCount": {"$gt": 0}}},
+                {"$group": {"_id": None, **self.delivery_totals("$", "archivedCount")}}
+            ],
+            "as": "totals"
+        }}
+
+    def archive_month_pipeline(self, period: str, archived_at: str) -> list:
+        """Build the aggregation that snapshots the counts set aside by a reset into delivery_history"""
+        # Archiving the same period twice adds the new counts to the existing snapshot
+        accumulate = {
+            "username": "$$new.username",
+            "role": "$$new.role",
+            "total_deliveries": {"$add": ["$total_deliveries", "$$new.total_deliveries"]},
+            "total_commission": {"$round": [{"$add": ["$total_commission", "$$new.total_commission"]}, 2]},
+            "deliveries_by_truck": {
+                truck: {"$add": [
+                    {"$ifNull": [f"$deliveries_by_truck.{truck}", 0]},
+                    f"$$new.deliveries_by_truck.{truck}"
+                ]}
+                for truck in self.truck_types
+            },
+            "archivedAt": "$$new.archivedAt"
+        }
+        return [
+            {"$match": {"role": {"$in": FLEET_ROLES}}},
+            self.archived_totals_lookup(),
+            {"$unwind": {"path": "$totals", "preserveNullAndEmptyArrays": True}},
+            {"$project": {
+                "_id": 0,
+                "period": {"$literal": period},
+                "userId": "$id",
+                "username": 1,
+                "role": 1,
+                **self.stats_projection("totals."),
+                "archivedAt": {"$literal": archived_at}
+            }},
+            {"$merge": {
+                "into": "delivery_history",
+                "on": ["period", "userId"],
+                "whenMatched": [{"$set": accumulate}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+
+    def subtract_archived_pipeline(self, now: str) -> list:
+        """Build the aggregation over deliveries that takes the counts set aside by a reset off user_stats"""
+        subtract = {
+            "total_deliveries": {"$subtract": ["$total_deliveries", "$$new.total_deliveries"]},
+            "total_commission": {"$round": [{"$subtract": ["$total_commission", "$$new.total_commission"]}, 2]},
+            "deliveries_by_truck": {
+                truck: {"$subtract": [
+                    {"$ifNull": [f"$deliveries_by_truck.{truck}", 0]},
+                    f"$$new.deliveries_by_truck.{truck}"
+                ]}
+                for truck in self.truck_types
+            },
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            "updatedAt": {"$literal": now}
+        }
+        return [
+            {"$match": {"archivedCount": {"$gt": 0}}},
+            {"$group": {"_id": "$userId", **self.delivery_totals("$", "archivedCount")}},
+            {"$project": {"_id": 0, "userId": "$_id", **self.stats_projection()}},
+            {"$merge": {
+                "into": "user_stats",
+                "on": "userId",
+                "whenMatched": [{"$set": subtract}],
+                # Without a stats document there is nothing to subtract from; it is built from the rows
+                "whenNotMatched": "discard"
+            }}
+        ]
+
+    def checkpoint_events_pipeline(self, run: str) -> list:
+        """Build the aggregation that folds the events claimed by `run` into hourly checkpoints"""
+        already_folded = {"$in": [run, {"$ifNull": ["$runs", []]}]}
+        return [
+            {"$match": {"compactedBy": run}},
+            {"$group": {
+                "_id": {
+                    "userId": "$userId",
+                    "truck_type": "$truck_type",
+                    "hour": {"$substrBytes": ["$createdAt", 0, 13]}
+                },
+                "amount": {"$sum": "$amount"},
+                "events": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "userId": "$_id.userId",
+                "truck_type": "$_id.truck_type",
+                "hour": "$_id.hour",
+                "amount": 1,
+                "events": 1,
+                "runs": [run]
+            }},
+            {"$merge": {
+                "into": "delivery_checkpoints",
+                "on": ["userId", "truck_type", "hour"],
+                "whenMatched": [{"$set": {
+                    "amount": {"$cond": [already_folded, "$amount", {"$add": ["$amount", "$$new.amount"]}]},
+                    "events": {"$cond": [already_folded, "$events", {"$add": ["$events", "$$new.events"]}]},
+                    "runs": {"$cond": [
+                        already_folded,
+                        "$runs",
+                        {"$slice": [{"$concatArrays": [{"$ifNull": ["$runs", []]}, [run]]}, -CHECKPOINT_RUNS_KEPT]}
+                    ]}
+                }}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+
+    # ----- users -----
+
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        return await self.db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        return await self.db.users.find_one({"username": username}, {"_id": 0})
+
+    async def get_users(self, user_ids: List[str]) -> List[dict]:
+        return await self.db.users.find(
+            {"id": {"$in": user_ids}},
+            {"_id": 0, "id": 1, "username": 1, "role": 1}
+        ).to_list(None)
+
+    async def list_fleet_users(self) -> List[dict]:
+        return await self.db.users.find(
+            {"role": {"$in": FLEET_ROLES}},
+            {"_id": 0, "id": 1, "username": 1, "role": 1}
+        ).to_list(None)
+
+    async def existing_usernames(self, usernames: List[str]) -> set:
+        return {
+            user["username"]
+            async for user in self.db.users.find({"username": {"$in": usernames}}, {"_id": 0, "username": 1})
+        }
+
+    async def insert_user(self, user: dict):
+        try:
+            await self.db.users.insert_one(dict(user))
+        except DuplicateKeyError:
+            raise DuplicateUsername(user["username"])
+
+    async def insert_users(self, users: List[dict]) -> dict:
+        # Unordered so one bad row does not stop the rest
+        failed = {}
+        try:
+            await self.db.users.insert_many([dict(user) for user in users], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                message = "Username already exists" if write_error.get("code") == 11000 else write_error.get("errmsg")
+                failed[write_error["index"]] = message
+        return failed
+
+    def initial_delivery_rows(self, user_id: str) -> list:
+        """Zeroed delivery rows for every truck type, created alongside a new user"""
+        now = datetime.now(timezone.utc).isoformat()
+        return [
+            {
+                "id": str(uuid.uuid4()),
+                "userId": user_id,
+                "truck_type": truck,
+                "count": 0,
+                "updatedAt": now
+            }
+            for truck in self.truck_types
+        ]
+
+    def initial_user_stats(self, user_id: str) -> dict:
+        """Stats document for a newly created user"""
+        return {
+            "userId": user_id,
+            **empty_stats(self.truck_types),
+            "version": 1,
+            "updatedAt": datetime.now(timezone.utc).isoformat()
+        }
+
+    async def create_user_deliveries(self, user_ids: List[str]):
+        await self.db.deliveries.insert_many(
+            [row for user_id in user_ids for row in self.initial_delivery_rows(user_id)],
+            ordered=False
+        )
+        await self.db.user_stats.insert_many(
+            [self.initial_user_stats(user_id) for user_id in user_ids],
+            ordered=False
+        )
+
+    # ----- deliveries and stats -----
+
+    async def calculate_user_stats(self, user_id: str) -> dict:
+        """Calculate total deliveries and commission for a user from the raw delivery rows"""
+        deliveries = await self.db.deliveries.find({"userId": user_id}, {"_id": 0}).to_list(None)
+
+        total_deliveries = 0
+        total_commission = 0.0
+        deliveries_by_truck = {truck: 0 for truck in self.truck_types}
+
+        for delivery in deliveries:
+            truck_type = delivery.get("truck_type")
+            count = delivery.get("count", 0)
+
+            if truck_type in self.commission_rates:
+                total_deliveries += count
+                deliveries_by_truck[truck_type] = count
+                total_commission += count * self.commission_rates[truck_type]
+
+        return {
+            "total_deliveries": total_deliveries,
+            "total_commission": round(total_commission, 2),
+            "deliveries_by_truck": deliveries_by_truck
+        }
+
+    async def backfill_user_stats(self, user_id: str) -> dict:
+        """Create the stats document for a user that predates materialized stats"""
+        stats = await self.calculate_user_stats(user_id)
+        return await self.db[self.STATS_COLLECTION].find_one_and_update(
+            {"userId": user_id},
+            {"$setOnInsert": {**stats, "version": 1, "updatedAt": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def get_user_stats(self, user_id: str) -> dict:
+        doc = await self.db[self.STATS_COLLECTION].find_one({"userId": user_id}, {"_id": 0})
+        if doc is None:
+            return await self.backfill_user_stats(user_id)
+        return doc
+
+    async def set_delivery_count(self, user_id: str, truck_type: str, count: int) -> dict:
+        """Set a delivery count and fold the change into the user's stats document"""
+        now = datetime.now(timezone.utc).isoformat()
+        previous = await self.db.deliveries.find_one_and_update(
+            {"userId": user_id, "truck_type": truck_type},
+            {"$set": {"count": count, "updatedAt": now}},
+            projection={"_id": 0, "count": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        delta = count - (previous or {}).get("count", 0)
+
+        doc, _ = await asyncio.gather(
+            self.inc_user_stats(user_id, truck_type, delta, now),
+            self.record_rollups([(user_id, truck_type, delta)])
+        )
+        if doc is None:
+            doc = await self.backfill_user_stats(user_id)
+        return doc
+
+    async def inc_user_stats(self, user_id: str, truck_type: str, delta: int, now: str) -> Optional[dict]:
+        """Fold a change of `delta` deliveries into the stats document; None if it does not exist yet"""
+        return await self.db[self.STATS_COLLECTION].find_one_and_update(
+            {"userId": user_id},
+            {
+                "$inc": {
+                    "total_deliveries": delta,
+                    "total_commission": delta * self.commission_rates[truck_type],
+                    f"deliveries_by_truck.{truck_type}": delta,
+                    "version": 1
+                },
+                "$set": {"updatedAt": now}
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def delivery_event(self, user_id: str, truck_type: str, amount: int, now: str) -> dict:
+        return {
+            "id": str(uuid.uuid4()),
+            "userId": user_id,
+            "truck_type": truck_type,
+            "amount": amount,
+            "createdAt": now
+        }
+
+    async def record_deliveries(self, user_id: str, truck_type: str, amount: int) -> dict:
+        """Log a delivery event and $inc the count, stats and rollups; the writes are independent"""
+        now = datetime.now(timezone.utc).isoformat()
+        _, _, doc, _ = await asyncio.gather(
+            self.db.delivery_events.insert_one(self.delivery_event(user_id, truck_type, amount, now)),
+            self.db.deliveries.update_one(
+                {"userId": user_id, "truck_type": truck_type},
+                {"$inc": {"count": amount}, "$set": {"updatedAt": now}},
+                upsert=True
+            ),
+            self.inc_user_stats(user_id, truck_type, amount, now),
+            self.record_rollups([(user_id, truck_type, amount)])
+        )
+        if doc is None:
+            # Built from the delivery rows, which already include this increment
+            doc = await self.backfill_user_stats(user_id)
+        return doc
+
+    async def set_delivery_counts(self, cells: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat()
+        user_ids = list({user_id for user_id, _ in cells})
+        # Each update stores the count it replaces under this call's id, so one read afterwards
+        # gives the change every cell made, whatever concurrent writes did to the same cells
+        write = uuid.uuid4().hex
+        await self.db.deliveries.bulk_write(
+            [
+                UpdateOne(
+                    {"userId": user_id, "truck_type": truck_type},
+                    [{"$set": {
+                        f"replaced.{write}": {"$ifNull": ["$count", 0]},
+                        "count": {"$literal": count},
+                        "updatedAt": {"$literal": now}
+                    }}],
+                    upsert=True
+                )
+                for (user_id, truck_type), count in cells.items()
+            ],
+            ordered=False
+        )
+        replaced = {"userId": {"$in": user_ids}, f"replaced.{write}": {"$exists": True}}
+        previous = {
+            (row["userId"], row["truck_type"]): row["replaced"][write]
+            async for row in self.db.deliveries.find(
+                replaced, {"_id": 0, "userId": 1, "truck_type": 1, f"replaced.{write}": 1}
+            )
+        }
+        await self.db.deliveries.update_many(replaced, {"$unset": {f"replaced.{write}": ""}})
+
+        changes = [
+            (user_id, truck_type, count - previous.get((user_id, truck_type), count))
+            for (user_id, truck_type), count in cells.items()
+        ]
+        # Stats move by the same changes, so they commute with increments and resets in flight
+        await asyncio.gather(self.inc_users_stats(changes, now), self.record_rollups(changes))
+        docs = {
+            doc["userId"]: doc
+            async for doc in self.db.user_stats.find({"userId": {"$in": user_ids}}, {"_id": 0})
+        }
+        for user_id in user_ids:
+            if user_id not in docs:
+                # Built from the delivery rows, which already include this write
+                docs[user_id] = await self.backfill_user_stats(user_id)
+        return docs
+
+    async def inc_users_stats(self, changes: List[Tuple[str, str, int]], now: str):
+        """Fold (user id, truck type, delta) changes into the existing stats documents, one write per user"""
+        deltas_by_user = {}
+        for user_id, truck_type, delta in changes:
+            deltas = deltas_by_user.setdefault(user_id, {})
+            deltas[truck_type] = deltas.get(truck_type, 0) + delta
+        await self.db.user_stats.bulk_write(
+            [
+                UpdateOne({"userId": user_id}, {
+                    "$inc": {
+                        "total_deliveries": sum(deltas.values()),
+                        "total_commission": sum(delta * self.commission_rates[truck] for truck, delta in deltas.items()),
+                        **{f"deliveries_by_truck.{truck}": delta for truck, delta in deltas.items()},
+                        "version": 1
+                    },
+                    "$set": {"updatedAt": now}
+                })
+                for user_id, deltas in deltas_by_user.items()
+            ],
+            ordered=False
+        )
+
+    async def refresh_user_stats(self, user_ids: Optional[List[str]] = None):
+        pipeline = self.user_stats_pipeline(user_ids) + [
+            {"$addFields": {"version": 1, "updatedAt": datetime.now(timezone.utc).isoformat()}},
+            {"$merge": {
+                "into": "user_stats",
+                "on": "userId",
+                "whenMatched": [{"$replaceWith": {"$mergeObjects": [
+                    "$$ROOT",
+                    "$$new",
+                    {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}
+                ]}}],
+                "whenNotMatched": "insert"
+            }}
+        ]
+        await self.db.deliveries.aggregate(pipeline).to_list(None)
+
+    async def delivery_rows(self) -> List[dict]:
+        return await self.db.deliveries.find(
+            {"count": {"$gt": 0}},
+            {"_id": 0, "userId": 1, "truck_type": 1, "count": 1}
+        ).to_list(None)
+
+    async def fleet_stats_page(self, cursor: Optional[str] = None, limit: Optional[int] = None):
+        after = decode_cursor(cursor) if cursor else None
+        users = await self.db.users.aggregate(self.all_users_stats_pipeline(after, limit)).to_list(None)
+        last_id = users[-1]["_id"] if users else None
+        for user in users:
+            del user["_id"]
+
+        next_cursor = None
+        if limit is not None and len(users) == limit:
+            next_cursor = encode_cursor(last_id)
+        return users, next_cursor
+
+    async def iter_fleet_stats(self, batch_size: int = 500):
+        async for user in self.db.users.aggregate(self.all_users_stats_pipeline(), batchSize=batch_size):
+            del user["_id"]
+            yield user
+
+    async def reset_month(self, period: str) -> int:
+        # Each non-zero count is zeroed only if it still holds the value read, and that value is
+        # moved to a side field in the same write; counts changed in between are read again and
+        # retried. The side fields are then archived, and taken off the stats, server-side. So
+        # whatever a concurrent increment or set does, the archive holds exactly what was zeroed
+        # and no count goes negative. Resets are serialized by a lease: the side fields of a
+        # reset that died part-way are archived by the next one.
+        if not await self._acquire_lease(RESET_LEASE_ID, RESET_LEASE_SECONDS):
+            raise ResetInProgress(period)
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            reset = await self.zero_counts(uuid.uuid4().hex, now)
+            await self.db.users.aggregate(self.archive_month_pipeline(period, now)).to_list(None)
+            await self.finish_reset(now)
+            return reset
+        finally:
+            await self._release_lease(RESET_LEASE_ID)
+
+    async def counts_to_reset(self, run: str, ids: Optional[list] = None) -> List[dict]:
+        """The non-zero delivery rows (optionally among `ids`) that reset `run` has not zeroed"""
+        query = {"count": {"$exists": True, "$ne": 0}, "resetBy": {"$ne": run}}
+        if ids is not None:
+            query["_id"] = {"$in": ids}
+        return await self.db.deliveries.find(query, {"count": 1}).to_list(None)
+
+    def zero_count_update(self, row: dict, run: str, now: str) -> UpdateOne:
+        """Zero a row if it still holds the count read, moving that count to archivedCount"""
+        return UpdateOne(
+            {"_id": row["_id"], "count": row["count"], "resetBy": {"$ne": run}},
+            {"$set": {"count": 0, "resetBy": run, "updatedAt": now}, "$inc": {"archivedCount": row["count"]}}
+        )
+
+    async def zero_counts(self, run: str, now: str) -> int:
+        """Zero every non-zero count once, retrying those changed since they were read"""
+        zeroed = 0
+        docs = await self.counts_to_reset(run)
+        while docs:
+            result = await self.db[self.COUNTS_COLLECTION].bulk_write(
+                [self.zero_count_update(doc, run, now) for doc in docs], ordered=False
+            )
+            zeroed += result.modified_count
+            if result.modified_count == len(docs):
+                break
+            docs = await self.counts_to_reset(run, [doc["_id"] for doc in docs])
+        return zeroed
+
+    async def finish_reset(self, now: str):
+        """Take the archived counts off user_stats, then clear them"""
+        await self.db.deliveries.aggregate(self.subtract_archived_pipeline(now)).to_list(None)
+        await self.db.deliveries.update_many(
+            {"resetBy": {"$exists": True}}, {"$unset": {"archivedCount": "", "resetBy": ""}}
+        )
+
+    # ----- rollups -----
+
+    async def record_rollups(self, changes: List[Tuple[str, str, int]]):
+        """Add (user id, truck type, delta) count changes to the current day, week and month buckets"""
+        now = datetime.now(timezone.utc)
+        increments = rollup_increments(changes, now)
+        if not increments:
+            return
+        expires = rollup_expiry(now)
+        await self.db.delivery_rollups.bulk_write(
+            [
+                UpdateOne(
+                    {"granularity": granularity, "bucket": bucket, "userId": owner, "truck_type": truck_type},
+                    {
+                        "$inc": {"deliveries": delta, "commission": delta * self.commission_rates[truck_type]},
+                        "$setOnInsert": {"expiresAt": expires[granularity]}
+                    },
+                    upsert=True
+                )
+                for (granularity, bucket, owner, truck_type), delta in increments.items()
+            ],
+            ordered=False
+        )
+
+    async def delivery_timeseries(self, granularity: str, start: str, end: str,
+                                  user_id: Optional[str] = None) -> List[dict]:
+        return await self.db.delivery_rollups.find(
+            {
+                "granularity": granularity,
+                "userId": user_id if user_id is not None else FLEET,
+                "bucket": {"$gte": start, "$lte": end}
+            },
+            {"_id": 0, "bucket": 1, "truck_type": 1, "deliveries": 1, "commission": 1}
+        ).to_list(None)
+
+    # ----- leaderboard -----
+
+    async def leaderboard(self, field: str, limit: int) -> List[dict]:
+        return await self.db[self.STATS_COLLECTION].aggregate(self.leaderboard_pipeline(field, limit)).to_list(None)
+
+    async def rank_of(self, user_id: str, field: str):
+        stats, admins = await asyncio.gather(
+            self.get_user_stats(user_id),
+            self.db.users.distinct("id", {"role": {"$nin": FLEET_ROLES}})
+        )
+        value = stat_value(stats, field)
+        # Counted on the leaderboard index; the few admins are left out by id rather than by a join
+        ahead = await self.db[self.STATS_COLLECTION].count_documents(
+            {field: {"$gt": value}, "userId": {"$nin": admins}}
+        )
+        return ahead + 1, value
+
+    async def fleet_size(self) -> int:
+        return await self.db.users.count_documents({"role": {"$in": FLEET_ROLES}})
+
+    # ----- delivery events -----
+
+    async def _acquire_lease(self, name: str, seconds: int) -> bool:
+        """Take the lease `name` for `seconds` unless another process holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.counters.find_one_and_update(
+                {"_id": name, "$or": [
+                    {"leaseUntil": {"$lt": now.isoformat()}},
+                    {"owner": self.instance_id}
+                ]},
+                {"$set": {
+                    "owner": self.instance_id,
+                    "leaseUntil": (now + timedelta(seconds=seconds)).isoformat()
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another process holds an unexpired lease
+            return False
+        return True
+
+    async def _release_lease(self, name: str):
+        await self.db.counters.update_one(
+            {"_id": name, "owner": self.instance_id},
+            {"$set": {"leaseUntil": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def compact_delivery_events(self, before: str) -> int:
+        if not await self._acquire_lease(COMPACTION_LEASE_ID, COMPACTION_LEASE_SECONDS):
+            return 0
+        try:
+            # Events are claimed by a run, folded, then deleted. A run that died after claiming
+            # is finished first; checkpoints remember their runs, so it is never counted twice.
+            unfinished = await self.db.delivery_events.distinct("compactedBy", {"compactedBy": {"$exists": True}})
+            run = uuid.uuid4().hex
+            await self.db.delivery_events.update_many(
+                {"createdAt": {"$lt": before}, "compactedBy": {"$exists": False}},
+                {"$set": {"compactedBy": run}}
+            )
+
+            folded = 0
+            for run_id in [*unfinished, run]:
+                await self.db.delivery_events.aggregate(self.checkpoint_events_pipeline(run_id)).to_list(None)
+                result = await self.db.delivery_events.delete_many({"compactedBy": run_id})
+                folded += result.deleted_count
+            return folded
+        finally:
+            await self._release_lease(COMPACTION_LEASE_ID)
+
+    # ----- history and versions -----
+
+    async def history(self, start: Optional[str] = None, end: Optional[str] = None,
+                      user_id: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        query = {}
+        if user_id is not None:
+            query["userId"] = user_id
+        period = {}
+        if start:
+            period["$gte"] = start
+        if end:
+            period["$lte"] = end
+        if period:
+            query["period"] = period
+
+        projection = {"_id": 0}
+        if fields is not None:
+            projection.update({field: 1 for field in fields})
+        return await self.db.delivery_history.find(query, projection).sort(
+            [("period", 1), ("username", 1)]
+        ).to_list(None)
+
+    async def fleet_version(self) -> int:
+        doc = await self.db.counters.find_one({"_id": "fleet"})
+        return doc["version"] if doc else 0
+
+    async def bump_fleet_version(self):
+        await self.db.counters.update_one({"_id": "fleet"}, {"$inc": {"version": 1}}, upsert=True)
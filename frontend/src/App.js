@@ -1,4 +1,5 @@
 import { useState, useEffect } from "react";
+import axios from "axios";
 import "@/App.css";
 import { BrowserRouter, Routes, Route, Navigate } from "react-router-dom";
 import Login from "@/pages/Login";
@@ -6,6 +7,9 @@ import UserDashboard from "@/pages/UserDashboard";
 import AdminDashboard from "@/pages/AdminDashboard";
 import { Toaster } from "@/components/ui/sonner";
 
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
 function App() {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -21,16 +25,64 @@ function App() {
     setLoading(false);
   }, []);
 
-  const handleLogin = (token, userData) => {
+  useEffect(() => {
+    // Access tokens expire; on a 401 swap the refresh token for a new pair and retry once
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refresh_token');
+        const isAuthCall = ["login", "register", "refresh"].some(
+          (path) => original?.url === `${API}/auth/${path}`
+        );
+
+        if (error.response?.status !== 401 || !refreshToken || isAuthCall || original._retried) {
+          return Promise.reject(error);
+        }
+
+        try {
+          const response = await axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken });
+          localStorage.setItem('token', response.data.token);
+          localStorage.setItem('refresh_token', response.data.refresh_token);
+          original._retried = true;
+          original.headers.Authorization = `Bearer ${response.data.token}`;
+          return axios(original);
+        } catch (refreshError) {
+          clearSession();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
+  const clearSession = () => {
+    localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
+    localStorage.removeItem('user');
+    setUser(null);
+  };
+
+  const handleLogin = (token, userData, refreshToken) => {
     localStorage.setItem('token', token);
+    if (refreshToken) {
+      localStorage.setItem('refresh_token', refreshToken);
+    }
     localStorage.setItem('user', JSON.stringify(userData));
     setUser(userData);
   };
 
   const handleLogout = () => {
-    localStorage.removeItem('token');
-    localStorage.removeItem('user');
-    setUser(null);
+    const token = localStorage.getItem('token');
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (token) {
+      axios.post(
+        `${API}/auth/logout`,
+        { refresh_token: refreshToken },
+        { headers: { Authorization: `Bearer ${token}` } }
+      ).catch(() => {});
+    }
+    clearSession();
   };
 
   if (loading) {
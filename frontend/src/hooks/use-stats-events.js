@@ -0,0 +1,58 @@
+import { useEffect, useRef } from "react";
+import axios from "axios";
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+const RECONNECT_DELAY = 5000;
+
+// Subscribe to live stats changes pushed by the server.
+// After a dropped connection the handler receives { type: "resync" } so the
+// caller can refetch anything it may have missed.
+export function useStatsEvents(onEvent) {
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+
+  useEffect(() => {
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+    let reconnecting = false;
+
+    const connect = () => {
+      const token = localStorage.getItem('token');
+      if (!token || closed) return;
+
+      source = new EventSource(`${API}/deliveries/events?token=${encodeURIComponent(token)}`);
+      source.onopen = () => {
+        if (reconnecting) {
+          reconnecting = false;
+          handlerRef.current({ type: "resync" });
+        }
+      };
+      source.onmessage = (event) => handlerRef.current(JSON.parse(event.data));
+      source.onerror = () => {
+        // Reconnect ourselves so an expired access token can be refreshed first
+        source.close();
+        reconnecting = true;
+        retryTimer = setTimeout(async () => {
+          try {
+            await axios.get(`${API}/auth/me`, {
+              headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
+            });
+          } catch (error) {
+            // The refresh interceptor has already done what it can
+          }
+          connect();
+        }, RECONNECT_DELAY);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  }, []);
+}
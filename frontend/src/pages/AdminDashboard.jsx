@@ -25,6 +25,7 @@ import {
   AlertDialogTitle,
   AlertDialogTrigger,
 } from "@/components/ui/alert-dialog";
+import { useStatsEvents } from "@/hooks/use-stats-events";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -37,6 +38,7 @@ const AdminDashboard = ({ user, onLogout }) => {
   const [selectedUser, setSelectedUser] = useState(null);
   const [deliveryUpdates, setDeliveryUpdates] = useState({});
   const [dialogOpen, setDialogOpen] = useState(false);
+  const [resetPeriod, setResetPeriod] = useState(new Date().toISOString().slice(0, 7));
 
   useEffect(() => {
     fetchUsers();
@@ -56,33 +58,104 @@ const AdminDashboard = ({ user, onLogout }) => {
     }
   };
 
+  // Merge recomputed stats for the given users into the list without reloading it
+  const applyUserStats = (updatedUsers) => {
+    const byId = Object.fromEntries(updatedUsers.map((updated) => [updated.id, updated]));
+    setUsers((current) => current.map((existing) => (
+      byId[existing.id] ? { ...existing, ...byId[existing.id] } : existing
+    )));
+  };
+
+  // Like applyUserStats, but also appends users that were just created
+  const upsertUsers = (updatedUsers) => {
+    setUsers((current) => {
+      const known = new Set(current.map((existing) => existing.id));
+      const byId = Object.fromEntries(updatedUsers.map((updated) => [updated.id, updated]));
+      return [
+        ...current.map((existing) => (byId[existing.id] ? { ...existing, ...byId[existing.id] } : existing)),
+        ...updatedUsers.filter((updated) => !known.has(updated.id)),
+      ];
+    });
+  };
+
+  const resetAllStats = () => {
+    setUsers((current) => current.map((existing) => ({
+      ...existing,
+      total_deliveries: 0,
+      total_commission: 0,
+      deliveries_by_truck: Object.fromEntries(TRUCK_TYPES.map((truck) => [truck, 0])),
+    })));
+  };
+
+  // Live updates pushed by the server, including edits made by other admins
+  useStatsEvents((event) => {
+    if (event.type === "stats") {
+      upsertUsers(event.users);
+    } else if (event.type === "reset") {
+      resetAllStats();
+    } else if (event.type === "resync") {
+      fetchUsers();
+    }
+  });
+
   const handleUpdateDelivery = async (userId, truckType) => {
     const count = deliveryUpdates[`${userId}-${truckType}`] || 0;
     
     try {
       const token = localStorage.getItem('token');
-      await axios.post(
+      const response = await axios.post(
         `${API}/deliveries/update`,
         { userId, truck_type: truckType, count: parseInt(count) },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       toast.success(`Updated ${truckType} deliveries`);
-      fetchUsers();
+      applyUserStats([{ id: userId, ...response.data.stats }]);
     } catch (error) {
       toast.error("Failed to update delivery");
     }
   };
 
+  const handleSaveAll = async (userToUpdate) => {
+    const updates = TRUCK_TYPES
+      .map((truck) => ({
+        userId: userToUpdate.id,
+        truck_type: truck,
+        count: parseInt(deliveryUpdates[`${userToUpdate.id}-${truck}`] || 0),
+      }))
+      .filter((update) => update.count !== (userToUpdate.deliveries_by_truck[update.truck_type] || 0));
+
+    if (updates.length === 0) {
+      setDialogOpen(false);
+      setSelectedUser(null);
+      return;
+    }
+
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.post(
+        `${API}/deliveries/update-batch`,
+        { updates },
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      toast.success(`Updated ${updates.length} truck types for ${userToUpdate.username}`);
+      applyUserStats(response.data.users);
+      setDialogOpen(false);
+      setSelectedUser(null);
+    } catch (error) {
+      toast.error("Failed to update deliveries");
+    }
+  };
+
   const handleResetMonth = async () => {
     try {
       const token = localStorage.getItem('token');
       await axios.post(
         `${API}/deliveries/reset-month`,
-        {},
+        { period: resetPeriod },
         { headers: { Authorization: `Bearer ${token}` } }
       );
-      toast.success("All deliveries reset for the new month");
-      fetchUsers();
+      toast.success(`Archived ${resetPeriod} and reset all deliveries`);
+      resetAllStats();
     } catch (error) {
       toast.error("Failed to reset month");
     }
@@ -138,9 +211,19 @@ const AdminDashboard = ({ user, onLogout }) => {
                   <AlertDialogHeader>
                     <AlertDialogTitle>Reset Month Deliveries?</AlertDialogTitle>
                     <AlertDialogDescription>
-                      This will reset all delivery counts to 0 for all users. This action cannot be undone.
+                      Current totals will be archived under the month below, then all delivery counts will be reset to 0 for all users.
                     </AlertDialogDescription>
                   </AlertDialogHeader>
+                  <div className="space-y-2">
+                    <Label htmlFor="reset-period">Month being closed</Label>
+                    <Input
+                      id="reset-period"
+                      type="month"
+                      value={resetPeriod}
+                      onChange={(e) => setResetPeriod(e.target.value)}
+                      data-testid="reset-period-input"
+                    />
+                  </div>
                   <AlertDialogFooter>
                     <AlertDialogCancel data-testid="reset-cancel-button">Cancel</AlertDialogCancel>
                     <AlertDialogAction 
@@ -273,6 +356,13 @@ const AdminDashboard = ({ user, onLogout }) => {
                 </div>
               ))}
             </div>
+            <Button
+              onClick={() => handleSaveAll(selectedUser)}
+              className="w-full bg-indigo-600 hover:bg-indigo-700"
+              data-testid={`save-all-${selectedUser.username}-button`}
+            >
+              Save All
+            </Button>
           </DialogContent>
         </Dialog>
       )}
@@ -23,7 +23,7 @@ const Login = ({ onLogin }) => {
     try {
       const response = await axios.post(`${API}/auth/login`, loginData);
       toast.success("Login successful!");
-      onLogin(response.data.token, response.data.user);
+      onLogin(response.data.token, response.data.user, response.data.refresh_token);
     } catch (error) {
       toast.error(error.response?.data?.detail || "Login failed. Please try again.");
     } finally {
@@ -38,7 +38,7 @@ const Login = ({ onLogin }) => {
     try {
       const response = await axios.post(`${API}/auth/register`, registerData);
       toast.success("Registration successful!");
-      onLogin(response.data.token, response.data.user);
+      onLogin(response.data.token, response.data.user, response.data.refresh_token);
     } catch (error) {
       toast.error(error.response?.data?.detail || "Registration failed. Please try again.");
     } finally {
@@ -3,19 +3,43 @@ import axios from "axios";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { toast } from "sonner";
-import { LogOut, TruckIcon, DollarSign, Package } from "lucide-react";
+import { LogOut, TruckIcon, DollarSign, Package, Trophy } from "lucide-react";
+import { useStatsEvents } from "@/hooks/use-stats-events";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
 const UserDashboard = ({ user, onLogout }) => {
   const [stats, setStats] = useState(null);
+  const [rank, setRank] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     fetchStats();
+    fetchRank();
   }, []);
 
+  // Live updates pushed by the server when an admin edits or resets deliveries
+  useStatsEvents((event) => {
+    if (event.type === "stats") {
+      setStats(event.stats);
+      fetchRank();
+    } else if (event.type === "reset") {
+      setStats((current) => current && {
+        ...current,
+        total_deliveries: 0,
+        total_commission: 0,
+        deliveries_by_truck: Object.fromEntries(
+          Object.keys(current.deliveries_by_truck).map((truck) => [truck, 0])
+        ),
+      });
+      fetchRank();
+    } else if (event.type === "resync") {
+      fetchStats();
+      fetchRank();
+    }
+  });
+
   const fetchStats = async () => {
     try {
       const token = localStorage.getItem('token');
@@ -30,6 +54,19 @@ const UserDashboard = ({ user, onLogout }) => {
     }
   };
 
+  // Position on the commission leaderboard; the dashboard works without it
+  const fetchRank = async () => {
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API}/deliveries/rank`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setRank(response.data);
+    } catch (error) {
+      setRank(null);
+    }
+  };
+
   if (loading) {
     return (
       <div className="min-h-screen flex items-center justify-center bg-gradient-to-br from-blue-50 to-indigo-100">
@@ -74,7 +111,7 @@ const UserDashboard = ({ user, onLogout }) => {
         </div>
 
         {/* Stats Cards */}
-        <div className="grid grid-cols-1 md:grid-cols-2 gap-6 mb-8">
+        <div className="grid grid-cols-1 md:grid-cols-3 gap-6 mb-8">
           <Card className="bg-white/80 backdrop-blur-sm border-0 shadow-lg hover:shadow-xl transition-shadow" data-testid="total-deliveries-card">
             <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
               <CardTitle className="text-sm font-medium text-gray-600">Total Deliveries</CardTitle>
@@ -100,6 +137,21 @@ const UserDashboard = ({ user, onLogout }) => {
               <p className="text-xs text-indigo-100 mt-2">Current month earnings</p>
             </CardContent>
           </Card>
+
+          <Card className="bg-white/80 backdrop-blur-sm border-0 shadow-lg hover:shadow-xl transition-shadow" data-testid="rank-card">
+            <CardHeader className="flex flex-row items-center justify-between space-y-0 pb-2">
+              <CardTitle className="text-sm font-medium text-gray-600">Your Rank</CardTitle>
+              <Trophy className="h-5 w-5 text-indigo-600" />
+            </CardHeader>
+            <CardContent>
+              <div className="text-4xl font-bold text-gray-900" data-testid="rank-position">
+                {rank ? `#${rank.rank}` : "-"}
+              </div>
+              <p className="text-xs text-gray-500 mt-2">
+                {rank ? `of ${rank.fleet_size} by commission this month` : "Ranking unavailable"}
+              </p>
+            </CardContent>
+          </Card>
         </div>
 
         {/* Deliveries by Truck Type */}
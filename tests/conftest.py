@@ -0,0 +1,77 @@
+"""
+Fixtures for the API tests: the app from backend/server.py running on the
+in-memory storage backend, so no database is needed.
+
+Each test gets empty storage and fresh token revocations and login throttles;
+the app itself (and its lifespan) is shared by the whole session.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# Set before server is imported: its settings are read at import time
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["EVENT_COMPACTION_INTERVAL"] = "0"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "fleettrack_test")
+sys.path.insert(0, str(BACKEND_DIR))
+
+PASSWORD = "test-password"
+
+
+@pytest.fixture(scope="session")
+def server():
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def app_client(server):
+    from fastapi.testclient import TestClient
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(app_client, server, monkeypatch):
+    from admission import TokenBuckets
+    from revocation import RevocationList
+    from storage import create_storage
+
+    storage = create_storage({"STORAGE_BACKEND": "memory"}, server.COMMISSION_RATES, server.TRUCK_TYPES)
+    app_client.portal.call(storage.startup)
+    monkeypatch.setattr(server, "storage", storage)
+    monkeypatch.setattr(server, "revoked_tokens", RevocationList())
+    for name in ("login_username_buckets", "login_ip_buckets"):
+        buckets = getattr(server, name)
+        monkeypatch.setattr(server, name, TokenBuckets(rate=buckets.rate, burst=buckets.burst))
+    return app_client
+
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def register(client):
+    """Register a user and return the response body (tokens and user)"""
+    def register(username: str, role: str = "driver") -> dict:
+        response = client.post("/api/auth/register", json={"username": username, "password": PASSWORD, "role": role})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return register
+
+
+@pytest.fixture
+def admin(register) -> dict:
+    return register("admin", "admin")
+
+
+@pytest.fixture
+def admin_headers(admin) -> dict:
+    return auth(admin["token"])
@@ -0,0 +1,159 @@
+"""
+The parts of MongoDB that the Mongo storage backends use and mongomock lacks.
+
+Importing this module patches mongomock in place: the $merge, $replaceWith
+and pipeline $lookup stages, the $round, $toDouble, $substrBytes and
+$mergeObjects expressions, copies (not references) in $set, bulk updates
+that carry a sort (pymongo 4.x passes one), and a yield to the event loop
+before every collection call so concurrent tasks interleave. Only what
+backend/storage needs is covered, closely enough for its tests; set
+TEST_MONGO_URL to run the same tests against a real server.
+"""
+import asyncio
+import copy
+import inspect
+
+import mongomock.aggregate as aggregate
+import mongomock.collection as collection
+import mongomock_motor
+from mongomock import OperationFailure, helpers
+
+_parse = aggregate._Parser.parse
+_lookup_stage = aggregate._PIPELINE_HANDLERS["$lookup"]
+_add_fields_stage = aggregate._PIPELINE_HANDLERS["$set"]
+_add_update = collection.BulkOperationBuilder.add_update
+
+
+def _get(doc: dict, path: str):
+    try:
+        return helpers.get_value_by_dot(doc, path)
+    except KeyError:
+        return None
+
+
+def _parse_extended(self, expression):
+    if isinstance(expression, dict) and len(expression) == 1:
+        (operator, value), = expression.items()
+        if operator == "$round":
+            number, places = value if isinstance(value, list) else (value, 0)
+            number = self._parse_or_nothing(number)
+            return round(number, places) if isinstance(number, (int, float)) else None
+        if operator == "$toDouble":
+            number = self._parse_or_nothing(value)
+            return float(number) if isinstance(number, (int, float)) else None
+        if operator == "$substrBytes":
+            string, start, length = self.parse_many(value)
+            return string.encode()[start:start + length].decode() if isinstance(string, str) else ""
+        if operator == "$mergeObjects":
+            merged = {}
+            for part in self.parse_many(value if isinstance(value, list) else [value]):
+                if isinstance(part, dict):
+                    merged.update(part)
+            return merged
+    return _parse(self, expression)
+
+
+def _unshared(value):
+    """A copy of `value` in which no two fields share a nested document or array"""
+    if isinstance(value, dict):
+        return {key: _unshared(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unshared(item) for item in value]
+    return value
+
+
+def _add_fields_unshared_stage(in_collection, database, options):
+    # mongomock assigns the value of `{"copy": "$field"}` by reference, so a later stage
+    # changing `field` would change `copy` too; MongoDB stores a copy
+    return [_unshared(doc) for doc in _add_fields_stage(in_collection, database, options)]
+
+
+def _bind(value, name: str, doc: dict):
+    """`value` with every "$$name" and "$$name.path" replaced by that part of `doc`"""
+    if isinstance(value, str):
+        if value == f"$${name}":
+            return {"$literal": copy.deepcopy(doc)}
+        if value.startswith(f"$${name}."):
+            return {"$literal": copy.deepcopy(_get(doc, value[len(name) + 3:]))}
+        return value
+    if isinstance(value, list):
+        return [_bind(item, name, doc) for item in value]
+    if isinstance(value, dict):
+        return {key: _bind(item, name, doc) for key, item in value.items()}
+    return value
+
+
+def _merge_stage(in_collection, database, options):
+    target = database.get_collection(options["into"])
+    on = options.get("on", "_id")
+    on = [on] if isinstance(on, str) else on
+    when_matched = options.get("whenMatched", "merge")
+    when_not_matched = options.get("whenNotMatched", "insert")
+
+    for doc in in_collection:
+        existing = target.find_one({field: _get(doc, field) for field in on})
+        if existing is None:
+            if when_not_matched == "insert":
+                target.insert_one(dict(doc))
+            elif when_not_matched == "fail":
+                raise OperationFailure("$merge found no matching document")
+            continue
+
+        if isinstance(when_matched, list):
+            [updated] = aggregate.process_pipeline([existing], database, _bind(when_matched, "new", doc), None)
+        elif when_matched == "merge":
+            updated = {**existing, **doc}
+        elif when_matched == "replace":
+            updated = dict(doc)
+        elif when_matched == "keepExisting":
+            continue
+        else:
+            raise OperationFailure("$merge found a matching document")
+        updated["_id"] = existing["_id"]
+        target.replace_one({"_id": existing["_id"]}, updated)
+    return []
+
+
+def _lookup_pipeline_stage(in_collection, database, options):
+    if "pipeline" not in options:
+        return _lookup_stage(in_collection, database, options)
+    foreign = database.get_collection(options["from"])
+    for doc in in_collection:
+        query = {}
+        if "localField" in options:
+            local = _get(doc, options["localField"])
+            query = {options["foreignField"]: {"$in": local} if isinstance(local, list) else local}
+        matches = list(foreign.find(query))
+        doc[options["as"]] = list(aggregate.process_pipeline(matches, database, options["pipeline"], None))
+    return in_collection
+
+
+def _add_update_without_sort(self, *args, sort=None, **kwargs):
+    return _add_update(self, *args, **kwargs)
+
+
+def _yielding(method):
+    # Each call yields to the event loop first, as a round trip to a server would, so that
+    # concurrent tasks interleave between operations (each operation itself stays atomic)
+    async def call(*args, **kwargs):
+        await asyncio.sleep(0)
+        return await method(*args, **kwargs)
+    return call
+
+
+for _name, _method in inspect.getmembers(mongomock_motor.AsyncMongoMockCollection, inspect.iscoroutinefunction):
+    if not _name.startswith("_"):
+        setattr(mongomock_motor.AsyncMongoMockCollection, _name, _yielding(_method))
+
+
+aggregate._Parser.parse = _parse_extended
+aggregate._PIPELINE_HANDLERS.update({
+    "$addFields": _add_fields_unshared_stage,
+    "$set": _add_fields_unshared_stage,
+    "$merge": _merge_stage,
+    "$replaceWith": lambda in_collection, database, options: aggregate._handle_replace_root_stage(
+        in_collection, database, {"newRoot": options}
+    ),
+    "$lookup": _lookup_pipeline_stage,
+})
+collection.BulkOperationBuilder.add_update = _add_update_without_sort
@@ -0,0 +1,137 @@
+"""Token refresh and revocation, event stream tickets, login throttling and admission control"""
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from .conftest import PASSWORD, auth
+
+
+def test_refresh_rotates_and_is_single_use(client, register):
+    driver = register("driver")
+    response = client.post("/api/auth/refresh", json={"refresh_token": driver["refresh_token"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user"] == driver["user"]
+    assert body["refresh_token"] != driver["refresh_token"]
+    assert client.get("/api/auth/me", headers=auth(body["token"])).status_code == 200
+
+    # The used refresh token is revoked; the new one still works
+    assert client.post("/api/auth/refresh", json={"refresh_token": driver["refresh_token"]}).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": body["refresh_token"]}).status_code == 200
+
+
+def test_tokens_are_not_interchangeable(client, register):
+    driver = register("driver")
+    assert client.get("/api/auth/me", headers=auth(driver["refresh_token"])).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": driver["token"]}).status_code == 401
+
+
+def test_logout_revokes_access_and_refresh_tokens(client, register):
+    driver = register("driver")
+    headers = auth(driver["token"])
+    response = client.post("/api/auth/logout", headers=headers, json={"refresh_token": driver["refresh_token"]})
+    assert response.status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    assert client.post("/api/auth/refresh", json={"refresh_token": driver["refresh_token"]}).status_code == 401
+
+
+def test_access_tokens_must_carry_username_and_role(client, server, register):
+    driver = register("driver")
+    token = server.create_token({"sub": driver["user"]["id"]}, "access", timedelta(minutes=1))
+    assert client.get("/api/auth/me", headers=auth(token)).status_code == 401
+
+
+def open_events(client, ticket: str):
+    """Read the stats event stream to its end; returns the status and the lines received"""
+    with client.stream("GET", "/api/deliveries/events", params={"ticket": ticket}) as response:
+        return response.status_code, [line for line in response.iter_lines() if line]
+
+
+def test_events_ticket_is_single_use_and_ends_with_the_access_token(client, server, register, monkeypatch):
+    driver = register("driver")
+    claims = {"sub": driver["user"]["id"], "username": "driver", "role": "driver"}
+    token = server.create_token(claims, "access", timedelta(seconds=1))
+    ticket = client.post("/api/deliveries/events/ticket", headers=auth(token)).json()["ticket"]
+    monkeypatch.setattr(server, "EVENTS_KEEPALIVE_SECONDS", 0.1)
+
+    started = time.monotonic()
+    status, lines = open_events(client, ticket)
+    assert status == 200 and lines[0] == "retry: 5000"
+    assert time.monotonic() - started < 3
+    assert open_events(client, ticket)[0] == 401
+    # The access token itself does not open the stream
+    assert open_events(client, driver["token"])[0] == 401
+
+
+def test_events_stream_closes_when_the_access_token_is_revoked(client, server, register, monkeypatch):
+    driver = register("driver")
+    headers = auth(driver["token"])
+    tickets = [client.post("/api/deliveries/events/ticket", headers=headers).json()["ticket"] for _ in range(2)]
+    monkeypatch.setattr(server, "EVENTS_KEEPALIVE_SECONDS", 0.1)
+
+    claims = server.decode_token(driver["token"], "access")
+    timer = threading.Timer(0.5, server.revoke_token, [claims])
+    timer.start()
+    started = time.monotonic()
+    status, lines = open_events(client, tickets[0])
+    timer.join()
+    assert status == 200 and ": keepalive" in lines
+    assert time.monotonic() - started < 3
+    # Tickets issued before the logout are refused too
+    assert open_events(client, tickets[1])[0] == 401
+
+
+def test_login_is_throttled_per_username(client, server, register):
+    register("driver")
+    burst = server.login_username_buckets.burst
+    for _ in range(burst):
+        response = client.post("/api/auth/login", json={"username": "driver", "password": "wrong"})
+        assert response.status_code == 401
+
+    # Even the right password is refused until the bucket refills
+    response = client.post("/api/auth/login", json={"username": "driver", "password": PASSWORD})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+    # Other usernames are unaffected
+    register("helper", "helper")
+    assert client.post("/api/auth/login", json={"username": "helper", "password": PASSWORD}).status_code == 200
+
+
+def test_login_ip_throttle_ignores_forged_forwarded_for(client, server, monkeypatch):
+    from admission import TokenBuckets
+
+    monkeypatch.setattr(server, "TRUSTED_PROXY_HOPS", 1)
+    monkeypatch.setattr(server, "login_ip_buckets", TokenBuckets(rate=0.01, burst=2))
+    # The proxy appends the address it saw; whatever the client put before it changes every time
+    for i, expected in enumerate((401, 401, 429)):
+        headers = {"X-Forwarded-For": f"10.0.0.{i}, 203.0.113.7"}
+        response = client.post("/api/auth/login", headers=headers, json={"username": f"user{i}", "password": "x"})
+        assert response.status_code == expected
+
+    headers = {"X-Forwarded-For": "203.0.113.7, 198.51.100.1"}
+    assert client.post("/api/auth/login", headers=headers, json={"username": "user", "password": "x"}).status_code == 401
+
+
+@pytest.fixture
+def saturated_fleet_admission(client, server, monkeypatch):
+    """A fleet limiter whose only slot is taken and which queues nothing"""
+    from admission import AdmissionLimiter
+
+    limiter = AdmissionLimiter("fleet", concurrency=1, queue_limit=0, queue_timeout=1)
+    monkeypatch.setitem(server.ADMISSION_ROUTES, ("GET", "/api/deliveries/history"), limiter)
+    acquired_at = client.portal.call(limiter.acquire)
+    yield limiter
+    limiter.release(acquired_at)
+
+
+def test_admission_sheds_load_with_503(client, admin_headers, saturated_fleet_admission):
+    response = client.get("/api/deliveries/history", headers=admin_headers)
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) >= 1
+    assert saturated_fleet_admission.snapshot()["rejected"] == 1
+
+    # Routes outside every admission class are never limited
+    assert client.get("/api/auth/me", headers=admin_headers).status_code == 200
@@ -0,0 +1,214 @@
+"""Delivery writes and the reports built on them: batch updates, monthly history, payroll, leaderboard and rollups"""
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from .conftest import PASSWORD, auth
+
+
+@pytest.fixture
+def fleet(client, register, admin_headers):
+    """Two drivers and a helper with some deliveries: commission 35.0, 22.5 and 10.0"""
+    users = {name: register(name, role)["user"] for name, role in
+             (("ann", "driver"), ("ben", "driver"), ("cat", "helper"))}
+    updates = [
+        {"userId": users["ann"]["id"], "truck_type": "BKO", "count": 10},
+        {"userId": users["ben"]["id"], "truck_type": "GKY", "count": 3},
+        {"userId": users["cat"]["id"], "truck_type": "AUA", "count": 1},
+    ]
+    response = client.post("/api/deliveries/update-batch", headers=admin_headers, json={"updates": updates})
+    assert response.status_code == 200
+    return users
+
+
+def stats_by_name(client, admin_headers) -> dict:
+    users = client.get("/api/deliveries/all-users", headers=admin_headers).json()["users"]
+    return {user["username"]: user for user in users}
+
+
+def test_batch_update_sets_counts_and_stats(client, admin_headers, fleet):
+    stats = stats_by_name(client, admin_headers)
+    assert stats["ann"]["total_deliveries"] == 10
+    assert stats["ann"]["total_commission"] == 35.0
+    assert stats["ben"]["deliveries_by_truck"]["GKY"] == 3
+    assert stats["cat"]["total_commission"] == 10.0
+
+    updates = [
+        {"userId": fleet["ann"]["id"], "truck_type": "BKO", "count": 4},
+        {"userId": fleet["ann"]["id"], "truck_type": "GKY", "count": 2},
+    ]
+    body = client.post("/api/deliveries/update-batch", headers=admin_headers, json={"updates": updates}).json()
+    assert [(user["username"], user["total_deliveries"]) for user in body["users"]] == [("ann", 6)]
+
+
+def test_batch_update_validates_before_writing(client, admin, admin_headers, fleet):
+    bad_truck = [{"userId": fleet["ann"]["id"], "truck_type": "XXX", "count": 1}]
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers,
+                       json={"updates": bad_truck}).status_code == 400
+    unknown_user = [
+        {"userId": fleet["ann"]["id"], "truck_type": "BKO", "count": 99},
+        {"userId": "nobody", "truck_type": "BKO", "count": 1},
+    ]
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers,
+                       json={"updates": unknown_user}).status_code == 404
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers, json={"updates": []}).status_code == 400
+    for_admin = [{"userId": admin["user"]["id"], "truck_type": "BKO", "count": 1}]
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers,
+                       json={"updates": for_admin}).status_code == 400
+    assert client.post("/api/deliveries/update", headers=admin_headers, json=for_admin[0]).status_code == 400
+    duplicate = [{"userId": fleet["ann"]["id"], "truck_type": "BKO", "count": count} for count in (4, 2)]
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers,
+                       json={"updates": duplicate}).status_code == 400
+    too_many = [{"userId": fleet["ann"]["id"], "truck_type": "BKO", "count": 1}] * 1001
+    assert client.post("/api/deliveries/update-batch", headers=admin_headers,
+                       json={"updates": too_many}).status_code == 422
+    assert stats_by_name(client, admin_headers)["ann"]["total_deliveries"] == 10
+
+
+def test_reset_month_archives_history(client, admin_headers, fleet):
+    response = client.post("/api/deliveries/reset-month", headers=admin_headers, json={"period": "2024-03"})
+    assert response.status_code == 200
+    assert response.json()["archived_period"] == "2024-03"
+    assert all(user["total_deliveries"] == 0 for user in stats_by_name(client, admin_headers).values())
+
+    history = client.get("/api/deliveries/history", headers=admin_headers,
+                         params={"from": "2024-01", "to": "2024-12"}).json()["history"]
+    assert {(doc["username"], doc["total_deliveries"]) for doc in history} == {("ann", 10), ("ben", 3), ("cat", 1)}
+    assert client.get("/api/deliveries/history", headers=admin_headers,
+                      params={"from": "2024-04"}).json()["history"] == []
+
+
+def test_user_history_is_private(client, register, fleet):
+    ann = client.post("/api/auth/login", json={"username": "ann", "password": PASSWORD}).json()
+    own = client.get(f"/api/deliveries/history/{fleet['ann']['id']}", headers=auth(ann["token"]))
+    assert own.status_code == 200
+    other = client.get(f"/api/deliveries/history/{fleet['ben']['id']}", headers=auth(ann["token"]))
+    assert other.status_code == 403
+
+
+def test_payroll_current_month(client, admin_headers, fleet):
+    report = client.get("/api/deliveries/payroll", headers=admin_headers, params={"top": 2}).json()
+    assert report["totals"] == {"users": 3, "total_deliveries": 14, "total_commission": 67.5}
+    assert report["by_role"]["driver"] == {"users": 2, "total_deliveries": 13, "total_commission": 57.5}
+    assert report["by_truck"]["GKY"] == {"deliveries": 3, "commission": 22.5}
+    assert [(entry["rank"], entry["username"]) for entry in report["ranking"]] == [(1, "ann"), (2, "ben")]
+    # Per-user figures are columns; index i is the same user in each of them
+    users = report["users"]
+    cat = users["username"].index("cat")
+    assert users["id"][cat] == fleet["cat"]["id"]
+    assert users["deliveries_by_truck"]["AUA"][cat] == 1
+    assert users["total_commission"][cat] == 10.0
+    assert sum(users["total_deliveries"]) == 14
+
+    summary = client.get("/api/deliveries/payroll", headers=admin_headers, params={"include_users": False}).json()
+    assert "users" not in summary
+
+
+def test_payroll_archived_months(client, admin_headers, fleet):
+    client.post("/api/deliveries/reset-month", headers=admin_headers, json={"period": "2024-01"})
+    client.post("/api/deliveries/update", headers=admin_headers,
+                json={"userId": fleet["ben"]["id"], "truck_type": "GKY", "count": 1})
+    client.post("/api/deliveries/reset-month", headers=admin_headers, json={"period": "2024-02"})
+
+    report = client.get("/api/deliveries/payroll", headers=admin_headers,
+                        params={"from": "2024-01", "to": "2024-02"}).json()
+    assert report["by_period"] == {
+        "2024-01": {"total_deliveries": 14, "total_commission": 67.5},
+        "2024-02": {"total_deliveries": 1, "total_commission": 7.5},
+    }
+    # One column entry per user, across both months
+    assert report["totals"]["users"] == 3
+    ben = report["users"]["username"].index("ben")
+    assert report["users"]["total_deliveries"][ben] == 4
+    assert report["users"]["deliveries_by_truck"]["GKY"][ben] == 4
+
+
+def test_leaderboard_and_rank(client, register, admin_headers, fleet):
+    # dan ties with ann on commission
+    dan = register("dan")
+    client.post("/api/deliveries/update", headers=admin_headers,
+                json={"userId": dan["user"]["id"], "truck_type": "NYC", "count": 10})
+
+    board = client.get("/api/deliveries/leaderboard", headers=admin_headers, params={"by": "commission"}).json()
+    # Ties are ordered by user id, which is random here
+    assert [(entry["rank"], entry["value"]) for entry in board["entries"]] == [(1, 35.0), (1, 35.0), (3, 22.5), (4, 10.0)]
+    usernames = [entry["username"] for entry in board["entries"]]
+    assert set(usernames[:2]) == {"ann", "dan"} and usernames[2:] == ["ben", "cat"]
+    by_truck = client.get("/api/deliveries/leaderboard", headers=admin_headers,
+                          params={"by": "deliveries", "truck": "GKY", "limit": 1}).json()
+    assert [(entry["username"], entry["value"]) for entry in by_truck["entries"]] == [("ben", 3)]
+
+    rank = client.get("/api/deliveries/rank", headers=auth(dan["token"])).json()
+    assert (rank["rank"], rank["value"], rank["fleet_size"]) == (1, 35.0, 4)
+    cat_rank = client.get("/api/deliveries/rank", headers=admin_headers, params={"userId": fleet["cat"]["id"]}).json()
+    assert cat_rank["rank"] == 4
+
+    assert client.get("/api/deliveries/leaderboard", headers=auth(dan["token"])).status_code == 403
+    assert client.get("/api/deliveries/rank", headers=auth(dan["token"]),
+                      params={"userId": fleet["ann"]["id"]}).status_code == 403
+    assert client.get("/api/deliveries/rank", headers=admin_headers).status_code == 400
+
+
+def test_timeseries_rolls_up_changes(client, admin_headers, fleet):
+    today = datetime.now(timezone.utc).date()
+    ann = client.post("/api/auth/login", json={"username": "ann", "password": PASSWORD}).json()
+    client.post("/api/deliveries/increment", headers=auth(ann["token"]), json={"truck_type": "BKO", "amount": 5})
+    # Lowering a count is a negative change; a reset is not a change at all
+    client.post("/api/deliveries/update", headers=admin_headers,
+                json={"userId": fleet["cat"]["id"], "truck_type": "AUA", "count": 0})
+    client.post("/api/deliveries/reset-month", headers=admin_headers)
+
+    fleet_series = client.get("/api/deliveries/timeseries", headers=admin_headers).json()
+    assert len(fleet_series["buckets"]) == 30
+    assert fleet_series["buckets"][-1] == today.isoformat()
+    assert fleet_series["deliveries"][-1] == 10 + 5 + 3
+    assert fleet_series["commission"][-1] == 52.5 + 22.5
+    assert fleet_series["deliveries_by_truck"]["AUA"][-1] == 0
+
+    own = client.get("/api/deliveries/timeseries", headers=auth(ann["token"]),
+                     params={"granularity": "month", "from": today.isoformat()}).json()
+    assert own["userId"] == fleet["ann"]["id"]
+    assert own["buckets"] == [today.strftime("%Y-%m")]
+    assert own["deliveries"] == [15]
+
+
+def test_timeseries_access_and_range_checks(client, admin_headers, fleet):
+    ann = client.post("/api/auth/login", json={"username": "ann", "password": PASSWORD}).json()
+    headers = auth(ann["token"])
+    assert client.get("/api/deliveries/timeseries", headers=headers,
+                      params={"userId": fleet["ben"]["id"]}).status_code == 403
+    assert client.get("/api/deliveries/timeseries", headers=admin_headers,
+                      params={"userId": "nobody"}).status_code == 404
+    assert client.get("/api/deliveries/timeseries", headers=headers,
+                      params={"from": "2024-02-01", "to": "2024-01-01"}).status_code == 400
+    assert client.get("/api/deliveries/timeseries", headers=headers,
+                      params={"from": "2020-01-01", "to": "2024-01-01"}).status_code == 400
+
+
+@pytest.mark.parametrize("params", [
+    {"from": "0001-01-01", "to": "9000-01-01"},
+    {"granularity": "month", "from": "0001-01-01", "to": "9999-12-31"},
+    {"granularity": "week", "from": "0001-01-01", "to": "9999-12-31"},
+])
+def test_timeseries_rejects_huge_ranges_quickly(client, admin_headers, params):
+    start = time.perf_counter()
+    response = client.get("/api/deliveries/timeseries", headers=admin_headers, params=params)
+    assert response.status_code == 400
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize("params, buckets", [
+    ({"to": "9999-12-31"}, 30),
+    ({"granularity": "month", "from": "9999-01-01", "to": "9999-12-31"}, 12),
+    ({"granularity": "week", "from": "9999-12-20", "to": "9999-12-31"}, 2),
+    ({"granularity": "week", "to": "0001-01-03"}, 1),
+    ({"granularity": "day", "to": "0001-01-05"}, 5),
+    ({"granularity": "month", "to": "0001-03-01"}, 3),
+])
+def test_timeseries_at_the_calendar_limits(client, admin_headers, params, buckets):
+    response = client.get("/api/deliveries/timeseries", headers=admin_headers, params=params)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert len(body["buckets"]) == buckets
+    assert body["buckets"] == sorted(body["buckets"])
@@ -0,0 +1,65 @@
+"""Fleet listing: cursor pagination and ETag revalidation"""
+from .conftest import auth
+
+
+def test_all_users_pages_with_cursor(client, register, admin_headers):
+    for i in range(5):
+        register(f"driver{i}")
+
+    usernames = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/deliveries/all-users", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        body = response.json()
+        usernames += [user["username"] for user in body["users"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    # Admins are not part of the fleet listing
+    assert sorted(usernames) == [f"driver{i}" for i in range(5)]
+    assert pages == 3
+
+
+def test_all_users_without_limit_has_no_cursor(client, register, admin_headers):
+    register("driver")
+    body = client.get("/api/deliveries/all-users", headers=admin_headers).json()
+    assert [user["username"] for user in body["users"]] == ["driver"]
+    assert "next_cursor" not in body
+
+
+def test_invalid_cursor_is_rejected(client, admin_headers):
+    response = client.get("/api/deliveries/all-users", params={"limit": 2, "cursor": "bogus"}, headers=admin_headers)
+    assert response.status_code == 400
+
+
+def test_fleet_etag_revalidates_until_a_write(client, register, admin, admin_headers):
+    driver = register("driver")
+    first = client.get("/api/deliveries/all-users", headers=admin_headers)
+    etag = first.headers["etag"]
+
+    cached = client.get("/api/deliveries/all-users", headers={**admin_headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+
+    client.post("/api/deliveries/update", headers=admin_headers,
+                json={"userId": driver["user"]["id"], "truck_type": "BKO", "count": 3})
+    changed = client.get("/api/deliveries/all-users", headers={**admin_headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+
+def test_my_deliveries_etag(client, register, admin_headers):
+    driver = register("driver")
+    headers = auth(driver["token"])
+    etag = client.get("/api/deliveries/my", headers=headers).headers["etag"]
+    assert client.get("/api/deliveries/my", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    client.post("/api/deliveries/increment", headers=headers, json={"truck_type": "GKY", "amount": 2})
+    response = client.get("/api/deliveries/my", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["stats"]["deliveries_by_truck"]["GKY"] == 2
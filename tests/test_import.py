@@ -0,0 +1,78 @@
+"""Bulk user import: JSON and CSV bodies, per-row validation errors"""
+from .conftest import auth
+
+
+def test_json_import_reports_invalid_rows(client, register, admin_headers):
+    register("taken")
+    rows = [
+        {"username": "alice", "password": "pw-alice"},
+        {"username": "bob", "password": "pw-bob", "role": "helper"},
+        {"username": "carol", "password": "pw-carol", "role": "pilot"},
+        {"username": "alice", "password": "again"},
+        {"username": "taken", "password": "pw"},
+        {"username": "dave"},
+        "not an object",
+    ]
+    response = client.post("/api/admin/users/import", headers=admin_headers, json={"users": rows})
+    assert response.status_code == 200
+    body = response.json()
+
+    assert body["imported"] == 2
+    assert {(user["username"], user["role"]) for user in body["users"]} == {("alice", "driver"), ("bob", "helper")}
+    assert [(error["row"], error["error"]) for error in body["errors"]] == [
+        (3, "Invalid role. Must be 'driver', 'helper', or 'admin'"),
+        (4, "Duplicate username in upload"),
+        (5, "Username already exists"),
+        (6, "username and password are required"),
+        (7, "username and password are required"),
+    ]
+
+    login = client.post("/api/auth/login", json={"username": "bob", "password": "pw-bob"})
+    assert login.status_code == 200
+    assert login.json()["user"]["role"] == "helper"
+
+
+def test_csv_import(client, admin_headers):
+    body = "username,password,role\nerin,pw-erin,\nfrank,pw-frank,helper\n"
+    response = client.post("/api/admin/users/import", headers={**admin_headers, "Content-Type": "text/csv"},
+                           content=body.encode())
+    assert response.status_code == 200
+    assert response.json()["imported"] == 2
+
+    fleet = client.get("/api/deliveries/all-users", headers=admin_headers).json()["users"]
+    assert {(user["username"], user["role"]) for user in fleet} == {("erin", "driver"), ("frank", "helper")}
+
+
+def test_import_rejects_empty_username_or_password(client, admin_headers):
+    body = "username,password,role\n,,\ngina,,\n,pw-nobody,\nhank,pw-hank,\n"
+    response = client.post("/api/admin/users/import", headers={**admin_headers, "Content-Type": "text/csv"},
+                           content=body.encode())
+    assert response.status_code == 200
+    assert response.json()["imported"] == 1
+    assert [(error["row"], error["error"]) for error in response.json()["errors"]] == [
+        (1, "username and password are required"),
+        (2, "username and password are required"),
+        (3, "username and password are required"),
+    ]
+
+    rows = [{"username": "", "password": ""}, {"username": "ivan", "password": ""}]
+    response = client.post("/api/admin/users/import", headers=admin_headers, json=rows)
+    assert response.json()["imported"] == 0
+    assert [error["row"] for error in response.json()["errors"]] == [1, 2]
+
+    fleet = client.get("/api/deliveries/all-users", headers=admin_headers).json()["users"]
+    assert [user["username"] for user in fleet] == ["hank"]
+
+
+def test_import_rejects_bad_bodies(client, server, admin_headers):
+    assert client.post("/api/admin/users/import", headers=admin_headers, content=b"{").status_code == 400
+    assert client.post("/api/admin/users/import", headers=admin_headers, json={"users": "x"}).status_code == 400
+
+    rows = [{"username": f"user{i}", "password": "pw"} for i in range(server.MAX_IMPORT_ROWS + 1)]
+    assert client.post("/api/admin/users/import", headers=admin_headers, json=rows).status_code == 400
+
+
+def test_import_requires_admin(client, register):
+    driver = register("driver")
+    response = client.post("/api/admin/users/import", headers=auth(driver["token"]), json=[])
+    assert response.status_code == 403
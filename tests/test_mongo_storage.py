@@ -0,0 +1,225 @@
+"""
+The MongoDB storage backends (rows, dual and compact layouts) called directly.
+
+By default these run on mongomock-motor, patched by mongomock_compat with the
+pipeline stages and operators the backends use. Set TEST_MONGO_URL (e.g.
+mongodb://localhost:27017) to run them against a real server; each test then
+gets its own database, dropped afterwards.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+RATES = {"BKO": 3.5, "GKY": 7.5, "AUA": 10.0}
+TRUCKS = list(RATES)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    url = os.environ.get("TEST_MONGO_URL")
+    if url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(url)
+        name = f"fleettrack_test_{uuid.uuid4().hex[:8]}"
+        yield client[name]
+        await client.drop_database(name)
+        client.close()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        from . import mongomock_compat  # noqa: F401
+        yield AsyncMongoMockClient()["fleettrack_test"]
+
+
+async def make_storage(db, layout: str):
+    from indexes import ensure_indexes
+    from storage.compact import mongo_storage_class
+
+    await ensure_indexes(db, TRUCKS)
+    return mongo_storage_class(layout)(db, RATES, TRUCKS)
+
+
+@pytest.fixture(params=["rows", "dual", "compact"])
+async def storage(request, db):
+    return await make_storage(db, request.param)
+
+
+async def add_users(storage, *names: str, role: str = "driver") -> dict:
+    """Create users (with zeroed counts) and return their ids by name"""
+    users = [
+        {"id": str(uuid.uuid4()), "username": name, "role": role, "password": "x",
+         "createdAt": datetime.now(timezone.utc).isoformat()}
+        for name in names
+    ]
+    assert await storage.insert_users(users) == {}
+    await storage.create_user_deliveries([user["id"] for user in users])
+    return {user["username"]: user["id"] for user in users}
+
+
+async def today_rollups(storage, user_id: str = None) -> dict:
+    today = datetime.now(timezone.utc).date().isoformat()
+    buckets = await storage.delivery_timeseries("day", today, today, user_id)
+    return {bucket["truck_type"]: bucket["deliveries"] for bucket in buckets if bucket["deliveries"]}
+
+
+async def test_writes_keep_stats_and_listing_in_step(storage):
+    ids = await add_users(storage, "ann", "ben")
+    await storage.set_delivery_count(ids["ann"], "BKO", 4)
+    doc = await storage.record_deliveries(ids["ann"], "GKY", 2)
+    assert (doc["total_deliveries"], doc["total_commission"]) == (6, 29.0)
+
+    docs = await storage.set_delivery_counts({(ids["ann"], "BKO"): 1, (ids["ben"], "AUA"): 3})
+    assert docs[ids["ann"]]["deliveries_by_truck"] == {"BKO": 1, "GKY": 2, "AUA": 0}
+    assert docs[ids["ben"]]["total_commission"] == 30.0
+
+    rows, cursor = await storage.fleet_stats_page(limit=1)
+    assert [row["username"] for row in rows] == ["ann"] and cursor is not None
+    rows, _ = await storage.fleet_stats_page(cursor, limit=5)
+    assert [(row["username"], row["total_deliveries"]) for row in rows] == [("ben", 3)]
+    assert (await storage.get_user_stats(ids["ann"]))["total_deliveries"] == 3
+
+
+async def test_rollups_record_each_change(storage):
+    ids = await add_users(storage, "ann")
+    await storage.set_delivery_count(ids["ann"], "BKO", 4)
+    await storage.record_deliveries(ids["ann"], "BKO", 2)
+    await storage.set_delivery_counts({(ids["ann"], "BKO"): 1, (ids["ann"], "GKY"): 2})
+    # +4, +2, then -5: the bucket holds the net change of the day
+    assert await today_rollups(storage, ids["ann"]) == {"BKO": 1, "GKY": 2}
+    assert await today_rollups(storage) == {"BKO": 1, "GKY": 2}
+
+
+async def test_batch_sets_racing_increments_keep_rollups_exact(storage):
+    ids = await add_users(storage, "ann", "ben")
+    cells = [(ids["ann"], "BKO"), (ids["ann"], "GKY"), (ids["ben"], "BKO")]
+    await asyncio.gather(
+        *(storage.set_delivery_counts({cell: count + i for cell in cells}) for i, count in enumerate((5, 2, 7))),
+        *(storage.record_deliveries(user_id, truck, 1) for user_id, truck in cells * 3)
+    )
+
+    counts = {(row["userId"], row["truck_type"]): row["count"] for row in await storage.delivery_rows()}
+    for name, user_id in ids.items():
+        own = {truck: count for (owner, truck), count in counts.items() if owner == user_id}
+        # Every write's change reached the rollups exactly once, so they add up to the counts
+        assert await today_rollups(storage, user_id) == own
+        stats = await storage.get_user_stats(user_id)
+        assert {truck: count for truck, count in stats["deliveries_by_truck"].items() if count} == own
+        assert stats["total_deliveries"] == sum(own.values())
+
+
+async def test_reset_archives_and_zeroes(storage):
+    ids = await add_users(storage, "ann", "ben")
+    await storage.set_delivery_counts({(ids["ann"], "BKO"): 2, (ids["ben"], "GKY"): 1})
+    await storage.reset_month("2024-03")
+    await storage.set_delivery_count(ids["ben"], "GKY", 4)
+    await storage.reset_month("2024-03")
+
+    history = {doc["username"]: doc for doc in await storage.history("2024-03", "2024-03")}
+    assert history["ann"]["total_deliveries"] == 2
+    # Archiving the same period twice adds to the snapshot
+    assert history["ben"]["deliveries_by_truck"]["GKY"] == 5
+    assert history["ben"]["total_commission"] == 37.5
+    for user_id in ids.values():
+        assert (await storage.get_user_stats(user_id))["total_deliveries"] == 0
+    assert await storage.delivery_rows() == []
+
+
+async def test_reset_racing_sets_and_increments(storage, monkeypatch):
+    ids = await add_users(storage, "ann", "ben", "cat")
+    await storage.set_delivery_counts({(ids["ann"], "BKO"): 5, (ids["ben"], "GKY"): 2})
+
+    counts_to_reset = storage.counts_to_reset
+    finish_reset = storage.finish_reset
+
+    async def read_then_race(run, ids_=None):
+        docs = await counts_to_reset(run, ids_)
+        if ids_ is None:
+            # Lands after the counts were read, before they are zeroed
+            await storage.set_delivery_count(ids["ann"], "BKO", 3)
+            await storage.record_deliveries(ids["ben"], "GKY", 4)
+        return docs
+
+    async def race_then_finish(now):
+        # Lands after the counts were zeroed: it belongs to the new month
+        await storage.record_deliveries(ids["cat"], "AUA", 1)
+        await finish_reset(now)
+
+    monkeypatch.setattr(storage, "counts_to_reset", read_then_race)
+    monkeypatch.setattr(storage, "finish_reset", race_then_finish)
+    await storage.reset_month("2024-03")
+
+    history = {doc["username"]: doc["total_deliveries"] for doc in await storage.history("2024-03", "2024-03")}
+    assert history == {"ann": 3, "ben": 6, "cat": 0}
+    stats = {name: await storage.get_user_stats(user_id) for name, user_id in ids.items()}
+    assert [stats[name]["total_deliveries"] for name in ("ann", "ben", "cat")] == [0, 0, 1]
+    assert stats["cat"]["total_commission"] == 10.0
+    assert await storage.delivery_rows() == [{"userId": ids["cat"], "truck_type": "AUA", "count": 1}]
+
+
+async def test_resets_do_not_overlap(db):
+    from storage import ResetInProgress
+
+    first = await make_storage(db, "rows")
+    second = await make_storage(db, "rows")
+    assert await first._acquire_lease("monthly_reset", 60)
+    with pytest.raises(ResetInProgress):
+        await second.reset_month("2024-03")
+    await first._release_lease("monthly_reset")
+    assert await second.reset_month("2024-03") == 0
+
+
+async def test_leaderboard_and_rank(storage):
+    ids = await add_users(storage, "ann", "ben", "cat")
+    admins = await add_users(storage, "root", role="admin")
+    await storage.set_delivery_counts({(ids["ann"], "BKO"): 2, (ids["ben"], "AUA"): 1, (ids["cat"], "GKY"): 1,
+                                       (admins["root"], "AUA"): 5})
+    board = await storage.leaderboard("total_commission", 2)
+    assert [(row["username"], row["total_commission"]) for row in board] == [("ben", 10.0), ("cat", 7.5)]
+    # Admins are neither listed nor counted ahead of anyone
+    assert await storage.rank_of(ids["ann"], "total_commission") == (3, 7.0)
+    assert await storage.fleet_size() == 3
+
+
+async def test_event_compaction_is_leased(db):
+    first = await make_storage(db, "rows")
+    second = await make_storage(db, "rows")
+    ids = await add_users(first, "ann")
+    for amount in (1, 2):
+        await first.record_deliveries(ids["ann"], "BKO", amount)
+
+    assert await first._acquire_lease("event_compactor", 60)
+    assert await second.compact_delivery_events("9999") == 0
+    await first._release_lease("event_compactor")
+
+    assert await second.compact_delivery_events("9999") == 2
+    checkpoints = await db.delivery_checkpoints.find({}, {"_id": 0, "amount": 1, "events": 1}).to_list(None)
+    assert checkpoints == [{"amount": 3, "events": 2}]
+
+
+async def test_compact_migration_and_lazy_backfill(db):
+    from storage.compact import migrate_to_compact
+
+    rows = await make_storage(db, "rows")
+    ids = await add_users(rows, "ann", "ben")
+    await rows.set_delivery_count(ids["ann"], "BKO", 3)
+    await rows.set_delivery_count(ids["ben"], "GKY", 1)
+
+    compact = await make_storage(db, "compact")
+    # Not migrated yet: built from the rows on first access
+    assert (await compact.get_user_stats(ids["ben"]))["total_commission"] == 7.5
+
+    state = await migrate_to_compact(rows, batch_size=1)
+    assert state["migrated"] == 2
+    doc = await db.delivery_counts.find_one({"userId": ids["ann"]})
+    assert (doc["deliveries_by_truck"]["BKO"], doc["total_commission"]) == (3, 10.5)
+    assert await compact.record_deliveries(ids["ann"], "BKO", 1) is not None
+    assert (await compact.get_user_stats(ids["ann"]))["total_deliveries"] == 4
@@ -0,0 +1,20 @@
+"""
+Cold-start budget for the backend, run with `python -m pytest tests`.
+
+Instances on Render sleep when idle, so the time to import the app is part of
+the first response a user sees after a wake-up. The check lives in
+backend/benchmarks/bench_startup.py; this runs it in fresh interpreters.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def test_import_within_budget_and_heavy_modules_lazy():
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--check", "--runs", "3"],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr